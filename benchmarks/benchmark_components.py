@@ -0,0 +1,301 @@
+"""Throughput and memory benchmarks of the components on synthetic data, run with airspeed velocity (asv).
+
+Each benchmark class generates its inputs with 'im3components.synthetic' in 'setup', for every combination of its
+parameters:  the data size and, where the component takes one, the number of workers.  'time_' benchmarks measure the
+wall time of a run, 'peakmem_' benchmarks the peak resident memory of the process, and 'track_' benchmarks the number
+of items, such as hours or cells, processed per second.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import salem
+
+from im3components import synthetic
+from im3components.pop_tell_counties import population_to_tell_counties
+from im3components.statemod_to_parquet.statemod_data_extraction import StateModDataExtractor
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import wrf_to_tell_balancing_authorities
+from im3components.wrf_to_tell.wrf_tell_counties import (
+    create_supersampled_weight_mapping,
+    create_weight_mapping,
+    wrf_to_tell_counties,
+)
+from im3components.wrf_to_tell.wrf_tell_fill_missing_hours import fill_missing_hours
+from im3components.zonal import weight_error
+
+
+WORKERS = [1, 2, 4]
+
+
+class Benchmark:
+    """Base class that creates a temporary directory for the inputs and outputs of each parameter combination."""
+
+    timeout = 600
+
+    def setup(self, *params):
+        self.directory = tempfile.mkdtemp(prefix='im3components_benchmark_')
+
+    def teardown(self, *params):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, *names) -> str:
+        return os.path.join(self.directory, *names)
+
+    def output_directory(self, name: str = 'output') -> str:
+        """Empty output directory, so every repeat of a benchmark writes the same files."""
+
+        shutil.rmtree(self.path(name), ignore_errors=True)
+        os.makedirs(self.path(name))
+
+        return self.path(name)
+
+
+class WrfToTellCounties(Benchmark):
+    """Aggregation of hourly WRF grids to counties, with the grid to county weights precomputed or not."""
+
+    params = ([50, 150], [1, 24], WORKERS)
+    param_names = ['grid_size', 'hours', 'n_jobs']
+
+    def setup(self, grid_size, hours, n_jobs):
+        super().setup()
+
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=hours, ny=grid_size, nx=grid_size,
+                                 variables=synthetic.WRF_VARIABLES)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 10, 10, synthetic.wrf_bounds(grid_size, grid_size))
+
+        self.run(n_jobs, self.path('weights.parquet'))
+
+    def run(self, n_jobs, weights_file):
+        wrf_to_tell_counties(
+            wrf_file=self.path('wrfout.nc'),
+            wrf_variables=synthetic.WRF_VARIABLES,
+            precisions=synthetic.WRF_PRECISIONS,
+            county_shapefile=self.path('counties.shp'),
+            weight_and_mapping_file=weights_file,
+            output_directory=self.output_directory(),
+            n_jobs=n_jobs,
+        )
+
+    def run_without_weights(self, n_jobs):
+        if os.path.isfile(self.path('new_weights.parquet')):
+            os.remove(self.path('new_weights.parquet'))
+        self.run(n_jobs, self.path('new_weights.parquet'))
+
+    def time_counties(self, grid_size, hours, n_jobs):
+        self.run(n_jobs, self.path('weights.parquet'))
+
+    def time_counties_without_weights(self, grid_size, hours, n_jobs):
+        self.run_without_weights(n_jobs)
+
+    def peakmem_counties(self, grid_size, hours, n_jobs):
+        self.run(n_jobs, self.path('weights.parquet'))
+
+    def peakmem_counties_without_weights(self, grid_size, hours, n_jobs):
+        self.run_without_weights(n_jobs)
+
+    def track_cell_hours_per_second(self, grid_size, hours, n_jobs):
+        start = time.perf_counter()
+        self.run(n_jobs, self.path('weights.parquet'))
+        return grid_size * grid_size * hours / (time.perf_counter() - start)
+
+    track_cell_hours_per_second.unit = 'cell hours per second'
+
+
+class CountyWeights(Benchmark):
+    """Creation of the WRF grid to county weights by exact polygon overlay or by rasterizing on a supersampled grid,
+    and the error of the supersampled weights against the exact weights."""
+
+    params = ([50, 150, 400], ['overlay', 'supersample'])
+    param_names = ['grid_size', 'engine']
+
+    def setup(self, grid_size, engine):
+        super().setup()
+
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=1, ny=grid_size, nx=grid_size)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 10, 10, synthetic.wrf_bounds(grid_size, grid_size))
+        self.wrf = salem.open_wrf_dataset(self.path('wrfout.nc'))
+
+    def teardown(self, grid_size, engine):
+        self.wrf.close()
+        super().teardown()
+
+    def run(self, engine):
+        if engine == 'supersample':
+            return create_supersampled_weight_mapping(self.wrf, self.path('counties.shp'))
+        return create_weight_mapping(self.wrf, ['T2'], self.path('counties.shp'))[['cell_index', 'FIPS', 'weight']]
+
+    def time_weights(self, grid_size, engine):
+        self.run(engine)
+
+    def peakmem_weights(self, grid_size, engine):
+        self.run(engine)
+
+    def track_max_absolute_error(self, grid_size, engine):
+        return weight_error(self.run(engine), self.run('overlay'))['absolute_error'].max()
+
+    track_max_absolute_error.unit = 'sum of absolute weight differences per county'
+
+
+class WrfToTellBalancingAuthorities(Benchmark):
+    """Aggregation of hourly county CSV files to balancing authorities."""
+
+    params = ([100, 500], [24 * 7, 24 * 28])
+    param_names = ['counties', 'hours']
+
+    def setup(self, counties, hours):
+        super().setup()
+
+        fips = synthetic.county_fips(counties)
+        synthetic.write_county_data_directory(self.path('counties'), fips, n_hours=hours)
+        synthetic.write_balancing_authority_mapping(self.path('mapping.csv'), fips, n_balancing_authorities=10)
+        synthetic.write_county_population(self.path('population.csv'), fips, range(2000, 2020))
+
+        # cache the population table, which is shared by every run
+        self.run()
+
+    def run(self):
+        wrf_to_tell_balancing_authorities(
+            year=2019,
+            is_historical=True,
+            balancing_authority_to_fips_file=self.path('mapping.csv'),
+            county_population_by_year_file=self.path('population.csv'),
+            county_data_directory=self.path('counties'),
+            output_directory=self.output_directory(),
+            county_data_suffix='_County_Mean_Meteorology',
+            population_cache_directory=self.path('cache'),
+        )
+
+    def time_balancing_authorities(self, counties, hours):
+        self.run()
+
+    def peakmem_balancing_authorities(self, counties, hours):
+        self.run()
+
+    def track_county_hours_per_second(self, counties, hours):
+        start = time.perf_counter()
+        self.run()
+        return counties * hours / (time.perf_counter() - start)
+
+    track_county_hours_per_second.unit = 'county hours per second'
+
+
+class FillMissingHours(Benchmark):
+    """Detection and filling of missing hourly county CSV files."""
+
+    params = ([100, 1000], [24 * 7, 24 * 28])
+    param_names = ['counties', 'hours']
+
+    def setup(self, counties, hours):
+        super().setup()
+
+        # the hours start at 1am, so the last full day ends at midnight of the day after the last date
+        self.end = (pd.Timestamp('2019-01-01') + pd.Timedelta(hours=hours - 24)).strftime('%Y-%m-%d')
+        self.missing = list(range(5, hours, 10))
+        synthetic.write_county_data_directory(self.path('counties'), synthetic.county_fips(counties),
+                                              n_hours=hours, skip_hours=self.missing)
+
+    def run(self):
+        fill_missing_hours('2019-01-01', self.end, self.path('counties'))
+
+        # remove the filled files so every repeat fills the same hours
+        for i in self.missing:
+            t = pd.Timestamp('2019-01-01 01:00') + pd.Timedelta(hours=i)
+            os.remove(self.path('counties', f'{t.strftime("%Y_%m_%d_%H_UTC")}_County_Mean_Meteorology.csv'))
+
+    def time_fill_missing_hours(self, counties, hours):
+        self.run()
+
+    def peakmem_fill_missing_hours(self, counties, hours):
+        self.run()
+
+    def track_hours_per_second(self, counties, hours):
+        start = time.perf_counter()
+        self.run()
+        return hours / (time.perf_counter() - start)
+
+    track_hours_per_second.unit = 'hours per second'
+
+
+class PopulationToTellCounties(Benchmark):
+    """Area weighted sums of gridded population by county."""
+
+    params = ([50, 150], WORKERS)
+    param_names = ['raster_size', 'n_jobs']
+
+    def setup(self, raster_size, n_jobs):
+        super().setup()
+
+        synthetic.write_county_shapefile(self.path('counties.shp'), 5, 5)
+        self.rasters = [
+            synthetic.write_population_raster(self.path(f'population_{year}.tif'), raster_size, raster_size, seed=i)
+            for i, year in enumerate([2020, 2030])
+        ]
+
+    def run(self, n_jobs):
+        population_to_tell_counties(
+            raster_list=self.rasters,
+            county_shapefile=self.path('counties.shp'),
+            state_name='alabama',
+            year_list=[2020, 2030],
+            n_jobs=n_jobs,
+        )
+
+    def time_population(self, raster_size, n_jobs):
+        self.run(n_jobs)
+
+    def peakmem_population(self, raster_size, n_jobs):
+        self.run(n_jobs)
+
+    def track_cells_per_second(self, raster_size, n_jobs):
+        start = time.perf_counter()
+        self.run(n_jobs)
+        return len(self.rasters) * raster_size * raster_size / (time.perf_counter() - start)
+
+    track_cells_per_second.unit = 'cells per second'
+
+    def time_population_stack(self, raster_size, n_jobs):
+        population_to_tell_counties(
+            raster_list=self.rasters,
+            county_shapefile=self.path('counties.shp'),
+            state_name='alabama',
+            year_list=[2020, 2030],
+            stack=True,
+        )
+
+
+class StateModExtraction(Benchmark):
+    """Extraction of structure data from StateMod xdd files to one Parquet file per structure.  The extractor always
+    uses every CPU, so only the data size is varied."""
+
+    params = ([10, 50], [2, 8])
+    param_names = ['structures', 'files']
+
+    def setup(self, structures, files):
+        super().setup()
+
+        self.ids_file, self.xdd_files = synthetic.write_xdd_files(self.path('xdd'), structures, files)
+
+    def run(self):
+        StateModDataExtractor(
+            structure_ids_file_path=self.ids_file,
+            output_path=self.output_directory(),
+            xdd_files=self.xdd_files,
+            allow_overwrite=True,
+        ).extract()
+
+    def time_extract(self, structures, files):
+        self.run()
+
+    def peakmem_extract(self, structures, files):
+        self.run()
+
+    def track_rows_per_second(self, structures, files):
+        start = time.perf_counter()
+        self.run()
+        return structures * files * 10 * 13 / (time.perf_counter() - start)
+
+    track_rows_per_second.unit = 'rows per second'
@@ -0,0 +1,44 @@
+"""Import time benchmarks, run with airspeed velocity (asv).
+
+Each 'timeraw_' benchmark returns code that asv runs in a fresh interpreter, so the module caches of one run do not
+hide the import cost of the next.
+
+"""
+
+
+def timeraw_import_package():
+    return """
+    import im3components
+    """
+
+
+def timeraw_list_registry():
+    return """
+    import im3components
+    im3components.registry().list_registry()
+    """
+
+
+def timeraw_get_python_component():
+    return """
+    import im3components
+    im3components.registry().get_component('wrf_to_tell_counties')
+    """
+
+
+def timeraw_import_pop_tell_counties():
+    return """
+    import im3components.pop_tell_counties
+    """
+
+
+def timeraw_import_wrf_to_tell_pipeline():
+    return """
+    import im3components.wrf_to_tell.wrf_tell_pipeline
+    """
+
+
+def timeraw_import_wrf_to_tell_counties():
+    return """
+    import im3components.wrf_to_tell.wrf_tell_counties
+    """
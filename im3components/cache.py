@@ -0,0 +1,452 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+import pandas as pd
+
+from im3components.utils import file_hash, get_cache_directory
+
+
+class ResultCache:
+    """Store of component results keyed by the component, its argument values, and the state of its input files.
+
+    Arguments naming existing files or directories are fingerprinted by the size and modification time of each file, or
+    by their contents if 'fingerprint' is 'hash'.  Output arguments are treated as destinations:  they are keyed by path
+    only, so the key is the same before and after a run creates them, and the files a run writes there are stored with
+    the return value and restored on a cache hit.  Components declare their output arguments, e.g. in the
+    'output_arguments' of their performance metadata; otherwise parameter names such as 'output_directory' or
+    'county_output_file' are taken as outputs.  Files a component reads when they exist, such as a weights file it
+    creates otherwise, are inputs, not outputs.  The files cached runs of a component wrote to its output paths are left
+    out of the fingerprints of its input directories, so a component may read and write the same directory, and a hit
+    never restores over an input file.  The least recently used results are evicted once the store exceeds 'max_size'
+    bytes.
+
+    :param directory:            directory of the artifact store; defaults to 'results' in the package cache directory
+    :type directory:             str
+
+    :param max_size:             maximum size of the store in bytes
+    :type max_size:              int
+
+    :param fingerprint:          how to fingerprint input files; either 'mtime' or 'hash'
+    :type fingerprint:           str
+
+    """
+
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'index.lock'
+    LOCK_TIMEOUT = 60
+
+    def __init__(self, directory: str = None, max_size: int = 2 * 2 ** 30, fingerprint: str = 'mtime'):
+
+        if fingerprint not in ('mtime', 'hash'):
+            raise ValueError(f"The fingerprint must be either 'mtime' or 'hash', not '{fingerprint}'.")
+
+        if directory is None:
+            directory = os.path.join(get_cache_directory(), 'results')
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_size = max_size
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock is not shared with copies sent to worker processes, which coordinate through the lock file
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock of this object and the lock file of the store, so updates to the index from other threads
+        and processes are not lost.  A lock file older than 'LOCK_TIMEOUT' seconds was left by a dead process."""
+
+        lock_file = os.path.join(self.directory, self.LOCK_FILE)
+
+        with self._lock:
+            while True:
+                try:
+                    os.close(os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lock_file) > self.LOCK_TIMEOUT:
+                            os.remove(lock_file)
+                    except OSError:
+                        pass
+                    time.sleep(0.01)
+            try:
+                yield
+            finally:
+                os.remove(lock_file)
+
+    def _read_index(self) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: Dict[str, dict]):
+        index_file = os.path.join(self.directory, self.INDEX_FILE)
+        temporary_file = f'{index_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_file, 'w') as f:
+            json.dump(index, f)
+        os.replace(temporary_file, index_file)
+
+    def _written_files(self, component_name: str, output_paths: List[str]) -> set:
+        """The files that cached runs of a component wrote below any of the output paths of a call."""
+
+        return {
+            f for entry in self._read_index().values() if entry['component'] == component_name
+            for f in entry['files'] if is_below(f, output_paths)
+        }
+
+    def _fingerprint_path(self, path: str, exclude: set = frozenset()) -> list:
+        """Fingerprint a file, or every file below a directory except those excluded."""
+
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(
+                f for f in (os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+                if os.path.abspath(f) not in exclude
+            )
+
+        if self.fingerprint == 'hash':
+            return [[os.path.relpath(f, path), file_hash(f)] for f in files]
+
+        return [[os.path.relpath(f, path), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files]
+
+    def _fingerprint_value(self, value: Any, exclude: set = frozenset()) -> Any:
+        """Fingerprint an argument value as something JSON serializable."""
+
+        if isinstance(value, str) and os.path.exists(value):
+            return {'path': os.path.abspath(value), 'files': self._fingerprint_path(value, exclude)}
+
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            return value
+
+        if isinstance(value, (list, tuple)):
+            return [self._fingerprint_value(v, exclude) for v in value]
+
+        if isinstance(value, dict):
+            return {
+                str(k): self._fingerprint_value(v, exclude)
+                for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))
+            }
+
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return {
+                'pandas': type(value).__name__,
+                'columns': [str(c) for c in getattr(value, 'columns', [value.name])],
+                'hash': hashlib.sha256(pd.util.hash_pandas_object(value).values.tobytes()).hexdigest(),
+            }
+
+        # raises if the value cannot be pickled, in which case the call is not cached
+        return {'pickle': hashlib.sha256(pickle.dumps(value)).hexdigest()}
+
+    def key(self, component_name: str, arguments: Dict[str, Any], outputs: List[str] = None) -> str:
+        """Compute the cache key of a call.
+
+        :param component_name:       name of the component
+        :type component_name:        str
+
+        :param arguments:            argument values by parameter name
+        :type arguments:             dict
+
+        :param outputs:              names of the output arguments; if None, they are found by parameter name
+        :type outputs:               List[str]
+
+        :return:                     hexadecimal key
+
+        """
+
+        output_paths = [os.path.abspath(v) for k, v in arguments.items() if is_output_argument(k, v, outputs)]
+        exclude = self._written_files(component_name, output_paths)
+
+        description = {
+            'component': component_name,
+            'arguments': {
+                name: os.path.abspath(value) if is_output_argument(name, value, outputs)
+                else self._fingerprint_value(value, exclude)
+                for name, value in arguments.items()
+            },
+        }
+
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def run(self,
+            component_name: str,
+            fn: Callable,
+            args: tuple = (),
+            kwargs: dict = None,
+            ignore: List[str] = None,
+            outputs: List[str] = None) -> Any:
+        """Return the cached result of a call if there is one, otherwise run it and cache the result.
+
+        :param component_name:       name of the component
+        :type component_name:        str
+
+        :param fn:                   component function
+        :type fn:                    Callable
+
+        :param args:                 positional arguments of the call
+        :type args:                  tuple
+
+        :param kwargs:               keyword arguments of the call
+        :type kwargs:                dict
+
+        :param ignore:               names of arguments that do not affect the result, e.g. the number of workers
+        :type ignore:                List[str]
+
+        :param outputs:              names of the arguments naming files or directories the call writes; if None,
+                                     they are found by parameter name
+        :type outputs:               List[str]
+
+        """
+
+        kwargs = {} if kwargs is None else kwargs
+        arguments = bind_arguments(fn, args, kwargs)
+        for name in (ignore or []):
+            arguments.pop(name, None)
+
+        try:
+            key = self.key(component_name, arguments, outputs)
+        except (TypeError, AttributeError, pickle.PicklingError):
+            self.uncacheable += 1
+            return fn(*args, **kwargs)
+
+        paths = [os.path.abspath(v) for k, v in arguments.items() if is_output_argument(k, v, outputs)]
+        exclude = self._written_files(component_name, paths)
+        inputs = {
+            f for k, v in arguments.items() if isinstance(v, str) and not is_output_argument(k, v, outputs)
+            for f in snapshot(os.path.abspath(v)) if f not in exclude
+        }
+
+        hit, value = self.get(key, protected=inputs)
+        if hit:
+            return value
+        before = {path: snapshot(path) for path in paths}
+
+        value = fn(*args, **kwargs)
+
+        written = []
+        for path in paths:
+            after = snapshot(path)
+            written.extend(f for f, state in after.items() if before[path].get(f) != state)
+
+        self.put(key, component_name, value, written)
+
+        return value
+
+    def get(self, key: str, protected: set = frozenset()) -> Tuple[bool, Any]:
+        """Look up a result, restoring the files it wrote.
+
+        :param key:                  cache key
+        :type key:                   str
+
+        :param protected:            full paths to the input files of the call, which are never restored over
+        :type protected:             set
+
+        :return:                     [0] whether the result was found
+                                     [1] the return value, or None
+
+        """
+
+        entry_directory = os.path.join(self.directory, key)
+
+        with self._locked():
+            index = self._read_index()
+            entry = index.get(key)
+
+            if (entry is None) or not os.path.isdir(entry_directory):
+                self.misses += 1
+                return False, None
+
+            try:
+                with open(os.path.join(entry_directory, 'result.pkl'), 'rb') as f:
+                    value = pickle.load(f)
+                for i, target in enumerate(entry['files']):
+                    if target in protected:
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copy2(os.path.join(entry_directory, 'files', str(i)), target)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self.misses += 1
+                return False, None
+
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._write_index(index)
+            self.hits += 1
+
+        return True, value
+
+    def put(self, key: str, component_name: str, value: Any, files: List[str] = None):
+        """Store a result and copies of the files it wrote, then evict the least recently used results if needed.
+
+        :param key:                  cache key
+        :type key:                   str
+
+        :param component_name:       name of the component
+        :type component_name:        str
+
+        :param value:                return value
+        :type value:                 Any
+
+        :param files:                full paths to the files the call wrote
+        :type files:                 List[str]
+
+        """
+
+        files = [] if files is None else files
+        entry_directory = os.path.join(self.directory, key)
+
+        with self._locked():
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            os.makedirs(os.path.join(entry_directory, 'files'))
+
+            try:
+                with open(os.path.join(entry_directory, 'result.pkl'), 'wb') as f:
+                    pickle.dump(value, f)
+            except (TypeError, AttributeError, pickle.PicklingError):
+                shutil.rmtree(entry_directory, ignore_errors=True)
+                self.uncacheable += 1
+                return
+
+            for i, path in enumerate(files):
+                shutil.copy2(path, os.path.join(entry_directory, 'files', str(i)))
+
+            index = self._read_index()
+            index[key] = {
+                'component': component_name,
+                'files': files,
+                'size': sum(
+                    os.path.getsize(os.path.join(root, name))
+                    for root, _, names in os.walk(entry_directory) for name in names
+                ),
+                'created': time.time(),
+                'last_used': time.time(),
+                'hits': 0,
+            }
+
+            # evict the least recently used results beyond the maximum size, but always keep the newest
+            total = sum(e['size'] for e in index.values())
+            for old_key in sorted(index, key=lambda k: index[k]['last_used']):
+                if (total <= self.max_size) or (old_key == key):
+                    break
+                total -= index.pop(old_key)['size']
+                shutil.rmtree(os.path.join(self.directory, old_key), ignore_errors=True)
+                self.evictions += 1
+
+            self._write_index(index)
+
+    def clear(self):
+        """Remove every stored result."""
+
+        with self._locked():
+            for key in self._read_index():
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            self._write_index({})
+
+    @property
+    def stats(self) -> dict:
+        """Hits, misses, uncacheable calls, and evictions of this cache object, and the size of the store."""
+
+        index = self._read_index()
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncacheable': self.uncacheable,
+            'evictions': self.evictions,
+            'entries': len(index),
+            'size': sum(e['size'] for e in index.values()),
+        }
+
+    def entries(self) -> pd.DataFrame:
+        """List the stored results with their component, size, number of files, times, and hit count."""
+
+        return pd.DataFrame([
+            {
+                'key': key,
+                'component': e['component'],
+                'size': e['size'],
+                'files': len(e['files']),
+                'created': pd.Timestamp(e['created'], unit='s'),
+                'last_used': pd.Timestamp(e['last_used'], unit='s'),
+                'hits': e['hits'],
+            } for key, e in self._read_index().items()
+        ], columns=['key', 'component', 'size', 'files', 'created', 'last_used', 'hits'])
+
+
+def bind_arguments(fn: Callable, args: tuple, kwargs: dict) -> Dict[str, Any]:
+    """Bind the arguments of a call to the parameter names of a function, including defaults."""
+
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+    except (TypeError, ValueError):
+        return {**{str(i): v for i, v in enumerate(args)}, **kwargs}
+
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+
+    # expand variable positional and keyword arguments so they are keyed consistently
+    for name, parameter in inspect.signature(fn).parameters.items():
+        if parameter.kind == parameter.VAR_POSITIONAL:
+            arguments.update({f'{name}[{i}]': v for i, v in enumerate(arguments.pop(name, ()))})
+        elif parameter.kind == parameter.VAR_KEYWORD:
+            arguments.update(arguments.pop(name, {}))
+
+    return arguments
+
+
+def is_output_argument(name: str, value: Any, outputs: List[str] = None) -> bool:
+    """Whether an argument is a destination for files the component writes:  one of the declared 'outputs' if given,
+    otherwise a parameter named like 'output_directory'."""
+
+    if not isinstance(value, str):
+        return False
+
+    if outputs is not None:
+        return name in outputs
+
+    name = name.casefold()
+
+    return ('output' in name) and name.endswith(('directory', 'dir', 'file', 'path'))
+
+
+def is_below(path: str, directories: List[str]) -> bool:
+    """Whether a path is one of, or below one of, a list of full paths."""
+
+    return any((path == d) or path.startswith(os.path.join(d, '')) for d in directories)
+
+
+def snapshot(path: str) -> Dict[str, tuple]:
+    """Size and modification time of a file, or of every file below a directory, by full path."""
+
+    if os.path.isfile(path):
+        files = [path]
+    elif os.path.isdir(path):
+        files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    else:
+        files = []
+
+    return {f: (os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files}
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+import warnings
+from typing import TYPE_CHECKING, Dict, List
+
+from im3components.utils import file_hash, get_cache_directory
+
+# geospatial dependencies are imported where they are used so that importing this module is cheap
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+
+# extensions of the files making up a shapefile that the processed geometries depend on
+SHAPEFILE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+# county geometries already loaded in this process, and the hash of each source file by its path, size, and
+#   modification time, so that repeated loads neither read nor hash the files again
+_COUNTIES = {}
+_HASHES = {}
+
+
+def source_hash(county_shapefile: str) -> str:
+    """Hash the contents of a shapefile and the files that accompany it, such as its attributes and projection.
+
+    :param county_shapefile:            Full path with file name and extension to the shapefile.
+    :type county_shapefile:             str
+
+    :return:                            Hexadecimal digest
+
+    """
+
+    path = os.path.abspath(county_shapefile)
+    stem = os.path.splitext(path)[0]
+    paths = [path] + [stem + ext for ext in SHAPEFILE_EXTENSIONS if os.path.isfile(stem + ext) and stem + ext != path]
+
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        identity = (path, stat.st_size, stat.st_mtime_ns)
+        if identity not in _HASHES:
+            _HASHES[identity] = file_hash(path)
+        digest.update(f'{os.path.splitext(path)[1]}:{_HASHES[identity]}'.encode())
+
+    return digest.hexdigest()
+
+
+def read_county_geometries(county_shapefile: str,
+                           crs=None,
+                           columns: List[str] = None,
+                           rename: Dict[str, str] = None) -> gpd.GeoDataFrame:
+    """Read county geometries, keeping only 'columns', renaming columns with 'rename', and reprojecting to 'crs'.
+
+    :param county_shapefile:            Full path with file name and extension to the counties shapefile.
+    :type county_shapefile:             str
+
+    :param crs:                         Coordinate reference system to reproject to, in any form understood by pyproj;
+                                        if None, the geometries are not reprojected.
+    :type crs:                          Any
+
+    :param columns:                     Attribute columns to keep, before renaming; if None, all are kept.
+    :type columns:                      List[str]
+
+    :param rename:                      Mapping of column names to new names.
+    :type rename:                       Dict[str, str]
+
+    :return:                            GeoDataFrame of county polygons
+
+    """
+    import geopandas as gpd
+
+    gdf = gpd.read_file(county_shapefile)
+
+    if columns is not None:
+        missing = set(columns) - set(gdf.columns)
+        if len(missing) > 0:
+            raise KeyError(f"The county data has no fields named {sorted(missing)}.")
+        gdf = gdf[list(columns) + ['geometry']]
+
+    if rename is not None:
+        gdf = gdf.rename(columns=rename)
+
+    if crs is not None:
+        gdf = gdf.to_crs(crs)
+
+    return gdf
+
+
+def load_county_geometries(county_shapefile: str,
+                           crs=None,
+                           columns: List[str] = None,
+                           rename: Dict[str, str] = None,
+                           spatial_index: bool = False,
+                           cache_directory: str = None,
+                           use_cache: bool = True) -> gpd.GeoDataFrame:
+    """Load processed county geometries, reusing a cached copy when the shapefile is unchanged.  The cache is a
+    GeoParquet file of the selected, renamed, and reprojected counties keyed by the hash of the shapefile contents, the
+    target coordinate reference system, and the columns, so it is read in a fraction of the time of parsing the
+    shapefile and reprojecting it.  Counties loaded in this process are kept in memory and returned again by later
+    calls, so the returned GeoDataFrame must not be modified in place.
+
+    :param county_shapefile:            Full path with file name and extension to the counties shapefile.
+    :type county_shapefile:             str
+
+    :param crs:                         Coordinate reference system to reproject to, in any form understood by pyproj;
+                                        if None, the geometries are not reprojected.
+    :type crs:                          Any
+
+    :param columns:                     Attribute columns to keep, before renaming; if None, all are kept.
+    :type columns:                      List[str]
+
+    :param rename:                      Mapping of column names to new names.
+    :type rename:                       Dict[str, str]
+
+    :param spatial_index:               If True, build the spatial index of the counties when they are loaded, so that
+                                        it is built once per process and reused by every later call.
+    :type spatial_index:                bool
+
+    :param cache_directory:             Full path to the directory holding cached geometries; defaults to the package
+                                        cache directory.
+    :type cache_directory:              str
+
+    :param use_cache:                   If False, always read the counties from the shapefile.
+    :type use_cache:                    bool
+
+    :return:                            GeoDataFrame of county polygons
+
+    """
+
+    if (not use_cache) or (not os.path.isfile(county_shapefile)):
+        return read_county_geometries(county_shapefile, crs, columns, rename)
+
+    from pyproj import CRS
+    import geopandas as gpd
+
+    target = '' if crs is None else CRS.from_user_input(crs).to_wkt()
+    options = f'{target}|{columns}|{sorted((rename or {}).items())}'
+    key = f'{source_hash(county_shapefile)[:16]}_{hashlib.sha256(options.encode()).hexdigest()[:16]}'
+
+    if key in _COUNTIES:
+        gdf = _COUNTIES[key]
+
+    else:
+        cache_file = os.path.join(get_cache_directory(cache_directory), f'counties_{key}.parquet')
+
+        if os.path.isfile(cache_file):
+            gdf = gpd.read_parquet(cache_file)
+
+        else:
+            gdf = read_county_geometries(county_shapefile, crs, columns, rename)
+
+            # write to a temporary file first, so that processes loading the same counties never read a partial file
+            temporary_file = f'{cache_file}.{uuid.uuid4().hex}.tmp'
+            try:
+                gdf.to_parquet(temporary_file, index=False)
+                os.replace(temporary_file, cache_file)
+            except OSError as e:
+                warnings.warn(f"Unable to cache the county geometries to '{cache_file}':  {e}")
+                if os.path.isfile(temporary_file):
+                    os.remove(temporary_file)
+
+        _COUNTIES[key] = gdf
+
+    if spatial_index:
+        gdf.sindex
+
+    return gdf
@@ -0,0 +1,152 @@
+import os
+import warnings
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+from im3components.utils import file_hash, get_cache_directory
+
+
+# tables already loaded in this process, keyed by the hash of their input files
+_TABLES = {}
+
+
+def read_county_population_file(county_population_file: str) -> pd.DataFrame:
+    """Read a county population file into a years by counties table.
+
+    Three layouts are understood:  the historical file with 'county_FIPS' and 'pop_YYYY' columns, the SSP projection
+    files with 'FIPS' and 'YYYY' columns, and the output of 'population_to_tell_counties', which has the same layout
+    as the SSP projection files.
+
+    :param county_population_file:      Full path with file name and extension to the county population CSV file.
+    :type county_population_file:       str
+
+    :return:                            DataFrame indexed by integer year with a column of population per integer
+                                        county FIPS code
+
+    """
+
+    df = pd.read_csv(county_population_file, index_col=None, header=0)
+
+    if 'county_FIPS' in df.columns:
+        df = df.set_index('county_FIPS')
+        year_columns = [c for c in df.columns if c.startswith('pop_') and c[4:].isdigit()]
+        table = df[year_columns].rename(columns=lambda c: int(c[4:]))
+
+    elif 'FIPS' in df.columns:
+        df = df.set_index('FIPS')
+        year_columns = [c for c in df.columns if str(c).isdigit()]
+        table = df[year_columns].rename(columns=int)
+
+    else:
+        raise KeyError(f"County population file '{county_population_file}' has neither a 'county_FIPS' nor a 'FIPS' "
+                       "column.")
+
+    table.index = table.index.astype(int)
+
+    return table.T.astype(np.float64)
+
+
+def build_population_table(county_population_files: Union[str, List[str]]) -> pd.DataFrame:
+    """Build a table of county population for every year, linearly interpolating between the years available.
+
+    :param county_population_files:     Full path, or list of full paths, to county population CSV files.  Multiple
+                                        files, such as one per state, are combined by county.
+    :type county_population_files:      Union[str, List[str]]
+
+    :return:                            DataFrame indexed by every integer year in the range of the inputs with a column
+                                        of population per integer county FIPS code
+
+    """
+
+    if isinstance(county_population_files, str):
+        county_population_files = [county_population_files]
+
+    table = pd.concat([read_county_population_file(f) for f in county_population_files], axis=1)
+    table = table.loc[:, ~table.columns.duplicated()].sort_index(axis=0).sort_index(axis=1)
+
+    return table.reindex(range(table.index.min(), table.index.max() + 1)).interpolate()
+
+
+def load_population_table(county_population_files: Union[str, List[str]],
+                          cache_directory: str = None,
+                          use_cache: bool = True) -> pd.DataFrame:
+    """Load the interpolated table of county population for every year, reusing a cached copy when the inputs are
+    unchanged.  The cache is a Parquet file keyed by the hash of the input file contents.
+
+    :param county_population_files:     Full path, or list of full paths, to county population CSV files.
+    :type county_population_files:      Union[str, List[str]]
+
+    :param cache_directory:             Full path to the directory holding cached tables; defaults to the package cache
+                                        directory.
+    :type cache_directory:              str
+
+    :param use_cache:                   If False, always build the table from the input files.
+    :type use_cache:                    bool
+
+    :return:                            DataFrame indexed by integer year with a column of population per integer
+                                        county FIPS code
+
+    """
+
+    if isinstance(county_population_files, str):
+        county_population_files = [county_population_files]
+
+    if not use_cache:
+        return build_population_table(county_population_files)
+
+    key = '_'.join(file_hash(f)[:16] for f in county_population_files)
+
+    if key in _TABLES:
+        return _TABLES[key]
+
+    cache_file = os.path.join(get_cache_directory(cache_directory), f'county_population_{key}.parquet')
+
+    if os.path.isfile(cache_file):
+        table = pd.read_parquet(cache_file)
+        table.columns = table.columns.astype(int)
+
+    else:
+        table = build_population_table(county_population_files)
+
+        try:
+            table.rename(columns=str).to_parquet(cache_file)
+        except OSError as e:
+            warnings.warn(f"Unable to cache the county population table to '{cache_file}':  {e}")
+
+    _TABLES[key] = table
+
+    return table
+
+
+def get_population_for_year(table: pd.DataFrame,
+                            year: int,
+                            clamp: bool = False) -> pd.DataFrame:
+    """Select the population of each county for a year from a population table.
+
+    :param table:                       Table of county population as returned by 'load_population_table'.
+    :type table:                        pd.DataFrame
+
+    :param year:                        Target year in YYYY format.
+    :type year:                         int
+
+    :param clamp:                       If True, years outside of the table use the nearest year available; else a
+                                        KeyError is raised.
+    :type clamp:                        bool
+
+    :return:                            DataFrame with fields 'County_FIPS' and 'Population' sorted by county
+
+    """
+
+    if clamp:
+        year = min(max(year, table.index.min()), table.index.max())
+
+    if year not in table.index:
+        raise KeyError(f"Year {year} is outside of the county population table years "
+                       f"{table.index.min()} to {table.index.max()}.")
+
+    return pd.DataFrame({
+        'County_FIPS': table.columns.values,
+        'Population': table.loc[year].values,
+    })
@@ -0,0 +1,293 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from im3components.instrumentation import instrument
+from im3components.taxonomy import Component
+
+
+# instrumentation measurements reported in the pipeline timings
+MEASUREMENTS = ['cpu_seconds', 'peak_memory_mb', 'bytes_read', 'bytes_written', 'files_read', 'files_written']
+
+
+@dataclass(frozen=True)
+class Output:
+    """Reference to the return value of another stage, used as an argument binding.
+
+    :param stage:                name of the stage whose return value to use
+    :type stage:                 str
+
+    :param key:                  optional key or index to select from the return value
+    :type key:                   Any
+
+    """
+
+    stage: str
+    key: Any = None
+
+    def resolve(self, outputs: Dict[str, Any]) -> Any:
+        value = outputs[self.stage]
+        return value if self.key is None else value[self.key]
+
+
+@dataclass
+class Stage:
+    """A call to a registered component within a pipeline.
+
+    :param name:                 unique name of the stage
+    :type name:                  str
+
+    :param component:            name of the registered component to run
+    :type component:             str
+
+    :param arguments:            keyword arguments of the component; 'Output' values are replaced by the return value
+                                 of the referenced stage
+    :type arguments:             dict
+
+    :param args:                 positional arguments of the component, which may also be 'Output' values
+    :type args:                  list
+
+    :param after:                names of stages that must finish first, for dependencies through files on disk
+                                 rather than through return values
+    :type after:                 List[str]
+
+    """
+
+    name: str
+    component: str
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    args: List[Any] = field(default_factory=list)
+    after: List[str] = field(default_factory=list)
+
+    @property
+    def dependencies(self) -> List[str]:
+        """Names of the stages this stage depends on."""
+
+        upstream = [v.stage for v in list(self.args) + list(self.arguments.values()) if isinstance(v, Output)]
+
+        return list(dict.fromkeys(upstream + list(self.after)))
+
+
+@dataclass
+class PipelineResult:
+    """Return values and timing of a pipeline run.
+
+    :param outputs:              return value of each stage by name
+    :type outputs:               dict
+
+    :param timings:              one row per stage with the component, the worker process, the start and end times in
+                                 seconds since the pipeline started, the seconds spent waiting for a worker and
+                                 running, and the instrumentation measurements of the run
+    :type timings:               pd.DataFrame
+
+    """
+
+    outputs: Dict[str, Any]
+    timings: pd.DataFrame
+
+    def __getitem__(self, stage: str) -> Any:
+        return self.outputs[stage]
+
+
+def stage_registry(registry, spec: Component):
+    """A registry of one component with the settings of another that can be sent to a worker process:  its result
+    cache, profile recording, and instrumentation, but not its executor, which belongs to this process."""
+
+    from im3components.registry import Registry
+
+    return Registry(
+        components=[spec],
+        cache_directory=registry.cache_directory,
+        record_profiles=registry.record_profiles,
+        instrumentation_log=registry.instrumentation_log,
+        profiler=registry.profiler,
+        cache=registry.cache,
+    )
+
+
+def run_stage(spec: Component, args: list, kwargs: dict, registry=None) -> tuple:
+    """Run a component in the current process through the 'run' of a registry, so its result cache, executor,
+    recommended resources, and profile recording apply, returning its output, start and end times, the process id,
+    and the instrumentation record."""
+
+    if registry is None:
+        from im3components.registry import Registry
+        registry = Registry(components=[spec])
+
+    start = time.time()
+    with instrument(spec.name) as instrumentation:
+        output = registry.run(spec.name, *args, **kwargs)
+
+    return output, start, time.time(), os.getpid(), instrumentation.record
+
+
+class Pipeline:
+    """A directed acyclic graph of component stages, run with independent branches in parallel.
+
+    Return values are handed from stage to stage in memory as soon as each stage finishes, so intermediate results
+    need not be written to disk.  Stages run through the 'run' of the registry, so its result cache, resource
+    recommendations, and profile recording apply to them; its executor is passed to the stages that run in this
+    process, i.e. when 'max_workers' is 0.
+
+    :param stages:               stages of the pipeline
+    :type stages:                List[Stage]
+
+    :param registry:             registry in which to look up components; defaults to the package registry
+    :type registry:              Registry
+
+    """
+
+    def __init__(self, stages: List[Stage], registry=None):
+
+        if registry is None:
+            from im3components.registry import registry as default_registry
+            registry = default_registry()
+
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"There are duplicate stages named '{stage.name}' which is not allowed.")
+            self.stages[stage.name] = stage
+
+        self.registry = registry
+
+        # look up every component before running anything
+        self.specs = {stage.name: registry.get_spec(stage.component) for stage in stages}
+
+        for stage in stages:
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on '{dependency}' which is not a stage.")
+
+        self.order()
+
+    def order(self) -> List[List[str]]:
+        """Group the stages into generations that only depend on earlier generations.
+
+        :return:                     list of generations, each a list of stage names
+
+        """
+
+        remaining = {name: set(stage.dependencies) for name, stage in self.stages.items()}
+        generations = []
+
+        while remaining:
+            ready = sorted(name for name, dependencies in remaining.items() if not dependencies)
+            if not ready:
+                raise ValueError(f"The stages {sorted(remaining)} have a circular dependency.")
+            generations.append(ready)
+            for name in ready:
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+
+        return generations
+
+    def run(self, max_workers: int = None, executor: Executor = None) -> PipelineResult:
+        """Run the pipeline, starting each stage as soon as the stages it depends on have finished.
+
+        :param max_workers:          number of worker processes; if 0, stages run one at a time in this process.
+                                     Defaults to the number of stages that can run at once, up to the number of CPUs.
+        :type max_workers:           int
+
+        :param executor:             optional executor to submit stages to instead of a new process pool
+        :type executor:              concurrent.futures.Executor
+
+        :return:                     PipelineResult
+
+        """
+
+        begin = time.time()
+        outputs = {}
+        records = []
+
+        def bind(stage: Stage) -> tuple:
+            args = [v.resolve(outputs) if isinstance(v, Output) else v for v in stage.args]
+            kwargs = {k: v.resolve(outputs) if isinstance(v, Output) else v for k, v in stage.arguments.items()}
+            return args, kwargs
+
+        def record(stage: Stage, submitted: float, start: float, end: float, worker: int, measured: dict):
+            records.append({
+                'stage': stage.name,
+                'component': stage.component,
+                'worker': worker,
+                'start': start - begin,
+                'end': end - begin,
+                'wait_seconds': start - submitted,
+                'run_seconds': end - start,
+                **{k: measured[k] for k in MEASUREMENTS},
+            })
+
+        if max_workers == 0:
+            for generation in self.order():
+                for name in generation:
+                    stage = self.stages[name]
+                    submitted = time.time()
+                    try:
+                        outputs[name], start, end, worker, measured = run_stage(
+                            self.specs[name], *bind(stage), registry=self.registry)
+                    except Exception as e:
+                        raise RuntimeError(f"Stage '{stage.name}' running '{stage.component}' failed:  {e}") from e
+                    record(stage, submitted, start, end, worker, measured)
+
+        else:
+            if max_workers is None:
+                max_workers = min(max((len(g) for g in self.order()), default=1), os.cpu_count() or 1)
+
+            pool = executor if executor is not None else ProcessPoolExecutor(max_workers=max_workers)
+            remaining = {name: set(stage.dependencies) for name, stage in self.stages.items()}
+            running = {}
+
+            try:
+                while remaining or running:
+
+                    # submit every stage whose dependencies have finished
+                    for name in sorted(name for name, dependencies in remaining.items() if not dependencies):
+                        del remaining[name]
+                        stage = self.stages[name]
+                        future = pool.submit(run_stage, self.specs[name], *bind(stage),
+                                             stage_registry(self.registry, self.specs[name]))
+                        running[future] = (stage, time.time())
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        stage, submitted = running.pop(future)
+                        try:
+                            outputs[stage.name], start, end, worker, measured = future.result()
+                        except Exception as e:
+                            raise RuntimeError(f"Stage '{stage.name}' running '{stage.component}' failed:  {e}") from e
+                        record(stage, submitted, start, end, worker, measured)
+                        for dependencies in remaining.values():
+                            dependencies.discard(stage.name)
+
+            finally:
+                for future in running:
+                    future.cancel()
+                if executor is None:
+                    pool.shutdown()
+
+        return PipelineResult(outputs, pd.DataFrame(records))
+
+
+def run_pipeline(stages: List[Stage], registry=None, max_workers: int = None) -> PipelineResult:
+    """Build and run a pipeline of component stages.
+
+    :param stages:               stages of the pipeline
+    :type stages:                List[Stage]
+
+    :param registry:             registry in which to look up components; defaults to the package registry
+    :type registry:              Registry
+
+    :param max_workers:          number of worker processes; if 0, stages run one at a time in this process
+    :type max_workers:           int
+
+    :return:                     PipelineResult
+
+    """
+
+    return Pipeline(stages, registry).run(max_workers=max_workers)
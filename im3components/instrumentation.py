@@ -0,0 +1,372 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+# files opened by the import system and by the measurements themselves, which are not counted as files touched
+IGNORED_EXTENSIONS = ('.py', '.pyc', '.so', '.pyd')
+IGNORED_PREFIXES = ('/proc/', '/sys/', '/dev/')
+
+# write flags of os.open, used to classify files opened without a mode string
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND
+
+# instrumentations currently recording the files opened, in any thread
+_ACTIVE = set()
+_ACTIVE_LOCK = threading.Lock()
+_HOOK_INSTALLED = False
+
+
+def _audit_hook(event: str, args: tuple):
+    """Pass the files opened to every active instrumentation."""
+
+    if (event != 'open') or not _ACTIVE:
+        return
+
+    path, mode, flags = (tuple(args) + (None, None, None))[:3]
+
+    if not isinstance(path, (str, bytes, os.PathLike)):
+        return
+
+    path = os.fsdecode(path)
+    if path.endswith(IGNORED_EXTENSIONS) or path.startswith(IGNORED_PREFIXES):
+        return
+
+    if isinstance(mode, str):
+        written = any(c in mode for c in 'wax+')
+    else:
+        written = bool((flags or 0) & WRITE_FLAGS)
+
+    for instrumentation in list(_ACTIVE):
+        (instrumentation.files_written if written else instrumentation.files_read).add(path)
+
+
+def _install_audit_hook():
+    """Install the audit hook once; audit hooks cannot be removed, so it is shared by every instrumentation."""
+
+    global _HOOK_INSTALLED
+
+    with _ACTIVE_LOCK:
+        if not _HOOK_INSTALLED:
+            sys.addaudithook(_audit_hook)
+            _HOOK_INSTALLED = True
+
+
+def _process():
+    """Return a psutil handle on this process, or None if psutil is not installed."""
+
+    try:
+        import psutil
+        return psutil.Process()
+    except ImportError:
+        return None
+
+
+def _resident_memory(process) -> int:
+    """Resident memory in bytes of a process and its child processes."""
+
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except Exception:
+            continue
+
+    return total
+
+
+def _io_bytes(process) -> tuple:
+    """Bytes read and written by this process, including those served from the page cache, or None if unknown."""
+
+    if process is not None:
+        try:
+            counters = process.io_counters()
+            read = getattr(counters, 'read_chars', counters.read_bytes)
+            written = getattr(counters, 'write_chars', counters.write_bytes)
+            return read, written
+        except (AttributeError, NotImplementedError, OSError):
+            pass
+
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _max_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process over its lifetime and of its finished child processes, in megabytes."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+    # reported in bytes on macOS and kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class Instrumentation:
+    """Context manager that measures a stage of work and optionally profiles it.
+
+    The record holds the wall and CPU seconds, the peak resident memory in megabytes, the bytes read and written, and
+    the files read and written.  With psutil installed, memory is sampled in a background thread and includes child
+    processes, e.g. joblib workers; otherwise the peak resident memory of the process over its lifetime is reported.
+    Bytes are counted for this process only.  Files are counted from the 'open' audit events of every thread.
+
+    :param stage:                name of the stage
+    :type stage:                 str
+
+    :param log_file:             optional JSON lines file to append the record to; defaults to the
+                                 'IM3COMPONENTS_INSTRUMENTATION_LOG' environment variable if set
+    :type log_file:              str
+
+    :param profiler:             optional profiler to capture the stage with, either 'cprofile' or 'pyinstrument';
+                                 defaults to the 'IM3COMPONENTS_PROFILER' environment variable if set
+    :type profiler:              str
+
+    :param profile_directory:    directory to write profiles to; defaults to 'profiles' in the package cache directory
+    :type profile_directory:     str
+
+    :param interval:             seconds between samples of resident memory
+    :type interval:              float
+
+    :param metadata:             additional fields to include in the record
+    :type metadata:              dict
+
+    """
+
+    def __init__(
+            self,
+            stage: str,
+            log_file: str = None,
+            profiler: str = None,
+            profile_directory: str = None,
+            interval: float = 0.05,
+            metadata: dict = None,
+    ):
+
+        if profiler is None:
+            profiler = os.environ.get('IM3COMPONENTS_PROFILER') or None
+
+        if (profiler is not None) and (profiler not in ('cprofile', 'pyinstrument')):
+            raise ValueError(f"The profiler must be either 'cprofile' or 'pyinstrument', not '{profiler}'.")
+
+        self.stage = stage
+        self.log_file = log_file if log_file is not None else os.environ.get('IM3COMPONENTS_INSTRUMENTATION_LOG')
+        self.profiler = profiler
+        self.profile_directory = profile_directory
+        self.interval = interval
+        self.metadata = metadata or {}
+        self.files_read = set()
+        self.files_written = set()
+        self.record = None
+
+    def _sample_memory(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._peak = max(self._peak, _resident_memory(self._process))
+            except Exception:
+                return
+
+    def _start_profiler(self):
+        self._profiler = None
+
+        if self.profiler == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already active, e.g. for an enclosing stage
+                return
+            self._profiler = profiler
+
+        elif self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            self._profiler = Profiler()
+            self._profiler.start()
+
+    def _stop_profiler(self) -> Optional[str]:
+        if self._profiler is None:
+            return None
+
+        if self.profile_directory is None:
+            from im3components.utils import get_cache_directory
+            self.profile_directory = os.path.join(get_cache_directory(), 'profiles')
+        os.makedirs(self.profile_directory, exist_ok=True)
+
+        name = f"{self.stage}_{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}"
+
+        if self.profiler == 'cprofile':
+            self._profiler.disable()
+            profile_file = os.path.join(self.profile_directory, f'{name}.prof')
+            self._profiler.dump_stats(profile_file)
+        else:
+            self._profiler.stop()
+            profile_file = os.path.join(self.profile_directory, f'{name}.html')
+            with open(profile_file, 'w') as f:
+                f.write(self._profiler.output_html())
+
+        return profile_file
+
+    def __enter__(self):
+        _install_audit_hook()
+
+        self._process = _process()
+        self._peak = _resident_memory(self._process) if self._process is not None else 0
+        self._stop = threading.Event()
+        self._sampler = None
+        if self._process is not None:
+            self._sampler = threading.Thread(target=self._sample_memory, daemon=True)
+            self._sampler.start()
+
+        self._io_start = _io_bytes(self._process)
+
+        with _ACTIVE_LOCK:
+            _ACTIVE.add(self)
+
+        try:
+            self._start_profiler()
+        except BaseException:
+            # stop measuring, since __exit__ is not called when entering fails
+            with _ACTIVE_LOCK:
+                _ACTIVE.discard(self)
+            self._stop.set()
+            raise
+
+        self._time = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._wall
+        cpu_seconds = time.process_time() - self._cpu
+
+        profile_file = self._stop_profiler()
+
+        with _ACTIVE_LOCK:
+            _ACTIVE.discard(self)
+
+        io_end = _io_bytes(self._process)
+
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            try:
+                peak_memory_mb = max(self._peak, _resident_memory(self._process)) / 2 ** 20
+            except Exception:
+                peak_memory_mb = self._peak / 2 ** 20
+        else:
+            peak_memory_mb = _max_rss_mb()
+
+        def difference(i):
+            return None if (self._io_start[i] is None) or (io_end[i] is None) else io_end[i] - self._io_start[i]
+
+        self.record = {
+            'stage': self.stage,
+            **self.metadata,
+            'time': self._time,
+            'seconds': seconds,
+            'cpu_seconds': cpu_seconds,
+            'peak_memory_mb': peak_memory_mb,
+            'bytes_read': difference(0),
+            'bytes_written': difference(1),
+            'files_read': len(self.files_read),
+            'files_written': len(self.files_written),
+            'files_touched': len(self.files_read | self.files_written),
+            'profile_file': profile_file,
+            'error': None if exc_type is None else f'{exc_type.__name__}: {exc_value}',
+        }
+
+        if self.log_file is not None:
+            write_log(self.record, self.log_file)
+
+        return False
+
+
+def instrument(stage: str, **kwargs) -> Instrumentation:
+    """Measure a block of code as a stage, e.g. 'with instrument("aggregate") as i:', after which 'i.record' holds
+    the measurements.  See 'Instrumentation' for the options.
+
+    :param stage:                name of the stage
+    :type stage:                 str
+
+    """
+
+    return Instrumentation(stage, **kwargs)
+
+
+def instrumented(stage: str = None, **instrument_kwargs) -> Callable:
+    """Decorate a function to measure each call as a stage, by default named after the function.  The record of the
+    last call is available as the 'last_record' attribute of the decorated function.
+
+    :param stage:                name of the stage; defaults to the name of the function
+    :type stage:                 str
+
+    """
+
+    def decorator(fn: Callable) -> Callable:
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            instrumentation = instrument(stage or fn.__name__, **instrument_kwargs)
+            try:
+                with instrumentation:
+                    return fn(*args, **kwargs)
+            finally:
+                wrapper.last_record = instrumentation.record
+
+        wrapper.last_record = None
+
+        return wrapper
+
+    return decorator
+
+
+def write_log(record: dict, log_file: str):
+    """Append a record to a JSON lines log file.
+
+    :param record:               record to write
+    :type record:                dict
+
+    :param log_file:             full path to the log file
+    :type log_file:              str
+
+    """
+
+    directory = os.path.dirname(os.path.abspath(log_file))
+    os.makedirs(directory, exist_ok=True)
+
+    with open(log_file, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+def read_log(log_file: str) -> List[dict]:
+    """Read the records of a JSON lines log file.
+
+    :param log_file:             full path to the log file
+    :type log_file:              str
+
+    """
+
+    records = []
+    with open(log_file, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
@@ -1,17 +1,21 @@
+from __future__ import annotations
+
+from concurrent.futures import Executor
 import os
-import pkg_resources
-from typing import List
+from typing import TYPE_CHECKING, List, Tuple, Union
 
-import swifter
 import numpy as np
 import pandas as pd
-import xarray as xr
-import geopandas as gpd
-from joblib import Parallel, delayed
-from shapely.geometry import Polygon
 
 from im3components.utils import read_yaml
 
+# geospatial and parallel dependencies are imported where they are used so that importing this module is cheap
+if TYPE_CHECKING:
+    import geopandas as gpd
+    import pyarrow as pa
+    from scipy import sparse
+    from shapely.geometry import Polygon
+
 
 def validate_year(x: int) -> int:
     """Return a year integer in YYYY format if the input format is correct.
@@ -64,7 +68,8 @@ def validate_string(x: str = None) -> str:
 
 
 def validate_weights_file(weights_file: str = None, set_county_id_name: str = 'FIPS') -> pd.DataFrame:
-    """Ensure weights file exists and has the required fields and return it as a DataFrame.
+    """Ensure weights file exists and has the required fields and return it as a DataFrame.  Both the binary Parquet
+    format written by 'write_weights_file' and the legacy CSV format are read.
 
     :param weights_file:                Full path with file name and extension to the input weights file.
     :type weights_file:                 str
@@ -81,7 +86,11 @@ def validate_weights_file(weights_file: str = None, set_county_id_name: str = 'F
 
     # ensure file exists
     if os.path.isfile(weights_file):
-        df = pd.read_csv(weights_file, dtype=data_types)
+
+        if weights_file.endswith('.parquet'):
+            df = read_weights_file(weights_file, set_county_id_name)
+        else:
+            df = pd.read_csv(weights_file, dtype=data_types)
 
         # ensure required columns exists
         missing = set(required_columns) - set(df.columns)
@@ -99,6 +108,150 @@ def validate_weights_file(weights_file: str = None, set_county_id_name: str = 'F
         raise FileNotFoundError(f"The 'weights_file' passed does not exist:  '{weights_file}'")
 
 
+def write_weights_file(df_weights: pd.DataFrame, weights_file: str, set_county_id_name: str = 'FIPS') -> str:
+    """Write grid cell to county weights in the binary weights format:  a Parquet file of the int64 'cell_index', the
+    county identifier as an int32 code, and the float32 'weight', sorted by grid cell.  The width of the county
+    identifiers is kept in the file metadata, so zero padded identifiers such as FIPS codes are restored on reading.
+
+    :param df_weights:                  DataFrame of the 'cell_index', county identifier, and 'weight' of each grid
+                                        cell county intersection.
+    :type df_weights:                   pd.DataFrame
+
+    :param weights_file:                Full path with file name and extension to the output Parquet file.
+    :type weights_file:                 str
+
+    :param set_county_id_name:          Field name of the unique county identifier, which must be numeric.
+    :type set_county_id_name:           str
+
+    :return:                            Full path to the file written
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    county_ids = df_weights[set_county_id_name].astype(str)
+    if not county_ids.str.isdigit().all():
+        raise ValueError(f"The '{set_county_id_name}' county identifiers must be numeric to write a binary weights file.")
+
+    df = pd.DataFrame({
+        'cell_index': df_weights['cell_index'].values.astype(np.int64),
+        set_county_id_name: county_ids.astype(np.int32).values,
+        'weight': df_weights['weight'].values.astype(np.float32),
+    }).sort_values(['cell_index', set_county_id_name], kind='stable')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        b'county_id_width': str(county_ids.str.len().max()).encode(),
+    })
+    pq.write_table(table, weights_file)
+
+    return weights_file
+
+
+def read_weights_file(weights_file: str, set_county_id_name: str = 'FIPS') -> pd.DataFrame:
+    """Read a binary weights file written by 'write_weights_file' as a DataFrame of the 'cell_index', the county
+    identifier as a zero padded string, and the 'weight', as for the legacy CSV format.
+
+    :param weights_file:                Full path with file name and extension to the Parquet weights file.
+    :type weights_file:                 str
+
+    :param set_county_id_name:          Field name of the unique county identifier.
+    :type set_county_id_name:           str
+
+    :return:                            pd.DataFrame
+
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(weights_file)
+    df = table.to_pandas()
+
+    if set_county_id_name in df.columns:
+        width = int((table.schema.metadata or {}).get(b'county_id_width', b'0'))
+        df[set_county_id_name] = df[set_county_id_name].astype(str).str.zfill(width)
+
+    if 'weight' in df.columns:
+        df['weight'] = df['weight'].astype(np.float64)
+
+    return df
+
+
+def weights_operator(cell_index: np.ndarray,
+                     county_ids: np.ndarray,
+                     weights: np.ndarray,
+                     raster_cell_index: np.ndarray) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Build the sparse (county, grid cell) matrix that sums grid cell values by county from grid cell to county
+    weights, with a column per grid cell of the raster in the order of 'raster_cell_index'.  Weights of grid cells that
+    are not in the raster, e.g. nodata cells, are left out.
+
+    :param cell_index:                  The 'cell_index' of each weight.
+    :type cell_index:                   np.ndarray
+
+    :param county_ids:                  The county identifier of each weight.
+    :type county_ids:                   np.ndarray
+
+    :param weights:                     The weights.
+    :type weights:                      np.ndarray
+
+    :param raster_cell_index:           The 'cell_index' of each grid cell of the raster data.
+    :type raster_cell_index:            np.ndarray
+
+    :return:                            [0] (county, grid cell) weights matrix
+                                        [1] county identifier of each row, sorted
+
+    """
+    from scipy import sparse
+
+    # gather the position of each weighted cell in the raster data directly rather than merging
+    columns = pd.Index(raster_cell_index).get_indexer(cell_index)
+    found = columns >= 0
+
+    counties, rows = np.unique(county_ids[found], return_inverse=True)
+
+    return sparse.csr_matrix((weights[found].astype(np.float64), (rows, columns[found])),
+                             shape=(len(counties), len(raster_cell_index))), counties
+
+
+def load_weights_operator(weights_file: str,
+                          raster_cell_index: np.ndarray,
+                          set_county_id_name: str = 'FIPS') -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Load a weights file as the sparse (county, grid cell) matrix of 'weights_operator'.  Binary weights files are
+    read without converting each county code to a string;  legacy CSV files are read with 'validate_weights_file'.
+
+    :param weights_file:                Full path with file name and extension to the weights file.
+    :type weights_file:                 str
+
+    :param raster_cell_index:           The 'cell_index' of each grid cell of the raster data.
+    :type raster_cell_index:            np.ndarray
+
+    :param set_county_id_name:          Field name of the unique county identifier.
+    :type set_county_id_name:           str
+
+    :return:                            [0] (county, grid cell) weights matrix
+                                        [1] county identifier of each row, sorted
+
+    """
+
+    if not weights_file.endswith('.parquet'):
+        df = validate_weights_file(weights_file, set_county_id_name)
+        return weights_operator(df['cell_index'].values, df[set_county_id_name].values, df['weight'].values,
+                                raster_cell_index)
+
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(weights_file, columns=['cell_index', set_county_id_name, 'weight'])
+    operator, counties = weights_operator(table.column('cell_index').to_numpy(),
+                                          table.column(set_county_id_name).to_numpy(),
+                                          table.column('weight').to_numpy(),
+                                          raster_cell_index)
+
+    # only the distinct county codes are converted back to identifiers
+    width = int((table.schema.metadata or {}).get(b'county_id_width', b'0'))
+
+    return operator, np.array([str(county).zfill(width) for county in counties], dtype=object)
+
+
 def validate_list_order(raster_list: List[str], weights_file_list: List[str]):
     """Ensure that the population raster list and the weights file list are both ordered the same by state.
 
@@ -205,6 +358,8 @@ def build_polygon_from_centroid(x: float,
 
     """
 
+    from shapely.geometry import Polygon
+
     # get half distance along each axis
     x_half_resolution = x_resolution / 2
     y_half_resolution = y_resolution / 2
@@ -226,8 +381,11 @@ def get_county_data(template_raster_file: str = None,
                     county_id_field: str = 'GEOID',
                     state_id_field: str = 'STATEFP',
                     set_county_id_name: str = 'FIPS',
-                    state_name: str = None) -> gpd.GeoDataFrame:
-    """Import and process county data.
+                    state_name: str = None,
+                    cache_directory: str = None,
+                    use_cache: bool = True) -> gpd.GeoDataFrame:
+    """Import and process county data.  Counties read from a shapefile are cached as GeoParquet after they are
+    reprojected, see 'im3components.county_geometry.load_county_geometries'.
 
     :param template_raster_file:                Full path with file name and extension to an input raster file. If
                                                 'county_geodataframe' is provided, this will be ignored.
@@ -253,6 +411,13 @@ def get_county_data(template_raster_file: str = None,
     :param state_name:                          Name of state to write into output file name.
     :type state_name:                           str
 
+    :param cache_directory:                     Full path to the directory holding cached county geometries; defaults
+                                                to the package cache directory.
+    :type cache_directory:                      str
+
+    :param use_cache:                           If False, always read the counties from the shapefile.
+    :type use_cache:                            bool
+
     :return:                                    GeoDataFrame of county polygons
 
     """
@@ -261,27 +426,32 @@ def get_county_data(template_raster_file: str = None,
         gdf_counties = county_geodataframe
 
     else:
+        import xarray as xr
+
+        from im3components.county_geometry import load_county_geometries
 
         # get coordinate reference system from the template raster
         da_raster_crs = xr.open_rasterio(template_raster_file).crs
 
-        # read in county polygon data
-        gdf_counties = gpd.read_file(county_shapefile)
-
-        # ensure field exists
-        if county_id_field in gdf_counties.columns:
-            gdf_counties = gdf_counties[[state_id_field, county_id_field, 'geometry']].rename(
-                columns={county_id_field: set_county_id_name}
-            ).to_crs(da_raster_crs)
-
-        else:
+        # read in county polygon data reprojected to the raster, from the geometry cache when the shapefile is unchanged
+        try:
+            gdf_counties = load_county_geometries(county_shapefile,
+                                                  crs=da_raster_crs,
+                                                  columns=[state_id_field, county_id_field],
+                                                  rename={county_id_field: set_county_id_name},
+                                                  cache_directory=cache_directory,
+                                                  use_cache=use_cache)
+
+        except KeyError:
             raise KeyError(f"There is not a field named '{county_id_field}' in the input county data.")
 
     # add state_name to county if it does not exist
     if 'state_name' not in gdf_counties.columns:
-        county_to_state_file = pkg_resources.resource_filename('im3components', 'data/county_to_state_key.yml')
+        county_to_state_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            'data',
+                                            'county_to_state_key.yml')
         county_to_state_dict = read_yaml(county_to_state_file)
-        gdf_counties['state_name'] = gdf_counties[state_id_field].map(county_to_state_dict)
+        gdf_counties = gdf_counties.assign(state_name=gdf_counties[state_id_field].map(county_to_state_dict))
 
     # only keep counties associated with the target state
     gdf_counties = gdf_counties.loc[gdf_counties['state_name'] == state_name].copy()
@@ -316,6 +486,9 @@ def get_raster_data(raster_file: str = None,
                                         [1] grid cell area value
 
     """
+    import geopandas as gpd
+    import xarray as xr
+
     # raster to DataArray
     da_raster = xr.open_rasterio(raster_file)
 
@@ -339,8 +512,8 @@ def get_raster_data(raster_file: str = None,
     df_raster['geometry'] = df_raster.apply(lambda xdf: build_polygon_from_centroid(
                                                                         x=xdf[x_coordinate_field],
                                                                         y=xdf[y_coordinate_field],
-                                                                        x_resolution=da_raster.res[1],
-                                                                        y_resolution=da_raster.res[0]), axis=1)
+                                                                        x_resolution=da_raster.res[0],
+                                                                        y_resolution=da_raster.res[1]), axis=1)
 
     # drop coordinate columns
     df_raster.drop(columns=[x_coordinate_field, y_coordinate_field], inplace=True)
@@ -354,6 +527,263 @@ def get_raster_data(raster_file: str = None,
     return gdf_raster, (da_raster.res[0] * da_raster.res[1])
 
 
+def get_raster_window(raster, bounds: Tuple[float, float, float, float] = None):
+    """Get the window of an open raster covering the given bounds, rounded out to whole cells so that cells partly
+    within the bounds are included.
+
+    :param raster:                      Raster dataset opened with rasterio.
+    :type raster:                       rasterio.io.DatasetReader
+
+    :param bounds:                      Bounds (xmin, ymin, xmax, ymax) in the coordinate system of the raster.  If
+                                        None, the window covers the whole raster.
+    :type bounds:                       Tuple[float, float, float, float]
+
+    :return:                            rasterio.windows.Window
+
+    """
+    from rasterio.windows import Window, from_bounds
+
+    if bounds is None:
+        return Window(0, 0, raster.width, raster.height)
+
+    window = from_bounds(*bounds, transform=raster.transform)
+    row_start, col_start = max(int(np.floor(window.row_off)), 0), max(int(np.floor(window.col_off)), 0)
+    row_stop = min(int(np.ceil(window.row_off + window.height)), raster.height)
+    col_stop = min(int(np.ceil(window.col_off + window.width)), raster.width)
+
+    return Window(col_start, row_start, max(col_stop - col_start, 0), max(row_stop - row_start, 0))
+
+
+def get_raster_stack_data(raster_list: List[str],
+                          bounds: Tuple[float, float, float, float] = None,
+                          drop_nan: bool = True) -> Tuple[gpd.GeoDataFrame, np.ndarray, float]:
+    """Import a stack of population rasters on the same grid, e.g. one per year, as one array of values per grid cell
+    and a single set of grid cell polygons.  The stack is either a single multi-band raster, one band per year, or a
+    list of single band rasters.  Only the window covering 'bounds' is read, as masked arrays, and the 'cell_index' of
+    each cell is its index in the flattened full raster, as assigned by 'get_raster_data'.
+
+    :param raster_list:                 List of full path with file name and extension to the input raster files.
+    :type raster_list:                  List[str]
+
+    :param bounds:                      Bounds to read (xmin, ymin, xmax, ymax) in the coordinate system of the raster.
+                                        If None, the whole raster is read.
+    :type bounds:                       Tuple[float, float, float, float]
+
+    :param drop_nan:                    Choice to drop all cells that are NaN (nodata in the raster) in every layer of
+                                        the stack.  If True, those cells will be removed; else if False, all cells will
+                                        be used.
+    :type drop_nan:                     bool
+
+    :return:                            [0] GeoDataFrame of grid cell polygons with their 'cell_index'
+                                        [1] array of values with a row per grid cell and a column per layer, with
+                                            nodata as NaN
+                                        [2] grid cell area value
+
+    """
+    import geopandas as gpd
+    import rasterio
+
+    with rasterio.open(raster_list[0]) as raster:
+        window = get_raster_window(raster, bounds)
+        transform = raster.window_transform(window)
+        grid = (raster.transform, raster.width, raster.height)
+        x_resolution, y_resolution = raster.res
+        crs = raster.crs
+
+        # a single raster holds every layer as a band
+        layers = [raster.read(window=window, masked=True)] if len(raster_list) == 1 else [
+            raster.read(1, window=window, masked=True)[np.newaxis]]
+
+    for raster_file in raster_list[1:]:
+        with rasterio.open(raster_file) as raster:
+            if (raster.transform, raster.width, raster.height) != grid:
+                raise ValueError(f"Raster '{raster_file}' is not on the same grid as '{raster_list[0]}'.")
+            layers.append(raster.read(1, window=window, masked=True)[np.newaxis])
+
+    # set nodata as NaN
+    values = np.concatenate([layer.astype(np.float64).filled(np.nan) for layer in layers])
+
+    if drop_nan:
+        rows, columns = np.nonzero(~np.isnan(values).all(axis=0))
+    else:
+        rows, columns = np.indices(values.shape[1:]).reshape(2, -1)
+
+    # cell centroids and their index in the full raster
+    x, y = rasterio.transform.xy(transform, rows, columns, offset='center')
+    cell_index = (rows + window.row_off) * grid[1] + (columns + window.col_off)
+
+    # generate a Polygon object for each centroid
+    gdf_raster = gpd.GeoDataFrame({
+        'geometry': [build_polygon_from_centroid(x=i,
+                                                 y=j,
+                                                 x_resolution=x_resolution,
+                                                 y_resolution=y_resolution) for i, j in zip(x, y)],
+        'cell_index': cell_index,
+    }, index=cell_index, geometry='geometry', crs=crs)
+
+    return gdf_raster, values[:, rows, columns].T, (x_resolution * y_resolution)
+
+
+def get_raster_window_data(raster_file: str = None,
+                           bounds: Tuple[float, float, float, float] = None,
+                           data_field_name: str = None,
+                           drop_nan: bool = True) -> gpd.GeoDataFrame:
+    """Import population raster data for only the window of the raster covering the given bounds, e.g. those of the
+    counties of one state, so that memory and time scale with the state rather than the whole raster.  The window is
+    read as a masked array and only its cells are turned into records.  The 'cell_index' of each cell is its index in
+    the flattened full raster, as assigned by 'get_raster_data', so weights files apply to either.
+
+    :param raster_file:                 Full path with file name and extension to the input raster file.
+    :type raster_file:                  str
+
+    :param bounds:                      Bounds to read (xmin, ymin, xmax, ymax) in the coordinate system of the raster.
+    :type bounds:                       Tuple[float, float, float, float]
+
+    :param data_field_name:             Field name to set as the value field for the raster data.
+    :type data_field_name:              str
+
+    :param drop_nan:                    Choice to drop all records that have a NaN (nodata in the raster) value.  If
+                                        True, all NaN records will be removed; else if False, all records will be used.
+    :type drop_nan:                     bool
+
+    :return:                            [0] GeoDataFrame of population per grid cell as polygons
+                                        [1] grid cell area value
+
+    """
+
+    gdf_raster, values, grid_cell_area = get_raster_stack_data([raster_file], bounds=bounds, drop_nan=drop_nan)
+
+    # single band raster
+    gdf_raster.insert(0, data_field_name, values[:, 0])
+
+    return gdf_raster, grid_cell_area
+
+
+def apportion_cell_areas(df_intersect: pd.DataFrame, grid_cell_area: float) -> pd.DataFrame:
+    """Weight each grid cell county intersection by the fraction of the grid cell area it is allotted, given the area of
+    each intersection.  The weights of each grid cell sum to 1, so no population is lost at the borders.
+
+    :param df_intersect:                DataFrame of the grid cell county intersections with their 'cell_index' and
+                                        'area'.
+    :type df_intersect:                 pd.DataFrame
+
+    :param grid_cell_area:              Area of a grid cell.
+    :type grid_cell_area:               float
+
+    :return:                            The intersections with the 'weight' of each
+
+    """
+
+    # calculate the number of counties that each grid cell is a part of
+    df_intersect['cell_count'] = df_intersect['cell_index'].map(
+        df_intersect['cell_index'].value_counts().to_dict()
+    )
+
+    # Where a fraction of the cell only exists in one county and the fraction of that grid cell
+    #   that is in the county is less than the grid cell total area, give the county the whole cell value.
+    #   This occurs when a grid cell is on the border of a county.
+    df_intersect['area'] = np.where((df_intersect['cell_count'] == 1) &
+                                    (df_intersect['area'] < grid_cell_area),
+                                    grid_cell_area,
+                                    df_intersect['area'])
+
+    # construct a dictionary of cell_index to total area per grid cell considering all counties
+    cell_to_area_dict = df_intersect.groupby('cell_index')['area'].sum().to_dict()
+
+    # Where a fraction of a grid cell is split between one or more counties and the area balance is less
+    #   than the total grid cell area, split the out of boundary area for the grid cell between the counties.
+    #   This occurs when county boundaries do not encompass the full grid cell.
+    df_intersect['area'] = df_intersect['area'] + (
+            (grid_cell_area - df_intersect['cell_index'].map(cell_to_area_dict)) / df_intersect['cell_count']
+    )
+
+    # calculate the weighted area per grid cell county intersection
+    df_intersect['weight'] = df_intersect['area'] / grid_cell_area
+
+    return df_intersect
+
+
+def compute_intersection_weights(gdf_counties: gpd.GeoDataFrame,
+                                 gdf_raster: gpd.GeoDataFrame,
+                                 grid_cell_area: float) -> gpd.GeoDataFrame:
+    """Intersect the county polygons with the grid cell polygons and weight each intersection by the fraction of the
+    grid cell area it is allotted.
+
+    :param gdf_counties:                GeoDataFrame of county ids and geometries.
+    :type gdf_counties:                 gpd.GeoDataFrame
+
+    :param gdf_raster:                  GeoDataFrame of grid cell polygons with their 'cell_index'.
+    :type gdf_raster:                   gpd.GeoDataFrame
+
+    :param grid_cell_area:              Area of a grid cell.
+    :type grid_cell_area:               float
+
+    :return:                            GeoDataFrame of the intersections with the fields of both inputs and 'weight'
+
+    """
+    import geopandas as gpd
+
+    # intersect the counties data and the raster polygonized data
+    gdf_intersect = gpd.overlay(gdf_counties, gdf_raster, how='intersection')
+
+    # calculate the weighted area
+    gdf_intersect['area'] = gdf_intersect.area
+
+    return apportion_cell_areas(gdf_intersect, grid_cell_area)
+
+
+def compute_supersampled_weights(gdf_counties: gpd.GeoDataFrame,
+                                 raster_file: str,
+                                 set_county_id_name: str = 'FIPS',
+                                 supersample_factor: int = 10) -> pd.DataFrame:
+    """Approximate the intersection weights of 'compute_intersection_weights' by rasterizing the counties onto the
+    raster grid supersampled 'supersample_factor' times along each axis, rather than intersecting polygons.  Only the
+    window of the raster covering the counties is used.  See 'im3components.zonal.weight_error' to measure the
+    difference from the exact weights.
+
+    :param gdf_counties:                GeoDataFrame of county ids and geometries in the coordinate system of the
+                                        raster.
+    :type gdf_counties:                 gpd.GeoDataFrame
+
+    :param raster_file:                 Full path with file name and extension to a raster on the target grid.
+    :type raster_file:                  str
+
+    :param set_county_id_name:          Field name of the unique county identifier.
+    :type set_county_id_name:           str
+
+    :param supersample_factor:          Number of sub-cells along each axis of a grid cell.
+    :type supersample_factor:           int
+
+    :return:                            DataFrame of the 'cell_index', county, 'area', and 'weight' of each grid cell
+                                        county intersection
+
+    """
+    import rasterio
+
+    from im3components.zonal import supersampled_coverage
+
+    with rasterio.open(raster_file) as raster:
+        window = get_raster_window(raster, tuple(gdf_counties.total_bounds))
+        transform = raster.window_transform(window)
+        grid_cell_area = raster.res[0] * raster.res[1]
+        width = raster.width
+
+    coverage = supersampled_coverage(gdf_counties.geometry,
+                                     transform,
+                                     (window.height, window.width),
+                                     supersample_factor)
+
+    # index of each cell in the full raster
+    rows, columns = np.divmod(coverage['cell_index'].values, window.width)
+    df_intersect = pd.DataFrame({
+        'cell_index': (rows + window.row_off) * width + (columns + window.col_off),
+        set_county_id_name: gdf_counties[set_county_id_name].values[coverage['zone'].values],
+        'area': coverage['coverage'].values * grid_cell_area,
+    })
+
+    return apportion_cell_areas(df_intersect, grid_cell_area)
+
+
 def process_single_year(raster_file: str,
                         county_shapefile: str = None,
                         county_geodataframe: gpd.GeoDataFrame = None,
@@ -368,7 +798,10 @@ def process_single_year(raster_file: str,
                         state_id_field: str = 'STATEFP',
                         set_county_id_name: str = 'FIPS',
                         weights_file: str = None,
-                        target_year: int = None) -> pd.DataFrame:
+                        target_year: int = None,
+                        read_window: bool = False,
+                        weight_engine: str = 'overlay',
+                        supersample_factor: int = 10) -> pd.DataFrame:
     """Sum gridded population data by its spatially corresponding counties using a weighted area approach.  Each grid
     cell population value gets adjusted using the fraction of its area that is contained within a county.
 
@@ -425,18 +858,25 @@ def process_single_year(raster_file: str,
     :param target_year:                 The year to process in YYYY format.
     :type target_year:                  int
 
+    :param read_window:                 If True, only read the window of the raster covering the bounding box of the
+                                        counties of the state, e.g. from a national raster.  Cells outside of the
+                                        window are ignored rather than assigned to their nearest county.
+    :type read_window:                  bool
+
+    :param weight_engine:               How to weight the grid cells by county if no 'weights_file' is given; either
+                                        'overlay' to intersect the polygons exactly, or 'supersample' to rasterize the
+                                        counties onto a supersampled grid, which is much faster for fine grids.
+    :type weight_engine:                str
+
+    :param supersample_factor:          Number of sub-cells along each axis of a grid cell for the 'supersample'
+                                        engine.
+    :type supersample_factor:           int
+
     :return:                            A Pandas DataFrame of population data aggregated by the 'set_county_id_name'
                                         having fields and types of: {county_id_field: str, data_field_name: float}
 
     """
 
-    # raster data
-    gdf_raster, grid_cell_area = get_raster_data(raster_file=raster_file,
-                                                 data_field_name=data_field_name,
-                                                 drop_nan=drop_nan,
-                                                 x_coordinate_field=x_coordinate_field,
-                                                 y_coordinate_field=y_coordinate_field)
-
     # read in county polygon data
     gdf_counties = get_county_data(template_raster_file=raster_file,
                                    county_shapefile=county_shapefile,
@@ -446,50 +886,45 @@ def process_single_year(raster_file: str,
                                    set_county_id_name=set_county_id_name,
                                    state_name=state_name)
 
-    # if using a preexisting weights file
-    if weights_file is None:
+    # raster data
+    if read_window:
+        gdf_raster, grid_cell_area = get_raster_window_data(raster_file=raster_file,
+                                                            bounds=tuple(gdf_counties.total_bounds),
+                                                            data_field_name=data_field_name,
+                                                            drop_nan=drop_nan)
 
-        # intersect the counties data and the raster polygonized data
-        gdf_intersect = gpd.overlay(gdf_counties, gdf_raster, how='intersection')
+    else:
+        gdf_raster, grid_cell_area = get_raster_data(raster_file=raster_file,
+                                                     data_field_name=data_field_name,
+                                                     drop_nan=drop_nan,
+                                                     x_coordinate_field=x_coordinate_field,
+                                                     y_coordinate_field=y_coordinate_field)
 
-        # calculate the number of counties that each grid cell is a part of
-        gdf_intersect['cell_count'] = gdf_intersect['cell_index'].map(
-            gdf_intersect['cell_index'].value_counts().to_dict()
-        )
+    # if using a preexisting weights file
+    if (weights_file is None) and (weight_engine == 'supersample'):
 
-        # calculate the weighted area
-        gdf_intersect['area'] = gdf_intersect.area
-
-        # Where a fraction of the cell only exists in one county and the fraction of that grid cell
-        #   that is in the county is less than the grid cell total area, give the county the whole cell value.
-        #   This occurs when a grid cell is on the border of a county.
-        gdf_intersect['area'] = np.where((gdf_intersect['cell_count'] == 1) &
-                                         (gdf_intersect['area'] < grid_cell_area),
-                                         grid_cell_area,
-                                         gdf_intersect['area'])
-
-        # construct a dictionary of cell_index to total area per grid cell considering all counties
-        cell_to_area_dict = gdf_intersect.groupby('cell_index')['area'].sum().to_dict()
-
-        # Where a fraction of a grid cell is split between one or more counties and the area balance is less
-        #   than the total grid cell area, split the out of boundary area for the grid cell between the counties.
-        #   This occurs when county boundaries do not encompass the full grid cell.
-        gdf_intersect['area'] = gdf_intersect['area'] + (
-                (grid_cell_area - gdf_intersect['cell_index'].map(cell_to_area_dict)) / gdf_intersect['cell_count']
-        )
+        # approximate the weights and join population gridded values
+        gdf_intersect = pd.merge(left=compute_supersampled_weights(gdf_counties,
+                                                                   raster_file,
+                                                                   set_county_id_name,
+                                                                   supersample_factor),
+                                 right=gdf_raster,
+                                 on='cell_index')
 
-        # calculate the weighted area per grid cell county intersection
-        gdf_intersect['weight'] = gdf_intersect['area'] / grid_cell_area
+    elif weights_file is None:
+
+        # intersect the counties data and the raster polygonized data and weight each intersection by its area
+        gdf_intersect = compute_intersection_weights(gdf_counties, gdf_raster, grid_cell_area)
 
     else:
 
         # validate weights file and return as a DataFrame
         gdf_intersect = validate_weights_file(weights_file, set_county_id_name)
 
-        # join population gridded values
-        gdf_intersect = pd.merge(left=gdf_intersect,
-                                 right=gdf_raster,
-                                 on='cell_index')
+        # gather population gridded values by position rather than merging
+        positions = pd.Index(gdf_raster['cell_index']).get_indexer(gdf_intersect['cell_index'])
+        gdf_intersect = gdf_intersect.loc[positions >= 0].copy()
+        gdf_intersect[data_field_name] = gdf_raster[data_field_name].values[positions[positions >= 0]]
 
     # update original value with weighted value
     gdf_intersect[data_field_name] = gdf_intersect[data_field_name] * gdf_intersect['weight']
@@ -529,9 +964,9 @@ def process_single_year(raster_file: str,
 
             # write a weights file if one was not passed in
             if weights_file is None:
-                weights_file = os.path.join(output_directory, f'{state_name}_population_to_county_area_weights.csv')
-                target_fields = ['cell_index', set_county_id_name, 'weight']
-                gdf_intersect[target_fields].to_csv(weights_file, index=False)
+                weights_file = os.path.join(output_directory,
+                                            f'{state_name}_population_to_county_area_weights.parquet')
+                write_weights_file(gdf_intersect, weights_file, set_county_id_name)
 
             # make state name and scenario lower case and hyphen separated with no periods
             state_name = validate_string(state_name)
@@ -548,6 +983,138 @@ def process_single_year(raster_file: str,
     return df_county_sum
 
 
+def process_raster_stack(raster_list: List[str],
+                         year_list: List[int],
+                         county_shapefile: str = None,
+                         county_geodataframe: gpd.GeoDataFrame = None,
+                         state_name: str = None,
+                         drop_nan: bool = True,
+                         county_id_field: str = 'GEOID',
+                         state_id_field: str = 'STATEFP',
+                         set_county_id_name: str = 'FIPS',
+                         weights_file: str = None,
+                         read_window: bool = False,
+                         weight_engine: str = 'overlay',
+                         supersample_factor: int = 10) -> pd.DataFrame:
+    """Sum a stack of gridded population rasters on the same grid, one layer per year, by county in a single pass.  The
+    grid is polygonized, intersected with the counties, and checked for stranded grid cells once;  the weights are then
+    applied to every year at once as a sparse (county, grid cell) matrix.  The result matches 'process_single_year' for
+    each year.
+
+    :param raster_list:                 Either a single multi-band raster with a band per year, or a list of single band
+                                        rasters with one per year, as full paths with file name and extension.
+    :type raster_list:                  List[str]
+
+    :param year_list:                   List of years in YYYY format corresponding to the layers of the stack.
+    :type year_list:                    List[int]
+
+    :param county_shapefile:            Full path with file name and extension to the input counties shapefile.
+    :type county_shapefile:             str
+
+    :param county_geodataframe:         GeoDataFrame for counties if 'county_shapefile' is not passed.
+    :type county_geodataframe:          gpd.GeoDataFrame
+
+    :param state_name:                  Name of state to process.
+    :type state_name:                   str
+
+    :param drop_nan:                    Choice to drop all grid cells that are NaN (nodata in the raster) in every year.
+    :type drop_nan:                     bool
+
+    :param county_id_field:             Field name of the ID field present in the counties shapefile.  This field will
+                                        get renamed to the value of 'set_county_id_name'.
+    :type county_id_field:              str
+
+    :param state_id_field:              Field name of the state ID field present in the counties shapefile.
+    :type state_id_field:               str
+
+    :param set_county_id_name:          Field name to change the 'county_id_field' name to.
+    :type set_county_id_name:           str
+
+    :param weights_file:                Full path with file name and extension to an inputs file containing the
+                                        grid cell id (cell_index), the counties unique field name
+                                        (what 'set_county_id_name' was set to), and the weight ('weight).  If given,
+                                        this file will be used instead of running a new intersection.
+    :type weights_file:                 str
+
+    :param read_window:                 If True, only read the window of the rasters covering the bounding box of the
+                                        counties of the state.
+    :type read_window:                  bool
+
+    :param weight_engine:               How to weight the grid cells by county if no 'weights_file' is given; either
+                                        'overlay' or 'supersample', as for 'process_single_year'.
+    :type weight_engine:                str
+
+    :param supersample_factor:          Number of sub-cells along each axis of a grid cell for the 'supersample'
+                                        engine.
+    :type supersample_factor:           int
+
+    :return:                            A Pandas DataFrame of population data aggregated by the 'set_county_id_name'
+                                        having fields and types of: {county_id_field: str, year_0...n: float}
+
+    """
+    from scipy import sparse
+
+    # read in county polygon data
+    gdf_counties = get_county_data(template_raster_file=raster_list[0],
+                                   county_shapefile=county_shapefile,
+                                   county_geodataframe=county_geodataframe,
+                                   county_id_field=county_id_field,
+                                   state_id_field=state_id_field,
+                                   set_county_id_name=set_county_id_name,
+                                   state_name=state_name)
+
+    # raster data for every year, with a row per grid cell and a column per year
+    gdf_raster, values, grid_cell_area = get_raster_stack_data(
+        raster_list,
+        bounds=tuple(gdf_counties.total_bounds) if read_window else None,
+        drop_nan=drop_nan,
+    )
+
+    if values.shape[1] != len(year_list):
+        raise ValueError(f"The raster stack has {values.shape[1]} layers but {len(year_list)} years were given.")
+
+    if weights_file is not None:
+        operator, counties = load_weights_operator(weights_file, gdf_raster['cell_index'].values, set_county_id_name)
+
+    else:
+        if weight_engine == 'supersample':
+            df_weights = compute_supersampled_weights(gdf_counties, raster_list[0], set_county_id_name,
+                                                      supersample_factor)
+        else:
+            df_weights = compute_intersection_weights(gdf_counties, gdf_raster, grid_cell_area)
+
+        operator, counties = weights_operator(df_weights['cell_index'].values,
+                                              df_weights[set_county_id_name].values,
+                                              df_weights['weight'].values,
+                                              gdf_raster['cell_index'].values)
+
+    # give any stranded grid cells that did not intersect the counties to the nearest county, as
+    #   'validate_missing_cells' does for a single year
+    stranded = np.flatnonzero(np.diff(operator.tocsc().indptr) == 0)
+
+    if len(stranded) > 0:
+        nearest = np.array([
+            gdf_counties[set_county_id_name].values[np.argmin(gdf_counties.geometry.distance(geometry).values)]
+            for geometry in gdf_raster.geometry.values[stranded]
+        ], dtype=object)
+        keep = np.isin(nearest, counties)
+        operator = operator + sparse.csr_matrix((np.ones(keep.sum()),
+                                                 (np.searchsorted(counties, nearest[keep]), stranded[keep])),
+                                                shape=operator.shape)
+
+    # apply the weights to every year with one sparse matrix product
+    values = np.nan_to_num(values)
+    county_sums = operator @ values
+
+    # distribute the population allocation that occurs from weighting the area to balance with what was expected
+    county_sums += (values.sum(axis=0) - county_sums.sum(axis=0)) / len(counties)
+
+    df_county_sum = pd.DataFrame(county_sums, columns=[str(year) for year in year_list])
+    df_county_sum.insert(0, set_county_id_name, counties)
+
+    return df_county_sum
+
+
 def population_to_tell_counties(raster_list: List[str],
                                 county_shapefile: str,
                                 state_name: str = None,
@@ -560,7 +1127,13 @@ def population_to_tell_counties(raster_list: List[str],
                                 set_county_id_name: str = 'FIPS',
                                 weights_file: str = None,
                                 year_list: List[int] = None,
-                                n_jobs: int = -1) -> pd.DataFrame:
+                                n_jobs: int = -1,
+                                executor: Executor = None,
+                                read_window: bool = False,
+                                stack: bool = False,
+                                weight_engine: str = 'overlay',
+                                supersample_factor: int = 10,
+                                in_memory: bool = False) -> Union[pd.DataFrame, pa.Table]:
     """Sum gridded population data by its spatially corresponding counties using a weighted area approach.  Each grid
     cell population value gets adjusted using the fraction of its area that is contained within a county.  This
     processes all years for a given state in parallel.
@@ -624,27 +1197,111 @@ def population_to_tell_counties(raster_list: List[str],
                                         https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html
     :type n_jobs:                       int
 
+    :param executor:                    Optional executor, such as a shared 'im3components.workers.WorkerPool' or a
+                                        'distributed.Client' of a dask cluster, to process the years on instead of a
+                                        new joblib pool.  The county geometries are read once and shared with its
+                                        workers.  If given, 'n_jobs' is ignored.
+    :type executor:                     concurrent.futures.Executor
+
+    :param read_window:                 If True, only read the window of each raster covering the bounding box of the
+                                        counties of the state, e.g. from national rasters.  Cells outside of the window
+                                        are ignored rather than assigned to their nearest county.
+    :type read_window:                  bool
+
+    :param stack:                       If True, process the rasters as a single stack on the same grid in one pass,
+                                        computing the county weights once for every year rather than once per year.
+                                        'raster_list' is then either one multi-band raster with a band per year or a
+                                        list of single band rasters, and 'n_jobs' and 'executor' are ignored.
+    :type stack:                        bool
+
+    :param weight_engine:               How to weight the grid cells by county if no 'weights_file' is given; either
+                                        'overlay' to intersect the polygons exactly, or 'supersample' to rasterize the
+                                        counties onto a supersampled grid, which is much faster for fine grids.
+    :type weight_engine:                str
+
+    :param supersample_factor:          Number of sub-cells along each axis of a grid cell for the 'supersample'
+                                        engine.
+    :type supersample_factor:           int
+
+    :param in_memory:                   If True, return the result as a 'pyarrow.Table' with the schema of the output
+                                        file, for handing over to other components in the same process.  The file is
+                                        still written if 'output_directory' is given.
+    :type in_memory:                    bool
+
     :return:                            A Pandas DataFrame of population data aggregated by the 'set_county_id_name'
-                                        having fields and types of: {county_id_field: str, year_0...n: float}
+                                        having fields and types of: {county_id_field: str, year_0...n: float}, or the
+                                        same as a 'pyarrow.Table' if 'in_memory' is True
 
     """
 
+    from joblib import Parallel, delayed
+
+    from im3components.workers import file_key, map_tasks, share
+
+    if weight_engine not in ('overlay', 'supersample'):
+        raise ValueError(f"Unknown weight engine '{weight_engine}'; expected 'overlay' or 'supersample'.")
+
+    # process all years in one pass
+    if stack:
+        results = [process_raster_stack(raster_list=raster_list,
+                                        year_list=year_list,
+                                        county_shapefile=county_shapefile,
+                                        state_name=state_name,
+                                        drop_nan=drop_nan,
+                                        county_id_field=county_id_field,
+                                        set_county_id_name=set_county_id_name,
+                                        weights_file=weights_file,
+                                        read_window=read_window,
+                                        weight_engine=weight_engine,
+                                        supersample_factor=supersample_factor)]
+
     # run all years in parallel
-    results = Parallel(n_jobs=n_jobs)(
-        delayed(process_single_year)(
-            raster_file=i,
-            county_shapefile=county_shapefile,
-            county_geodataframe=None,  # gdf_counties,
-            data_field_name=str(year_list[idx]),  # set year as data field name
-            x_coordinate_field=x_coordinate_field,
-            y_coordinate_field=y_coordinate_field,
-            drop_nan=drop_nan,
-            state_name=state_name,
-            county_id_field=county_id_field,
-            set_county_id_name=set_county_id_name,
-            weights_file=weights_file
-        ) for idx, i in enumerate(raster_list)
-    )
+    elif executor is None:
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(process_single_year)(
+                raster_file=i,
+                county_shapefile=county_shapefile,
+                county_geodataframe=None,  # gdf_counties,
+                data_field_name=str(year_list[idx]),  # set year as data field name
+                x_coordinate_field=x_coordinate_field,
+                y_coordinate_field=y_coordinate_field,
+                drop_nan=drop_nan,
+                state_name=state_name,
+                county_id_field=county_id_field,
+                set_county_id_name=set_county_id_name,
+                weights_file=weights_file,
+                read_window=read_window,
+                weight_engine=weight_engine,
+                supersample_factor=supersample_factor
+            ) for idx, i in enumerate(raster_list)
+        )
+
+    else:
+        # read the counties of the state once, in the projection of the rasters, and share them with the workers
+        key = file_key(f'counties:{state_name}:{county_id_field}:{set_county_id_name}', county_shapefile, raster_list[0])
+        shared_counties = share(executor, get_county_data(template_raster_file=raster_list[0],
+                                                          county_shapefile=county_shapefile,
+                                                          county_id_field=county_id_field,
+                                                          set_county_id_name=set_county_id_name,
+                                                          state_name=state_name), key=key)
+
+        results = map_tasks(executor, process_single_year, (
+            dict(
+                raster_file=i,
+                county_geodataframe=shared_counties,
+                data_field_name=str(year_list[idx]),
+                x_coordinate_field=x_coordinate_field,
+                y_coordinate_field=y_coordinate_field,
+                drop_nan=drop_nan,
+                state_name=state_name,
+                county_id_field=county_id_field,
+                set_county_id_name=set_county_id_name,
+                weights_file=weights_file,
+                read_window=read_window,
+                weight_engine=weight_engine,
+                supersample_factor=supersample_factor
+            ) for idx, i in enumerate(raster_list)
+        ))
 
     # aggregate results into a single DataFrame
     for idx, i in enumerate(results):
@@ -670,4 +1327,9 @@ def population_to_tell_counties(raster_list: List[str],
         else:
             raise NotADirectoryError(f"Argument 'output_directory' setting '{output_directory}' is not a directory.")
 
+    if in_memory:
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(df_result, preserve_index=False)
+
     return df_result
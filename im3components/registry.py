@@ -1,16 +1,21 @@
-from dataclasses import dataclass, field
+from dataclasses import asdict
 from enum import Enum
+from contextlib import contextmanager
 import importlib
-import pkg_resources
-import r_functions as rfn
-from typing import List
+import inspect
+import json
+import os
+from typing import Dict, List
+import warnings
 from yaml import load
 try:
     from yaml import CLoader as Loader
 except ImportError:
     from yaml import Loader
 
+from im3components.instrumentation import instrument
 from im3components.taxonomy import Component
+from im3components.utils import available_memory_mb, get_cache_directory
 
 
 class AssetType(Enum):
@@ -20,26 +25,262 @@ class AssetType(Enum):
     DataSet = 'DataSet'
 
 
-def load_from_yaml(asset_type: AssetType):
-    base_path = f'data/taxonomy/{asset_type.value.casefold()}'
+# components already loaded in this process, keyed by taxonomy directory and its signature
+_LOADED = {}
+
+
+def taxonomy_directory(asset_type: AssetType) -> str:
+    """Return the path to the directory of taxonomy YAML files for an asset type."""
+
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'taxonomy', asset_type.value.casefold())
+
+
+def directory_signature(directory: str) -> list:
+    """Return the name, modification time, and size of each YAML file in a directory, used to invalidate caches.
+
+    :param directory:            path to the directory
+    :type directory:             str
+
+    """
+
+    return sorted(
+        [entry.name, entry.stat().st_mtime_ns, entry.stat().st_size]
+        for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(('.yaml', '.yml'))
+    )
+
+
+def load_from_yaml(asset_type: AssetType, directory: str = None):
+    """Parse every taxonomy YAML file of an asset type.
+
+    :param asset_type:           type of asset to load
+    :type asset_type:            AssetType
+
+    :param directory:            path to the directory of YAML files; defaults to the package taxonomy directory
+    :type directory:             str
+
+    """
+
+    if directory is None:
+        directory = taxonomy_directory(asset_type)
     assets = []
     if asset_type:
-        resources = pkg_resources.resource_listdir('im3components', base_path)
-        for resource in resources:
-            resource_string = pkg_resources.resource_string('im3components', f'{base_path}/{resource}')
+        for resource, _, _ in directory_signature(directory):
+            with open(os.path.join(directory, resource), 'r') as f:
+                resource_string = f.read()
             assets.append(
                 load(
-                    f"!!python/object:im3components.taxonomy.{asset_type.value}\n{resource_string.decode('utf-8')}",
+                    f"!!python/object:im3components.taxonomy.{asset_type.value}\n{resource_string}",
                     Loader=Loader
                 )
             )
     return assets
 
 
-@dataclass
-class Registry:
+def load_components(directory: str = None, cache_directory: str = None, use_cache: bool = True) -> List[Component]:
+    """Load the registered components, reusing a compiled JSON cache while the taxonomy files are unchanged.
+
+    :param directory:            path to the directory of component YAML files; defaults to the package taxonomy
+    :type directory:             str
+
+    :param cache_directory:      directory in which to keep the compiled cache; defaults to the package cache
+    :type cache_directory:       str
+
+    :param use_cache:            if False, always parse the YAML files
+    :type use_cache:             bool
+
+    """
+
+    if directory is None:
+        directory = taxonomy_directory(AssetType.Component)
+
+    if not use_cache:
+        return load_from_yaml(AssetType.Component, directory)
+
+    signature = directory_signature(directory)
+    key = (os.path.abspath(directory), json.dumps(signature))
+
+    if key in _LOADED:
+        return _LOADED[key]
+
+    cache_file = os.path.join(get_cache_directory(cache_directory), 'component_registry.json')
+
+    components = None
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        if (cache.get('directory') == key[0]) and (cache.get('signature') == signature):
+            components = [Component(**c) for c in cache['components']]
+    except (OSError, ValueError, TypeError, KeyError):
+        pass
+
+    if components is None:
+        components = load_from_yaml(AssetType.Component, directory)
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump({
+                    'directory': key[0],
+                    'signature': signature,
+                    'components': [asdict(c) for c in components],
+                }, f)
+        except OSError as e:
+            warnings.warn(f"Unable to cache the component registry to '{cache_file}':  {e}")
 
-    components: List[Component] = field(default_factory=lambda: load_from_yaml(AssetType.Component))
+    _LOADED[key] = components
+
+    return components
+
+
+PROFILES_FILE = 'component_profiles.jsonl'
+
+
+def record_profile(profile: dict, cache_directory: str = None):
+    """Append the measured profile of a component run to the profiles file in the cache directory.
+
+    :param profile:              measurements of the run, including the 'component' name
+    :type profile:               dict
+
+    :param cache_directory:      directory holding the profiles file; defaults to the package cache
+    :type cache_directory:       str
+
+    """
+
+    profiles_file = os.path.join(get_cache_directory(cache_directory), PROFILES_FILE)
+
+    try:
+        with open(profiles_file, 'a') as f:
+            f.write(json.dumps(profile) + '\n')
+    except OSError as e:
+        warnings.warn(f"Unable to record the component profile to '{profiles_file}':  {e}")
+
+
+def read_profiles(cache_directory: str = None) -> List[dict]:
+    """Read the measured profiles of past component runs.
+
+    :param cache_directory:      directory holding the profiles file; defaults to the package cache
+    :type cache_directory:       str
+
+    """
+
+    profiles_file = os.path.join(get_cache_directory(cache_directory), PROFILES_FILE)
+
+    if not os.path.isfile(profiles_file):
+        return []
+
+    profiles = []
+    with open(profiles_file, 'r') as f:
+        for line in f:
+            try:
+                profile = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(profile, dict):
+                profiles.append(profile)
+
+    return profiles
+
+
+class Registry:
+    """Registry of components, loaded on first access and indexed by name and related assets.
+
+    :param components:           components to register; if None, the taxonomy is loaded on first access
+    :type components:            List[Component]
+
+    :param directory:            path to the directory of component YAML files; defaults to the package taxonomy
+    :type directory:             str
+
+    :param cache_directory:      directory in which to keep the compiled registry cache; defaults to the package cache
+    :type cache_directory:       str
+
+    :param use_cache:            if False, always parse the taxonomy YAML files
+    :type use_cache:             bool
+
+    :param record_profiles:      if True, the measurements of each 'run' are appended to a profiles file in the cache
+                                 directory, from which 'metadata' summarizes the recorded runs; off by default, since
+                                 the file grows with every run
+    :type record_profiles:       bool
+
+    :param instrumentation_log:  optional JSON lines file to which to also write the measurements of each 'run'
+    :type instrumentation_log:   str
+
+    :param profiler:             optional profiler to capture each 'run' with, either 'cprofile' or 'pyinstrument'
+    :type profiler:              str
+
+    :param cache:                opt in to reusing the results of 'run' when a component is called again with the same
+                                 arguments and unchanged input files; either True to use the default store or a
+                                 'ResultCache'
+    :type cache:                 Union[bool, im3components.cache.ResultCache]
+
+    :param executor:             optional executor, such as an 'im3components.workers.WorkerPool', passed to every
+                                 component run that takes an 'executor' argument and is not given one
+    :type executor:              concurrent.futures.Executor
+
+    """
+
+    def __init__(
+            self,
+            components: List[Component] = None,
+            directory: str = None,
+            cache_directory: str = None,
+            use_cache: bool = True,
+            record_profiles: bool = False,
+            instrumentation_log: str = None,
+            profiler: str = None,
+            cache=None,
+            executor=None,
+    ):
+        self._components = components
+        self.directory = directory
+        self.cache_directory = cache_directory
+        self.use_cache = use_cache
+        self.record_profiles = record_profiles
+        self.instrumentation_log = instrumentation_log
+        self.profiler = profiler
+
+        if cache is True:
+            from im3components.cache import ResultCache
+            cache = ResultCache(os.path.join(get_cache_directory(cache_directory), 'results'))
+        self.cache = cache or None
+        self.executor = executor
+        self._by_name = None
+        self._duplicates = None
+        self._search_text = None
+        self._related = {}
+
+    @property
+    def components(self) -> List[Component]:
+        """All registered components, loaded on first access."""
+
+        if self._components is None:
+            self._components = list(load_components(self.directory, self.cache_directory, self.use_cache))
+
+        return self._components
+
+    def _build_index(self):
+        """Index the components by name and by the text searched for related assets."""
+
+        self._by_name = {}
+        self._duplicates = set()
+        self._search_text = {}
+
+        for c in self.components:
+            if c.name in self._by_name:
+                self._duplicates.add(c.name)
+            self._by_name[c.name] = c
+            self._search_text[c.name] = ' '.join(
+                (c.tags if c.tags is not None else []) +
+                (c.from_models if c.from_models is not None else []) +
+                (c.to_models if c.to_models is not None else []) +
+                ([c.language] if c.language is not None else [])
+            ).casefold()
+
+    @property
+    def index(self) -> Dict[str, Component]:
+        """Components by name."""
+
+        if self._by_name is None:
+            self._build_index()
+
+        return self._by_name
 
     def list_related(self, asset: str) -> list:
         """List all components that are related to the target asset.
@@ -49,49 +290,177 @@ class Registry:
 
         """
 
-        return [c.name for c in self.components if c.is_related(asset)]
+        search = asset.casefold()
+
+        if search not in self._related:
+            if self._search_text is None:
+                self._build_index()
+            self._related[search] = [name for name, text in self._search_text.items() if search in text]
+
+        return list(self._related[search])
+
+    def is_related(self, component_name: str, asset: str) -> bool:
+        """Whether a component is related to the target asset.
+
+        :param component_name:       name of the component
+        :type component_name:        str
+
+        :param asset:                name of the asset
+        :type asset:                 str
+
+        """
+
+        return component_name in self.list_related(asset)
 
     def list_registry(self) -> list:
         """Return a list of all registered components."""
 
         return [i.name for i in self.components]
 
+    def get_spec(self, component_name: str) -> Component:
+        """Return the taxonomy entry of a component by its name."""
+
+        spec = self.index.get(component_name)
+
+        if spec is None:
+            msg = f"Component name '{component_name}' does not match any in the current registry."
+            raise KeyError(msg)
+
+        if component_name in self._duplicates:
+            msg = f"There are duplicate entries for the name '{component_name} which is not allowed."
+            raise AttributeError(msg)
+
+        return spec
+
     def get_component(self, component_name: str):
         """Return a component function by its name."""
 
-        # dict of class or function objects related to the target component name
-        protocol = [[i.package.strip(), i.method.strip(), i.language.strip()] for i in self.components if i.name == component_name]
+        spec = self.get_spec(component_name)
+        package, method, language = spec.package.strip(), spec.method.strip(), spec.language.strip()
 
-        # expected condition where there is one function
-        if len(protocol) == 1:
-            package, method, language = protocol[0]
+        # if using R or Julia, call the function in a persistent session from the shared pool of the language
+        if language.casefold() in ('r', 'julia'):
+            from im3components.runtime import get_pool
 
-            # if using R
-            if language.casefold() == 'r':
+            # split package name out of object oriented spec to locate the source file
+            package_split = package.split('.')
+            package_root = os.path.dirname(importlib.import_module(package_split[0]).__file__)
+            extension = '.R' if language.casefold() == 'r' else '.jl'
+            file_path = f"{os.path.join(package_root, *package_split[1:])}{extension}"
 
-                # split package name out of object oriented spec to use r_functions call
-                package_split = package.split('.')
-                package_path = '/'.join(package_split[1:])
-                file_path = pkg_resources.resource_filename(package_split[0], f'{package_path}.R')
+            return get_pool(language).create(file_path, method)
 
-                return rfn.create(file_path, method)
+        # if Python
+        else:
+            return getattr(importlib.import_module(package), method)
 
-            # if Python
-            else:
-                return getattr(importlib.import_module(package), method)
+    def pipeline(self, stages: list):
+        """Build a pipeline of stages that run components from this registry.
 
-        elif len(protocol) == 0:
-            msg = f"Component name '{component_name}' does not match any in the current registry."
-            raise KeyError(msg)
+        :param stages:               stages of the pipeline
+        :type stages:                List[im3components.executor.Stage]
 
-        else:
-            msg = f"There are duplicate entries for the name '{component_name} which is not allowed."
-            raise AttributeError(msg)
+        """
 
-    def metadata(self):
-        """Report component metadata for the target."""
+        from im3components.executor import Pipeline
 
-        pass
+        return Pipeline(stages, registry=self)
+
+    @contextmanager
+    def workers(self, max_workers: int = None, **kwargs):
+        """Context in which every 'run' of a component that takes an 'executor' argument reuses one pool of worker
+        processes, e.g. 'with registry.workers(8) as pool:'.  The pool is shut down when the context exits.
+
+        :param max_workers:          number of worker processes; defaults to the number of CPUs
+        :type max_workers:           int
+
+        :param kwargs:               other arguments of 'im3components.workers.WorkerPool', e.g. 'preload'
+
+        """
+
+        from im3components.workers import WorkerPool
+
+        previous = self.executor
+        pool = WorkerPool(max_workers=max_workers, **kwargs)
+        self.executor = pool
+
+        try:
+            yield pool
+        finally:
+            self.executor = previous
+            pool.shutdown()
+
+    def metadata(self, component_name: str = None) -> dict:
+        """Report the taxonomy entry, performance hints, and measured profile summary of a component.
+
+        :param component_name:       name of the component; if None, the metadata of every component is returned by name
+        :type component_name:        str
+
+        :return:                     dictionary with the fields of the component, where 'performance' holds the
+                                     declared resource hints and 'profile' the number of recorded runs and their mean
+                                     and maximum seconds, mean CPU seconds, and maximum peak memory in megabytes
+
+        """
+
+        profiles = {}
+        for profile in read_profiles(self.cache_directory):
+            profiles.setdefault(profile.get('component'), []).append(profile)
+
+        def summarize(name: str) -> dict:
+            runs = profiles.get(name, [])
+            if not runs:
+                return {'runs': 0}
+            seconds = [r['seconds'] for r in runs]
+            memory = [r['peak_memory_mb'] for r in runs if r.get('peak_memory_mb') is not None]
+            return {
+                'runs': len(runs),
+                'mean_seconds': sum(seconds) / len(seconds),
+                'max_seconds': max(seconds),
+                'mean_cpu_seconds': sum(r['cpu_seconds'] for r in runs) / len(runs),
+                'max_peak_memory_mb': max(memory) if memory else None,
+                'last_run': max(r['time'] for r in runs),
+            }
+
+        if component_name is None:
+            return {name: self.metadata(name) for name in self.list_registry()}
+
+        return {**asdict(self.get_spec(component_name)), 'profile': summarize(component_name)}
+
+    def resources(self, component_name: str, units: int = None) -> dict:
+        """Recommend the number of workers and the number of units to hold in memory at once for a component, from its
+        memory per unit, whether it is parallel safe, the number of CPUs, and the memory available.
+
+        :param component_name:       name of the component
+        :type component_name:        str
+
+        :param units:                optional number of units of work, which bounds both recommendations
+        :type units:                 int
+
+        :return:                     dictionary with 'workers' and 'chunk_size'; 'chunk_size' is None if the memory
+                                     per unit is unknown
+
+        """
+
+        performance = self.get_spec(component_name).performance
+        workers = os.cpu_count() or 1
+        chunk_size = None
+
+        if performance is not None:
+
+            if not performance.parallel_safe:
+                workers = 1
+
+            available = available_memory_mb()
+            if performance.memory_per_unit_mb and available:
+                # leave headroom for the parent process and the operating system
+                chunk_size = max(1, int(0.8 * available // performance.memory_per_unit_mb))
+                workers = min(workers, chunk_size)
+
+        if units is not None:
+            workers = max(1, min(workers, units))
+            chunk_size = None if chunk_size is None else max(1, min(chunk_size, units))
+
+        return {'workers': workers, 'chunk_size': chunk_size}
 
     # TODO:  setup help call on R functions
     def help(self, component_name: str):
@@ -102,12 +471,64 @@ class Registry:
         return help(fn)
 
     def run(self, component_name: str, *args, **kwargs):
-        """Launch run of component."""
-
-        fn = self.get_component(component_name=component_name)
+        """Launch run of component, reusing a cached result if the registry has a result cache.
 
-        return fn(*args, **kwargs)
+        If the component declares arguments for its number of workers or chunk size and they are not given, they are
+        set from the recommendation of 'resources'.  If the registry has an executor, e.g. within 'workers', it is passed
+        to components that take an 'executor' argument.
 
+        """
 
-def registry():
-    return Registry()
+        fn = self.get_component(component_name=component_name)
+        performance = self.get_spec(component_name).performance
+        resource_arguments = []
+
+        # the executor changes where the work runs, not its result
+        ignore = ['executor']
+
+        try:
+            parameters = inspect.signature(fn).parameters
+            given = inspect.signature(fn).bind_partial(*args, **kwargs).arguments
+        except (TypeError, ValueError):
+            parameters, given = {}, {}
+
+        if (self.executor is not None) and ('executor' in parameters) and ('executor' not in given):
+            kwargs['executor'] = self.executor
+
+        if performance is not None:
+            recommended = None
+            for argument, key in ((performance.workers_argument, 'workers'), (performance.chunk_argument, 'chunk_size')):
+                if argument is None:
+                    continue
+                resource_arguments.append(argument)
+                if (argument in parameters) and (argument not in given):
+                    recommended = recommended or self.resources(component_name)
+                    if recommended[key] is not None:
+                        kwargs[argument] = recommended[key]
+
+        instrumentation = instrument(
+            component_name,
+            log_file=self.instrumentation_log,
+            profiler=self.profiler,
+            metadata={
+                'component': component_name,
+                **{argument: kwargs[argument] for argument in resource_arguments if argument in kwargs},
+            },
+        )
+
+        try:
+            with instrumentation:
+                if self.cache is not None:
+                    outputs = (performance.output_arguments or None) if performance is not None else None
+                    return self.cache.run(component_name, fn, args, kwargs, ignore=resource_arguments + ignore,
+                                          outputs=outputs)
+                return fn(*args, **kwargs)
+
+        finally:
+            # there is no record if the instrumentation itself failed to start
+            if self.record_profiles and (instrumentation.record is not None):
+                record_profile(instrumentation.record, self.cache_directory)
+
+
+def registry(**kwargs):
+    return Registry(**kwargs)
@@ -0,0 +1,491 @@
+import atexit
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from typing import Any, Callable, Dict, List
+
+
+# marks the lines of the session output that carry a response, so that output printed by components passes through
+RESPONSE_MARKER = '\x1eIM3COMPONENTS\x1e'
+
+# serves function calls read as JSON lines from standard input, keeping each sourced file in its own environment;
+# data frames are exchanged as Feather files if the arrow package is installed, otherwise as JSON columns
+R_SERVER = """
+marker <- commandArgs(trailingOnly = TRUE)[1]
+input <- file("stdin", "r")
+sourced <- new.env()
+has_arrow <- requireNamespace("arrow", quietly = TRUE)
+
+read_column <- function(column) {
+  if (length(column) == 0) return(logical(0))
+  unlist(lapply(column, function(v) if (is.null(v)) NA else v))
+}
+
+read_argument <- function(argument) {
+  if (!is.null(argument$frame)) {
+    return(as.data.frame(arrow::read_feather(argument$frame)))
+  }
+  if (!is.null(argument$columns)) {
+    return(as.data.frame(lapply(argument$columns, read_column), stringsAsFactors = FALSE, check.names = FALSE))
+  }
+  return(argument$value)
+}
+
+# tell the session how data frames are exchanged
+cat(marker, jsonlite::toJSON(list(status = "ready", arrow = has_arrow), auto_unbox = TRUE), "\\n", sep = "")
+flush(stdout())
+
+repeat {
+  line <- readLines(input, n = 1)
+  if (length(line) == 0) break
+
+  response <- tryCatch({
+    request <- jsonlite::fromJSON(line, simplifyVector = FALSE)
+
+    # source each file once, again only if it changes
+    source_file <- normalizePath(request$source)
+    modified <- as.character(file.mtime(source_file))
+    cached <- sourced[[source_file]]
+    if (is.null(cached) || !identical(cached$modified, modified)) {
+      env <- new.env(parent = globalenv())
+      sys.source(source_file, envir = env)
+      cached <- list(env = env, modified = modified)
+      assign(source_file, cached, envir = sourced)
+    }
+
+    arguments <- lapply(request$arguments, read_argument)
+    names(arguments) <- vapply(request$arguments, function(a) if (is.null(a$name)) "" else a$name, "")
+    output <- do.call(get(request$`function`, envir = cached$env), arguments)
+
+    if (is.data.frame(output) && has_arrow) {
+      arrow::write_feather(output, request$output)
+      list(status = "ok", frame = TRUE)
+    } else if (is.data.frame(output)) {
+      list(status = "ok", frame = TRUE, columns = lapply(as.list(output), I))
+    } else {
+      list(status = "ok", frame = FALSE, value = output)
+    }
+  }, error = function(e) list(status = "error", message = conditionMessage(e)))
+
+  cat(marker, jsonlite::toJSON(response, auto_unbox = TRUE, force = TRUE, na = "null", null = "null", digits = NA),
+      "\\n", sep = "")
+  flush(stdout())
+}
+"""
+
+# the Julia equivalent of R_SERVER; requires the JSON and Arrow packages
+JULIA_SERVER = """
+using JSON
+using Arrow
+
+marker = ARGS[1]
+sourced = Dict{String, Tuple{Float64, Module}}()
+
+read_argument(argument) = haskey(argument, "frame") ? Arrow.Table(argument["frame"]) : argument["value"]
+
+for line in eachline(stdin)
+    response = try
+        request = JSON.parse(line)
+
+        # include each file once, again only if it changes
+        source_file = abspath(request["source"])
+        modified = mtime(source_file)
+        if !haskey(sourced, source_file) || sourced[source_file][1] != modified
+            m = Module()
+            Base.include(m, source_file)
+            sourced[source_file] = (modified, m)
+        end
+        m = sourced[source_file][2]
+
+        positional = [read_argument(a) for a in request["arguments"] if a["name"] === nothing]
+        named = [Symbol(a["name"]) => read_argument(a) for a in request["arguments"] if a["name"] !== nothing]
+        output = Base.invokelatest(getfield(m, Symbol(request["function"])), positional...; named...)
+
+        if Arrow.Tables.istable(output)
+            Arrow.write(request["output"], output)
+            Dict("status" => "ok", "frame" => true)
+        else
+            Dict("status" => "ok", "frame" => false, "value" => output)
+        end
+    catch e
+        Dict("status" => "error", "message" => sprint(showerror, e))
+    end
+
+    println(marker, JSON.json(response))
+    flush(stdout)
+end
+"""
+
+
+class Session:
+    """A persistent interpreter process that sources each component file once and then serves calls to its functions.
+
+    Arguments and return values are exchanged as JSON, except for data frames which are exchanged as Arrow Feather
+    files, or as JSON columns if the interpreter reports on starting that it cannot read them.  A session serves one
+    call at a time; use a 'RuntimePool' to make concurrent calls.
+
+    :param executable:           name of or path to the interpreter; defaults to the executable of the language
+    :type executable:            str
+
+    """
+
+    executable = None
+    arguments = []
+    server = None
+    server_file_name = None
+
+    # whether the server reports on starting whether it can exchange data frames as Feather files
+    handshake = False
+
+    def __init__(self, executable: str = None):
+        if executable is not None:
+            self.executable = executable
+        self.directory = None
+        self.process = None
+        self.arrow = True
+
+    @property
+    def is_alive(self) -> bool:
+        """Whether the interpreter process is running."""
+
+        return (self.process is not None) and (self.process.poll() is None)
+
+    def start(self):
+        """Start the interpreter process."""
+
+        if shutil.which(self.executable) is None:
+            raise FileNotFoundError(f"The executable '{self.executable}' was not found.  Please ensure it is installed "
+                                    "and on the PATH.")
+
+        self.directory = tempfile.mkdtemp(prefix='im3components_runtime_')
+        server_file = os.path.join(self.directory, self.server_file_name)
+        with open(server_file, 'w') as f:
+            f.write(self.server)
+
+        self.process = subprocess.Popen(
+            [self.executable, *self.arguments, server_file, RESPONSE_MARKER],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+
+        if self.handshake:
+            self.arrow = bool(self._read_response().get('arrow', False))
+
+    def close(self):
+        """Stop the interpreter process and remove its working files."""
+
+        if self.process is not None:
+            if self.is_alive:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def _write_frame(self, frame) -> str:
+        """Write a pandas DataFrame or Arrow Table to a Feather file in the session directory and return its path."""
+
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        if not isinstance(frame, pa.Table):
+            frame = pa.Table.from_pandas(frame, preserve_index=False)
+
+        path = os.path.join(self.directory, f'{uuid.uuid4().hex}.feather')
+        feather.write_feather(frame, path)
+
+        return path
+
+    def _encode_argument(self, name: str, value: Any, frame_files: List[str]) -> dict:
+        """Encode an argument for the request, writing data frames to Feather files."""
+
+        if is_frame(value) and self.arrow:
+            frame_files.append(self._write_frame(value))
+            return {'name': name, 'frame': frame_files[-1]}
+
+        if is_frame(value):
+            frame = value if type(value).__module__.startswith('pandas') else value.to_pandas()
+            return {'name': name, 'columns': {str(c): json.loads(frame[c].to_json(orient='values')) for c in frame}}
+
+        return {'name': name, 'value': value}
+
+    def call(self, source_file: str, function_name: str, *args, **kwargs) -> Any:
+        """Call a function from a source file and return its output.
+
+        :param source_file:          full path to the source file defining the function
+        :type source_file:           str
+
+        :param function_name:        name of the function to call
+        :type function_name:         str
+
+        :return:                     the output of the function; data frames are returned as pandas DataFrames
+
+        """
+
+        if not self.is_alive:
+            self.close()
+            self.start()
+
+        frame_files = []
+        output_file = os.path.join(self.directory, f'{uuid.uuid4().hex}.feather')
+        request = {
+            'source': os.path.abspath(source_file),
+            'function': function_name,
+            'arguments': [self._encode_argument(None, value, frame_files) for value in args] +
+                         [self._encode_argument(name, value, frame_files) for name, value in kwargs.items()],
+            'output': output_file,
+        }
+
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            response = self._read_response()
+
+            if response['status'] != 'ok':
+                raise RuntimeError(f"Calling '{function_name}' from '{source_file}' failed:  {response['message']}")
+
+            if response.get('columns') is not None:
+                return frame_from_columns(response['columns'])
+
+            if response['frame']:
+                import pyarrow.feather as feather
+                return feather.read_table(output_file).to_pandas()
+
+            return response.get('value')
+
+        finally:
+            for path in frame_files + [output_file]:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def _read_response(self) -> dict:
+        """Read the next response from the interpreter, passing any other output through to standard output."""
+
+        while True:
+            line = self.process.stdout.readline()
+            if line == '':
+                self.close()
+                raise RuntimeError(f"The '{self.executable}' session exited unexpectedly.")
+            if line.startswith(RESPONSE_MARKER):
+                return json.loads(line[len(RESPONSE_MARKER):])
+            sys.stdout.write(line)
+
+
+class RSession(Session):
+    """A persistent R session; requires the 'jsonlite' package.  Data frames are exchanged as Feather files if the
+    'arrow' package is installed, otherwise as JSON."""
+
+    executable = 'Rscript'
+    server = R_SERVER
+    server_file_name = 'server.R'
+    handshake = True
+
+
+class JuliaSession(Session):
+    """A persistent Julia session; requires the 'JSON' and 'Arrow' packages."""
+
+    executable = 'julia'
+    arguments = ['--startup-file=no']
+    server = JULIA_SERVER
+    server_file_name = 'server.jl'
+
+
+SESSIONS = {
+    'r': RSession,
+    'julia': JuliaSession,
+}
+
+
+def frame_from_columns(columns: Dict[str, list]):
+    """Build a pandas DataFrame from data frame columns returned as JSON."""
+
+    import pandas as pd
+
+    return pd.DataFrame(columns)
+
+
+def is_frame(value: Any) -> bool:
+    """Whether a value is exchanged as a data frame, i.e. it is a pandas DataFrame or an Arrow Table."""
+
+    module = type(value).__module__.split('.')[0]
+
+    return (module in ('pandas', 'pyarrow')) and (type(value).__name__ in ('DataFrame', 'Table'))
+
+
+class RuntimePool:
+    """A pool of persistent interpreter sessions for one language, started as needed and reused across calls.
+
+    :param language:             language of the sessions, i.e. 'R' or 'Julia'
+    :type language:              str
+
+    :param size:                 maximum number of sessions, and so of concurrent calls
+    :type size:                  int
+
+    :param executable:           name of or path to the interpreter; defaults to the executable of the language
+    :type executable:            str
+
+    """
+
+    def __init__(self, language: str, size: int = 2, executable: str = None):
+
+        if language.casefold() not in SESSIONS:
+            raise ValueError(f"There is no runtime for the language '{language}'.  Options are:  {list(SESSIONS)}")
+
+        if size < 1:
+            raise ValueError(f"The pool size must be at least 1, not {size}.")
+
+        self.language = language
+        self.size = size
+        self.executable = executable
+        self._sessions = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Session:
+        """Take an idle session, starting a new one if none is idle and the pool is not full."""
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._sessions) < self.size:
+                session = SESSIONS[self.language.casefold()](self.executable)
+                self._sessions.append(session)
+                return session
+
+        return self._idle.get()
+
+    def _release(self, session: Session):
+        """Return a session to the idle queue, or stop it if the pool has been shrunk below its number of sessions."""
+
+        with self._lock:
+            if len(self._sessions) > self.size:
+                self._sessions.remove(session)
+                session.close()
+                return
+
+        self._idle.put(session)
+
+    def resize(self, size: int):
+        """Change the maximum number of sessions in place.  Idle sessions beyond the new size are stopped at once, and
+        sessions in use when they are returned, so calls in progress on other threads are not interrupted.
+
+        :param size:                 maximum number of sessions, and so of concurrent calls
+        :type size:                  int
+
+        """
+
+        if size < 1:
+            raise ValueError(f"The pool size must be at least 1, not {size}.")
+
+        with self._lock:
+            self.size = size
+            while len(self._sessions) > self.size:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._sessions.remove(session)
+                session.close()
+
+    def call(self, source_file: str, function_name: str, *args, **kwargs) -> Any:
+        """Call a function from a source file on an idle session and return its output.
+
+        :param source_file:          full path to the source file defining the function
+        :type source_file:           str
+
+        :param function_name:        name of the function to call
+        :type function_name:         str
+
+        """
+
+        session = self._acquire()
+        try:
+            return session.call(source_file, function_name, *args, **kwargs)
+        finally:
+            self._release(session)
+
+    def create(self, source_file: str, function_name: str) -> Callable:
+        """Create a Python function bound to a function from a source file, called on this pool.
+
+        :param source_file:          full path to the source file defining the function
+        :type source_file:           str
+
+        :param function_name:        name of the function to call
+        :type function_name:         str
+
+        """
+
+        def component(*args, **kwargs):
+            return self.call(source_file, function_name, *args, **kwargs)
+
+        component.__name__ = function_name
+        component.__doc__ = f"Call '{function_name}' from '{source_file}' in a persistent {self.language} session."
+
+        return component
+
+    def close(self):
+        """Stop every session of the pool."""
+
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._idle = queue.LifoQueue()
+
+
+# pools shared by the registry, keyed by language, and the lock guarding them
+_POOLS: Dict[str, RuntimePool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(language: str, size: int = None) -> RuntimePool:
+    """Return the shared session pool of a language, creating it on first use.
+
+    :param language:             language of the sessions, i.e. 'R' or 'Julia'
+    :type language:              str
+
+    :param size:                 maximum number of sessions; defaults to the 'IM3COMPONENTS_RUNTIME_POOL_SIZE'
+                                 environment variable if set, otherwise 2.  Changing the size of an existing pool
+                                 resizes it in place, without stopping sessions in use.
+    :type size:                  int
+
+    """
+
+    if size is None:
+        size = int(os.environ.get('IM3COMPONENTS_RUNTIME_POOL_SIZE', 2))
+
+    key = language.casefold()
+
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = RuntimePool(language, size)
+        elif pool.size != size:
+            pool.resize(size)
+
+    return pool
+
+
+@atexit.register
+def close_pools():
+    """Stop every session of the shared pools."""
+
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
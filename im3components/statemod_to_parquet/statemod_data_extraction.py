@@ -9,12 +9,12 @@
 # SBATCH --job-name xdd_to_parquet
 
 import concurrent.futures.thread
+from concurrent.futures import Executor
+from contextlib import nullcontext
 import argparse
-import dask.dataframe as dd
 from glob import glob
 from importlib.util import find_spec, module_from_spec
 import io
-from joblib import Parallel, delayed
 import logging
 import numpy as np
 import pandas as pd
@@ -40,7 +40,8 @@ class StateModDataExtractor:
             glob_to_xdd: str = None,
             xdd_files: Iterable[str] = None,
             allow_overwrite: bool = False,
-            has_mpi: bool = False
+            has_mpi: bool = False,
+            executor: Executor = None
     ):
 
         # path to file with the structure ids of interest separated by newlines
@@ -71,6 +72,9 @@ class StateModDataExtractor:
         # is mpi in use and loaded
         self.use_mpi = has_mpi
 
+        # optional executor to reuse instead of a new joblib pool, e.g. a WorkerPool shared with other components
+        self.executor = executor
+
         # expected data format
         self.metadata_rows = np.arange(1, 12)
         self.id_column = 0
@@ -111,6 +115,12 @@ class StateModDataExtractor:
         # the line separator counts as an extra character, hence the +1
         self.expected_line_size = self.expected_column_sizes.sum() + 1
 
+    def __getstate__(self):
+        # the executor is only used by the process running `extract`, and is not sent to its workers
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
     def parse_xdd_file(self, file_path: str) -> bool:
         """Parses a StateMod xdd file into a parquet file.
 
@@ -213,6 +223,8 @@ class StateModDataExtractor:
             bool: a boolean indicating whether aggregation was successful (True means success)
         """
 
+        import dask.dataframe as dd
+
         try:
             df = dd.read_parquet(
                 Path(f'{self.temporary_path}/S*_*.parquet'),
@@ -321,18 +333,25 @@ class StateModDataExtractor:
         # if so, use mpi4py
         # if not, use joblib
         if self.use_mpi:
-            context = futures.MPIPoolExecutor
+            context = futures.MPIPoolExecutor()
             logging.info(f"Running with mpi4py; world size =  {mpi.COMM_WORLD.Get_size()}.")
+        elif self.executor is not None:
+            # the executor is owned by the caller, so it is not shut down here
+            context = nullcontext(self.executor)
+            logging.info(f"Running with the given {type(self.executor).__name__}.")
         else:
-            context = Parallel
+            from joblib import Parallel, delayed
+            context = Parallel(n_jobs=-1, temp_folder=self.temporary_path)
             logging.info("Running with joblib.")
 
-        with context(**(dict() if self.use_mpi else dict(n_jobs=-1, temp_folder=self.temporary_path))) as executor:
+        with context as executor:
 
             # create the temporary files per xdd file
             logging.info('Creating temporary parquet files per xdd.')
             if self.use_mpi:
                 successful_xdd = executor.map(self.parse_xdd_file, files, unordered=True)
+            elif self.executor is not None:
+                successful_xdd = list(executor.map(self.parse_xdd_file, files))
             else:
                 successful_xdd = executor(delayed(self.parse_xdd_file)(file) for file in files)
             # check how many failed
@@ -348,6 +367,8 @@ class StateModDataExtractor:
                     self.ids_of_interest,
                     unordered=True
                 )
+            elif self.executor is not None:
+                successful_structure_id = list(executor.map(self.create_file_per_structure_id, self.ids_of_interest))
             else:
                 successful_structure_id = executor(
                     delayed(self.create_file_per_structure_id)(structure_id) for structure_id in self.ids_of_interest
@@ -0,0 +1,487 @@
+"""Synthetic inputs of configurable size for the components, used by the benchmarks and tests.
+
+Every generator is deterministic for a given seed.  The WRF grid, the county grid, and the population raster are laid
+out over the same region so that the outputs of one can be passed to the next, e.g. the counties of
+'write_county_shapefile' cover the interior of the grid of 'write_wrf_file'.
+
+"""
+
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Lambert conformal projection of the WRF grid, matching the attributes written to the file
+WRF_PROJECTION = dict(proj='lcc', lat_1=30., lat_2=45., lat_0=40., lon_0=-97., x_0=0, y_0=0, a=6370000, b=6370000)
+
+# default center of the generated region, in Alabama
+CENTER = (-86.6, 32.6)
+
+# variables written by WRF and aggregated by the TELL components, with the precisions they are aggregated to
+WRF_VARIABLES = ['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW']
+WRF_PRECISIONS = [2, 5, 2, 2, 2, 2]
+
+# projection of the gridded population rasters, USA Contiguous Albers Equal Area Conic
+POPULATION_CRS = 'ESRI:102003'
+POPULATION_NODATA = -3.4028234663852886e+38
+
+# fixed width layout of the StateMod xdd data rows:  id, river id, year, month, 29 values, and two trailing fields
+XDD_VALUE_COUNT = 29
+XDD_MONTHS = ['OCT', 'NOV', 'DEC', 'JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP']
+
+
+def wrf_coordinates(ny: int, nx: int, dx: float = 12000., center: Tuple[float, float] = CENTER) -> tuple:
+    """Longitude and latitude of the cell centers of a WRF-like Lambert conformal grid.
+
+    :param ny:                   number of cells south to north
+    :type ny:                    int
+
+    :param nx:                   number of cells west to east
+    :type nx:                    int
+
+    :param dx:                   cell size in meters
+    :type dx:                    float
+
+    :param center:               longitude and latitude of the center of the grid
+    :type center:                Tuple[float, float]
+
+    :return:                     [0] array of longitude with shape (ny, nx)
+                                 [1] array of latitude with shape (ny, nx)
+
+    """
+
+    import pyproj
+
+    proj = pyproj.Proj(**WRF_PROJECTION)
+    cx, cy = proj(*center)
+    xx, yy = np.meshgrid(cx + (np.arange(nx) - (nx - 1) / 2) * dx, cy + (np.arange(ny) - (ny - 1) / 2) * dx)
+
+    return proj(xx, yy, inverse=True)
+
+
+def wrf_bounds(ny: int, nx: int, dx: float = 12000., center: Tuple[float, float] = CENTER) -> tuple:
+    """Longitude and latitude bounds that lie inside a WRF-like grid, one cell in from its edges.
+
+    :return:                     west, south, east, and north bounds in degrees
+
+    """
+
+    lon, lat = wrf_coordinates(ny, nx, dx, center)
+    margin = 1 if min(ny, nx) > 2 else 0
+
+    return (
+        lon[:, margin].max(),
+        lat[margin, :].max(),
+        lon[:, -1 - margin].min(),
+        lat[-1 - margin, :].min(),
+    )
+
+
+def write_wrf_file(
+        path: str,
+        start: str = '2019-01-01 01:00',
+        n_times: int = 3,
+        ny: int = 6,
+        nx: int = 8,
+        variables: Sequence[str] = ('T2', 'Q2'),
+        dx: float = 12000.,
+        center: Tuple[float, float] = CENTER,
+        offset: float = 0.,
+        n_members: int = None,
+) -> str:
+    """Write a WRF-like NetCDF file of hourly data on a Lambert conformal grid.  The value of the i-th variable
+    increases steadily from (i + 1) * 100 + offset over the cells and times, so that means are easy to check.
+
+    :param path:                 full path of the file to write
+    :type path:                  str
+
+    :param start:                first time in the file
+    :type start:                 str
+
+    :param n_times:              number of hourly times
+    :type n_times:               int
+
+    :param ny:                   number of cells south to north
+    :type ny:                    int
+
+    :param nx:                   number of cells west to east
+    :type nx:                    int
+
+    :param variables:            names of the variables to write
+    :type variables:             Sequence[str]
+
+    :param dx:                   cell size in meters
+    :type dx:                    float
+
+    :param center:               longitude and latitude of the center of the grid
+    :type center:                Tuple[float, float]
+
+    :param offset:               value added to every variable
+    :type offset:                float
+
+    :param n_members:            if given, the variables have a leading 'member' dimension of this size, as in an
+                                 ensemble, and each member adds 10 times its index to the offset
+    :type n_members:             int
+
+    :return:                     the path written
+
+    """
+
+    import netCDF4
+
+    lon, lat = wrf_coordinates(ny, nx, dx, center)
+
+    with netCDF4.Dataset(path, 'w') as nc:
+        nc.createDimension('Time', None)
+        nc.createDimension('DateStrLen', 19)
+        nc.createDimension('south_north', ny)
+        nc.createDimension('west_east', nx)
+        nc.setncatts(dict(
+            MAP_PROJ=1, TRUELAT1=WRF_PROJECTION['lat_1'], TRUELAT2=WRF_PROJECTION['lat_2'],
+            STAND_LON=WRF_PROJECTION['lon_0'], MOAD_CEN_LAT=WRF_PROJECTION['lat_0'], CEN_LAT=center[1],
+            CEN_LON=center[0], DX=dx, DY=dx, TITLE='OUTPUT FROM WRF V4', GRIDTYPE='C',
+        ))
+        times = pd.date_range(start, periods=n_times, freq='H').strftime('%Y-%m-%d_%H:%M:%S')
+        nc.createVariable('Times', 'S1', ('Time', 'DateStrLen'))[:] = netCDF4.stringtochar(np.array(times, dtype='S19'))
+        for name, values in (('XLAT', lat), ('XLONG', lon)):
+            nc.createVariable(name, 'f4', ('Time', 'south_north', 'west_east'))[:] = np.broadcast_to(
+                values, (n_times, ny, nx))
+        if n_members is not None:
+            nc.createDimension('member', n_members)
+        for i, name in enumerate(variables):
+            values = offset + (i + 1) * 100 + np.arange(n_times * ny * nx).reshape(n_times, ny, nx) / (ny * nx)
+            if n_members is None:
+                nc.createVariable(name, 'f4', ('Time', 'south_north', 'west_east'))[:] = values
+            else:
+                nc.createVariable(name, 'f4', ('member', 'Time', 'south_north', 'west_east'))[:] = (
+                    values + 10 * np.arange(n_members)[:, np.newaxis, np.newaxis, np.newaxis]
+                )
+
+    return path
+
+
+def county_fips(n_counties: int, state_fips: str = '01') -> List[str]:
+    """FIPS codes of the synthetic counties of a state, as five character strings.
+
+    :param n_counties:           number of counties, at most 999
+    :type n_counties:            int
+
+    :param state_fips:           two character FIPS code of the state
+    :type state_fips:            str
+
+    """
+
+    if not 0 < n_counties < 1000:
+        raise ValueError(f'The number of counties must be between 1 and 999, not {n_counties}.')
+
+    return [f'{state_fips}{i:03d}' for i in range(1, n_counties + 1)]
+
+
+def write_county_shapefile(
+        path: str,
+        n_rows: int,
+        n_columns: int,
+        bounds: Tuple[float, float, float, float] = None,
+        state_fips: str = '01',
+) -> str:
+    """Write a shapefile of a grid of rectangular counties in NAD83 longitude and latitude, with the 'STATEFP' and
+    'GEOID' fields of the Census TIGER county files.
+
+    :param path:                 full path of the shapefile to write
+    :type path:                  str
+
+    :param n_rows:               number of rows of counties
+    :type n_rows:                int
+
+    :param n_columns:            number of columns of counties
+    :type n_columns:             int
+
+    :param bounds:               west, south, east, and north bounds of the grid; defaults to the interior of the
+                                 default WRF grid
+    :type bounds:                Tuple[float, float, float, float]
+
+    :param state_fips:           two character FIPS code of the state
+    :type state_fips:            str
+
+    :return:                     the path written
+
+    """
+
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    west, south, east, north = wrf_bounds(6, 8) if bounds is None else bounds
+    xs = np.linspace(west, east, n_columns + 1)
+    ys = np.linspace(south, north, n_rows + 1)
+
+    geoids = county_fips(n_rows * n_columns, state_fips)
+    geometry = [box(xs[j], ys[i], xs[j + 1], ys[i + 1]) for i in range(n_rows) for j in range(n_columns)]
+
+    gpd.GeoDataFrame({
+        'STATEFP': state_fips,
+        'COUNTYFP': [g[2:] for g in geoids],
+        'GEOID': geoids,
+    }, geometry=geometry, crs='EPSG:4269').to_file(path)
+
+    return path
+
+
+def write_population_raster(
+        path: str,
+        n_rows: int,
+        n_columns: int,
+        bounds: Tuple[float, float, float, float] = None,
+        nodata_fraction: float = 0.,
+        seed: int = 0,
+) -> str:
+    """Write a single band GeoTIFF of gridded population in USA Contiguous Albers Equal Area Conic, covering the
+    given longitude and latitude bounds.
+
+    :param path:                 full path of the raster to write
+    :type path:                  str
+
+    :param n_rows:               number of rows of cells
+    :type n_rows:                int
+
+    :param n_columns:            number of columns of cells
+    :type n_columns:             int
+
+    :param bounds:               west, south, east, and north bounds in degrees; defaults to the interior of the
+                                 default WRF grid
+    :type bounds:                Tuple[float, float, float, float]
+
+    :param nodata_fraction:      fraction of cells to set to nodata
+    :type nodata_fraction:       float
+
+    :param seed:                 seed of the random population values
+    :type seed:                  int
+
+    :return:                     the path written
+
+    """
+
+    import rasterio
+    from rasterio.transform import from_bounds
+    from rasterio.warp import transform_bounds
+
+    bounds = wrf_bounds(6, 8) if bounds is None else bounds
+    west, south, east, north = transform_bounds('EPSG:4269', POPULATION_CRS, *bounds)
+
+    rng = np.random.default_rng(seed)
+    data = rng.gamma(2., 50., size=(n_rows, n_columns)).astype(np.float32)
+    data[rng.random((n_rows, n_columns)) < nodata_fraction] = POPULATION_NODATA
+
+    with rasterio.open(
+            path,
+            'w',
+            driver='GTiff',
+            height=n_rows,
+            width=n_columns,
+            count=1,
+            dtype='float32',
+            crs=POPULATION_CRS,
+            transform=from_bounds(west, south, east, north, n_columns, n_rows),
+            nodata=POPULATION_NODATA,
+    ) as raster:
+        raster.write(data, 1)
+
+    return path
+
+
+def write_county_data_directory(
+        directory: str,
+        fips: Sequence[str],
+        start: str = '2019-01-01 01:00',
+        n_hours: int = 24,
+        suffix: str = '_County_Mean_Meteorology',
+        variables: Sequence[str] = tuple(WRF_VARIABLES),
+        skip_hours: Sequence[int] = (),
+        seed: int = 0,
+) -> List[str]:
+    """Write a directory of hourly county mean CSV files, as written by 'wrf_to_tell_counties'.
+
+    :param directory:            directory to write the files to; created if needed
+    :type directory:             str
+
+    :param fips:                 FIPS codes of the counties
+    :type fips:                  Sequence[str]
+
+    :param start:                first hour
+    :type start:                 str
+
+    :param n_hours:              number of hours
+    :type n_hours:               int
+
+    :param suffix:               string appended to the timestamp of each file name
+    :type suffix:                str
+
+    :param variables:            names of the variables
+    :type variables:             Sequence[str]
+
+    :param skip_hours:           indices of hours to leave out, e.g. to exercise 'fill_missing_hours'
+    :type skip_hours:            Sequence[int]
+
+    :param seed:                 seed of the random values
+    :type seed:                  int
+
+    :return:                     full paths of the files written
+
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    fips = np.array([int(f) for f in fips])
+    skip_hours = set(skip_hours)
+
+    files = []
+    for i, t in enumerate(pd.date_range(start, periods=n_hours, freq='H')):
+        if i in skip_hours:
+            continue
+        df = pd.DataFrame({'FIPS': fips})
+        for j, variable in enumerate(variables):
+            df[variable] = np.round((j + 1) * 100 + rng.random(len(fips)), 5)
+        file = os.path.join(directory, f'{t.strftime("%Y_%m_%d_%H_UTC")}{suffix}.csv')
+        df.to_csv(file, index=False)
+        files.append(file)
+
+    return files
+
+
+def write_balancing_authority_mapping(path: str, fips: Sequence[str], n_balancing_authorities: int) -> str:
+    """Write a CSV file mapping counties to balancing authorities, with the 'County_FIPS', 'BA_Code', and 'BA_Number'
+    columns read by 'wrf_to_tell_balancing_authorities'.  Counties are assigned to balancing authorities in turn.
+
+    :param path:                 full path of the file to write
+    :type path:                  str
+
+    :param fips:                 FIPS codes of the counties
+    :type fips:                  Sequence[str]
+
+    :param n_balancing_authorities:  number of balancing authorities
+    :type n_balancing_authorities:   int
+
+    :return:                     the path written
+
+    """
+
+    numbers = 10000 + np.arange(len(fips)) % n_balancing_authorities
+
+    pd.DataFrame({
+        'County_FIPS': [int(f) for f in fips],
+        'BA_Number': numbers,
+        'BA_Code': [f'BA{n - 10000:03d}' for n in numbers],
+    }).to_csv(path, index=False)
+
+    return path
+
+
+def write_county_population(path: str, fips: Sequence[str], years: Sequence[int], seed: int = 0) -> str:
+    """Write a CSV file of historical county population, with 'county_FIPS' and 'pop_YYYY' columns.
+
+    :param path:                 full path of the file to write
+    :type path:                  str
+
+    :param fips:                 FIPS codes of the counties
+    :type fips:                  Sequence[str]
+
+    :param years:                years of population
+    :type years:                 Sequence[int]
+
+    :param seed:                 seed of the random population values
+    :type seed:                  int
+
+    :return:                     the path written
+
+    """
+
+    rng = np.random.default_rng(seed)
+    base = rng.integers(1000, 1000000, len(fips))
+
+    df = pd.DataFrame({'county_FIPS': [int(f) for f in fips]})
+    for i, year in enumerate(years):
+        df[f'pop_{year}'] = np.round(base * (1.01 ** i)).astype(int)
+    df.to_csv(path, index=False)
+
+    return path
+
+
+def xdd_line(structure_id: str, year: int, month: str, values: Sequence[float]) -> str:
+    """Format one fixed width data row of a StateMod xdd file."""
+
+    return (
+        f'{structure_id:<11}{" " + structure_id:<13}{year:>5}{month:>5}'
+        + ''.join(f'{value:.0f}.'.rjust(8) for value in values)
+        + ' NA'.ljust(13) + '-1.000'.rjust(12) + '\n'
+    )
+
+
+def write_xdd_files(
+        directory: str,
+        n_structures: int,
+        n_files: int,
+        n_years: int = 10,
+        start_year: int = 1909,
+        sample: int = 1,
+        seed: int = 0,
+) -> Tuple[str, List[str]]:
+    """Write StateMod xdd files of monthly water rights data, one per realization of a sample, and a file of their
+    structure ids.  Each water year of each structure is written as a block of rows from October to September
+    followed by a total row, as in the files written by StateMod.
+
+    :param directory:            directory to write the files to; created if needed
+    :type directory:             str
+
+    :param n_structures:         number of structures in each file
+    :type n_structures:          int
+
+    :param n_files:              number of files, i.e. realizations
+    :type n_files:               int
+
+    :param n_years:              number of water years of each structure
+    :type n_years:               int
+
+    :param start_year:           first water year
+    :type start_year:            int
+
+    :param sample:               sample number written into the file names
+    :type sample:                int
+
+    :param seed:                 seed of the random values
+    :type seed:                  int
+
+    :return:                     [0] full path to the file of structure ids
+                                 [1] full paths to the xdd files
+
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    structure_ids = [f'{5100000 + i}' for i in range(n_structures)]
+    separator = ' '.join(['_' * 11, '_' * 12, '_' * 4, '_' * 4] + ['_' * 7] * XDD_VALUE_COUNT) + '\n'
+
+    ids_file = os.path.join(directory, 'structure_ids.txt')
+    with open(ids_file, 'w') as f:
+        f.write('\n'.join(structure_ids) + '\n')
+
+    xdd_files = []
+    for realization in range(1, n_files + 1):
+        xdd_file = os.path.join(directory, f'synthetic_S{sample}_{realization}.xdd')
+        with open(xdd_file, 'w') as f:
+            f.write('#\n# *.xdd       Diversion Summary\n#\n')
+            for structure_id in structure_ids:
+                f.write(f'\n    STRUCTURE ID (0 = total)  : {structure_id}\n\n')
+                for year in range(start_year, start_year + n_years):
+                    values = rng.integers(0, 10000, (len(XDD_MONTHS), XDD_VALUE_COUNT))
+                    for month, row in zip(XDD_MONTHS, values):
+                        # the water year starts in October of the previous calendar year
+                        calendar_year = year - 1 if month in ('OCT', 'NOV', 'DEC') else year
+                        f.write(xdd_line(structure_id, calendar_year, month, row))
+                    f.write(separator)
+                    f.write(xdd_line(structure_id, year, 'TOT', values.sum(axis=0)))
+        xdd_files.append(xdd_file)
+
+    return ids_file, xdd_files
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 
 class Language(Enum):
@@ -10,6 +10,40 @@ class Language(Enum):
     bash = 'Bash'
 
 
+class Executor(Enum):
+    joblib = 'joblib'
+    mpi = 'MPI'
+    dask = 'dask'
+
+
+@dataclass
+class Performance:
+    """Resource hints for running a component.
+
+    :param unit:                    what one unit of work is, e.g. a WRF time slice or a population raster
+    :param memory_per_unit_mb:      expected peak memory in megabytes to process one unit in one worker
+    :param parallel_safe:           whether units may be processed by concurrent workers
+    :param executor:                preferred parallel executor; one of the values of Executor
+    :param workers_argument:        name of the argument that sets the number of workers, e.g. 'n_jobs'
+    :param chunk_argument:          name of the argument that sets the number of units held in memory at once
+    :param output_arguments:        names of the arguments naming files or directories the component only writes; the
+                                    result cache keys them by path and restores what the component wrote to them.
+                                    Files the component reads when they exist, e.g. a weights file, are inputs
+    """
+
+    unit: Optional[str] = None
+    memory_per_unit_mb: Optional[float] = None
+    parallel_safe: bool = True
+    executor: Optional[str] = None
+    workers_argument: Optional[str] = None
+    chunk_argument: Optional[str] = None
+    output_arguments: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if (self.executor is not None) and (self.executor not in [e.value for e in Executor]):
+            raise ValueError(f"Executor '{self.executor}' is not one of {[e.value for e in Executor]}.")
+
+
 @dataclass
 class Component:
     name: str
@@ -20,6 +54,16 @@ class Component:
     from_models: List[str] = field(default_factory=list)
     to_models: List[str] = field(default_factory=list)
     tags: List[str] = field(default_factory=list)
+    performance: Optional[Performance] = None
+
+    def __post_init__(self):
+        if isinstance(self.performance, dict):
+            self.performance = Performance(**self.performance)
+
+    def __setstate__(self, state: dict):
+        # used when loading from YAML, which does not call __init__
+        self.__dict__.update(state)
+        self.__post_init__()
 
     def is_related(self, search: str):
         return search.casefold() in ' '.join(
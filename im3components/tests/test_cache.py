@@ -0,0 +1,185 @@
+import os
+import tempfile
+import time
+import unittest
+
+import im3components as cmp
+from im3components.cache import ResultCache
+from im3components.taxonomy import Component, Performance
+
+
+CALLS = []
+
+
+def count_lines(input_file, output_directory, prefix='lines'):
+    CALLS.append(input_file)
+    with open(input_file, 'r') as f:
+        n = len(f.readlines())
+    with open(os.path.join(output_directory, f'{prefix}.txt'), 'w') as f:
+        f.write(str(n))
+    return n
+
+
+def count_weighted_lines(input_file, weights_file):
+    CALLS.append(input_file)
+    if not os.path.isfile(weights_file):
+        with open(weights_file, 'w') as f:
+            f.write('2')
+    with open(input_file, 'r') as f, open(weights_file, 'r') as g:
+        return len(f.readlines()) * int(g.read())
+
+
+def write_lines(input_file, destination):
+    CALLS.append(input_file)
+    with open(input_file, 'r') as f, open(destination, 'w') as g:
+        g.write(f.read())
+    return destination
+
+
+def total_lines(data_directory, output_directory):
+    CALLS.append(data_directory)
+    n = sum(len(open(os.path.join(data_directory, name)).readlines())
+            for name in sorted(os.listdir(data_directory)) if name.endswith('.txt'))
+    with open(os.path.join(output_directory, 'total.csv'), 'w') as f:
+        f.write(str(n))
+    return n
+
+
+def apply(fn, x):
+    CALLS.append(x)
+    return fn(x)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.directory.name, 'input.txt')
+        self.output_directory = os.path.join(self.directory.name, 'output')
+        os.makedirs(self.output_directory)
+        with open(self.input_file, 'w') as f:
+            f.write('a\nb\n')
+        self.cache = ResultCache(os.path.join(self.directory.name, 'store'))
+        self.registry = cmp.registry(
+            components=[
+                Component(name=name, description='', language='Python', package=__name__, method=name)
+                for name in ['count_lines', 'count_weighted_lines', 'total_lines', 'apply']
+            ] + [
+                Component(name='write_lines', description='', language='Python', package=__name__,
+                          method='write_lines', performance=Performance(output_arguments=['destination'])),
+            ],
+            cache_directory=self.directory.name,
+            cache=self.cache,
+        )
+        CALLS.clear()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit(self):
+        """Ensure an unchanged call is served from the cache and restores the files it wrote."""
+
+        self.assertEqual(2, self.registry.run('count_lines', self.input_file, self.output_directory))
+
+        output_file = os.path.join(self.output_directory, 'lines.txt')
+        os.remove(output_file)
+
+        self.assertEqual(2, self.registry.run('count_lines', input_file=self.input_file,
+                                              output_directory=self.output_directory))
+        self.assertEqual(1, len(CALLS))
+        self.assertTrue(os.path.isfile(output_file))
+        self.assertEqual({'hits': 1, 'misses': 1}, {k: self.cache.stats[k] for k in ['hits', 'misses']})
+        self.assertEqual(1, self.cache.entries()['hits'].iloc[0])
+
+    def test_miss(self):
+        """Ensure changed arguments or input files are recomputed."""
+
+        self.registry.run('count_lines', self.input_file, self.output_directory)
+        self.registry.run('count_lines', self.input_file, self.output_directory, prefix='other')
+
+        time.sleep(0.01)
+        with open(self.input_file, 'a') as f:
+            f.write('c\n')
+
+        self.assertEqual(3, self.registry.run('count_lines', self.input_file, self.output_directory))
+        self.assertEqual(3, len(CALLS))
+
+        # content hashes ignore a change of modification time alone
+        cache = ResultCache(os.path.join(self.directory.name, 'hashed'), fingerprint='hash')
+        cache.run('count_lines', count_lines, (self.input_file, self.output_directory))
+        os.utime(self.input_file, (0, 0))
+        cache.run('count_lines', count_lines, (self.input_file, self.output_directory))
+        self.assertEqual(4, len(CALLS))
+
+    def test_declared_outputs(self):
+        """Ensure a declared output created by the first run keeps the key stable and is restored on a hit."""
+
+        destination = os.path.join(self.directory.name, 'copy.txt')
+        self.registry.run('write_lines', self.input_file, destination)
+        self.registry.run('write_lines', self.input_file, destination)
+        self.assertEqual(1, len(CALLS))
+
+        os.remove(destination)
+        self.registry.run('write_lines', self.input_file, destination)
+        self.assertEqual(1, len(CALLS))
+        self.assertTrue(os.path.isfile(destination))
+
+    def test_read_or_create(self):
+        """Ensure a file read when it exists, such as a weights file, is keyed as an input and never restored over."""
+
+        weights_file = os.path.join(self.directory.name, 'weights.txt')
+        self.assertEqual(4, self.registry.run('count_weighted_lines', self.input_file, weights_file))
+        self.assertEqual(4, self.registry.run('count_weighted_lines', self.input_file, weights_file))
+        self.assertEqual(4, self.registry.run('count_weighted_lines', self.input_file, weights_file))
+        self.assertEqual(2, len(CALLS))
+
+        # weights regenerated for another grid are not mistaken for the old ones, nor overwritten by them
+        time.sleep(0.01)
+        with open(weights_file, 'w') as f:
+            f.write('3')
+        self.assertEqual(6, self.registry.run('count_weighted_lines', self.input_file, weights_file))
+        self.assertEqual(3, len(CALLS))
+        with open(weights_file, 'r') as f:
+            self.assertEqual('3', f.read())
+
+    def test_shared_directory(self):
+        """Ensure a component reading and writing the same directory gets hits while its inputs are unchanged."""
+
+        data_file = os.path.join(self.output_directory, 'data.txt')
+        with open(data_file, 'w') as f:
+            f.write('a\nb\nc\n')
+
+        self.assertEqual(3, self.registry.run('total_lines', self.output_directory, self.output_directory))
+        self.assertEqual(3, self.registry.run('total_lines', self.output_directory, self.output_directory))
+        self.assertEqual(1, len(CALLS))
+
+        time.sleep(0.01)
+        with open(data_file, 'a') as f:
+            f.write('d\n')
+        self.assertEqual(4, self.registry.run('total_lines', self.output_directory, self.output_directory))
+        self.assertEqual(2, len(CALLS))
+
+    def test_eviction(self):
+        """Ensure the least recently used results are evicted beyond the maximum size."""
+
+        self.cache.max_size = 1
+        for x in range(3):
+            self.registry.run('apply', abs, x)
+
+        self.assertEqual(1, self.cache.stats['entries'])
+        self.assertEqual(2, self.cache.stats['evictions'])
+
+        self.registry.run('apply', abs, 2)
+        self.registry.run('apply', abs, 0)
+        self.assertEqual([0, 1, 2, 0], CALLS)
+
+    def test_uncacheable(self):
+        """Ensure calls with arguments that cannot be fingerprinted still run."""
+
+        self.assertEqual(2, self.registry.run('apply', lambda x: x + 1, 1))
+        self.assertEqual(2, self.registry.run('apply', lambda x: x + 1, 1))
+        self.assertEqual(2, self.cache.stats['uncacheable'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from geopandas.testing import assert_geodataframe_equal
+
+import im3components.county_geometry as cg
+from im3components import synthetic
+
+
+class TestCountyGeometry(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.shapefile = synthetic.write_county_shapefile(self.path('counties.shp'), 2, 3)
+        self.arguments = dict(crs='EPSG:5070', columns=['GEOID'], rename={'GEOID': 'FIPS'},
+                              cache_directory=self.path('cache'))
+
+    def tearDown(self):
+        cg._COUNTIES.clear()
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_load_county_geometries_cache(self):
+        """Ensure the processed counties are cached by source hash and target CRS and reloaded unchanged."""
+
+        expected = cg.read_county_geometries(self.shapefile, 'EPSG:5070', ['GEOID'], {'GEOID': 'FIPS'})
+        counties = cg.load_county_geometries(self.shapefile, spatial_index=True, **self.arguments)
+
+        assert_geodataframe_equal(expected, counties)
+        self.assertTrue(counties.has_sindex)
+        self.assertIs(counties, cg.load_county_geometries(self.shapefile, **self.arguments))
+        self.assertEqual(1, len(os.listdir(self.path('cache'))))
+
+        # read back from disk rather than the in process copy
+        cg._COUNTIES.clear()
+        assert_geodataframe_equal(expected, cg.load_county_geometries(self.shapefile, **self.arguments))
+
+        # another CRS is another entry
+        cg.load_county_geometries(self.shapefile, **dict(self.arguments, crs='EPSG:4326'))
+        self.assertEqual(2, len(os.listdir(self.path('cache'))))
+
+    def test_source_changes(self):
+        """Ensure a changed shapefile is not served from the cache."""
+
+        key = cg.source_hash(self.shapefile)
+        cg.load_county_geometries(self.shapefile, **self.arguments)
+
+        synthetic.write_county_shapefile(self.shapefile, 3, 3)
+        self.assertNotEqual(key, cg.source_hash(self.shapefile))
+        self.assertEqual(9, len(cg.load_county_geometries(self.shapefile, **self.arguments)))
+
+        with self.assertRaises(KeyError):
+            cg.load_county_geometries(self.shapefile, **dict(self.arguments, columns=['NAME']))
+
+
+if __name__ == '__main__':
+    unittest.main()
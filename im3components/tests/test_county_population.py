@@ -0,0 +1,72 @@
+import os
+import pkg_resources
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import im3components.county_population as cp
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import get_county_population
+
+
+class TestCountyPopulation(unittest.TestCase):
+
+    HISTORICAL_FILE = pkg_resources.resource_filename(
+        'im3components', 'tests/data/wrf_to_tell/county_populations_2000_to_2019.csv')
+    FUTURE_FILE = pkg_resources.resource_filename('im3components', 'tests/data/wrf_to_tell/ssp3_county_population.csv')
+
+    def test_build_population_table(self):
+        """Ensure the table has every year and interpolates linearly between decades."""
+
+        table = cp.build_population_table(TestCountyPopulation.FUTURE_FILE)
+
+        self.assertEqual(list(range(2020, 2101)), table.index.tolist())
+        self.assertEqual([53033, 53035], table.columns.tolist())
+
+        expected = 2179295.3681802894 + 0.9 * (2165722.928815113 - 2179295.3681802894)
+        self.assertAlmostEqual(expected, table.loc[2069, 53033])
+
+    def test_load_population_table_cache(self):
+        """Ensure the table is cached by input hash and reloaded unchanged."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            table = cp.load_population_table(TestCountyPopulation.HISTORICAL_FILE, cache_directory=tmp_dir)
+
+            cache_files = os.listdir(tmp_dir)
+            self.assertEqual(1, len(cache_files))
+
+            # read back from disk rather than the in process copy
+            cp._TABLES.clear()
+            cached = cp.load_population_table(TestCountyPopulation.HISTORICAL_FILE, cache_directory=tmp_dir)
+            pd.testing.assert_frame_equal(table, cached)
+
+    def test_get_population_for_year(self):
+        """Ensure the population for a year matches the source data and years outside the table are clamped."""
+
+        table = cp.build_population_table(TestCountyPopulation.HISTORICAL_FILE)
+
+        df = cp.get_population_for_year(table, 2019)
+        np.testing.assert_array_equal([2252782, 271473], df['Population'].values)
+
+        clamped = cp.get_population_for_year(table, 2030, clamp=True)
+        pd.testing.assert_frame_equal(df, clamped)
+
+        with self.assertRaises(KeyError):
+            cp.get_population_for_year(table, 2030)
+
+    def test_balancing_authority_population(self):
+        """Ensure the balancing authority step reads the same populations as the original interpolation."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            df = get_county_population(2059, False, TestCountyPopulation.FUTURE_FILE, tmp_dir)
+
+        expected = pd.read_csv(TestCountyPopulation.FUTURE_FILE).drop(columns=['state_name']).set_index('FIPS').T
+        expected.index = expected.index.astype(int)
+        expected = expected.reindex(range(2020, 2101)).interpolate()
+
+        np.testing.assert_array_equal(expected.loc[2059].round(0).astype(int).values, df['Population'].values)
+
+
+if __name__ == '__main__':
+    unittest.main()
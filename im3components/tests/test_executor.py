@@ -0,0 +1,119 @@
+import os
+import tempfile
+import time
+import unittest
+
+import im3components as cmp
+from im3components.cache import ResultCache
+from im3components.executor import Output, Stage
+from im3components.taxonomy import Component
+
+
+CALLS = []
+
+
+def slow_add(x, y, seconds=0):
+    CALLS.append((x, y))
+    time.sleep(seconds)
+    return x + y
+
+
+def split(x):
+    return {'half': x / 2, 'double': x * 2}
+
+
+def fail():
+    raise ValueError('bad input')
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = cmp.registry(components=[
+            Component(name=name, description='', language='Python', package=__name__, method=name)
+            for name in ['slow_add', 'split', 'fail']
+        ])
+
+    def diamond(self, seconds: float = 0) -> list:
+        return [
+            Stage('a', 'slow_add', {'x': 1, 'y': 2, 'seconds': seconds}),
+            Stage('b', 'slow_add', args=[3, 4], arguments={'seconds': seconds}),
+            Stage('c', 'slow_add', {'x': Output('a'), 'y': Output('b')}),
+            Stage('d', 'split', {'x': Output('c')}),
+            Stage('e', 'slow_add', {'x': Output('d', 'half'), 'y': Output('d', 'double')}),
+        ]
+
+    def test_order(self):
+        """Ensure stages are grouped into generations by their dependencies."""
+
+        pipeline = self.registry.pipeline(self.diamond() + [Stage('f', 'split', {'x': 1}, after=['e'])])
+        self.assertEqual([['a', 'b'], ['c'], ['d'], ['e'], ['f']], pipeline.order())
+
+    def test_run(self):
+        """Ensure independent stages run concurrently and outputs are passed downstream."""
+
+        result = self.registry.pipeline(self.diamond(seconds=1)).run(max_workers=2)
+
+        self.assertEqual(10, result['c'])
+        self.assertEqual(25, result['e'])
+
+        timings = result.timings.set_index('stage')
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], sorted(timings.index))
+        self.assertLess(timings.loc['a', 'start'], timings.loc['b', 'end'])
+        self.assertLess(timings.loc['b', 'start'], timings.loc['a', 'end'])
+        self.assertGreaterEqual(timings.loc['c', 'start'], max(timings.loc['a', 'end'], timings.loc['b', 'end']))
+
+    def test_run_serial(self):
+        """Ensure stages can run one at a time in the current process."""
+
+        result = self.registry.pipeline(self.diamond()).run(max_workers=0)
+
+        self.assertEqual(25, result['e'])
+        self.assertEqual(1, result.timings['worker'].nunique())
+
+    def test_run_empty(self):
+        """Ensure a pipeline without stages runs to an empty result."""
+
+        result = self.registry.pipeline([]).run()
+        self.assertEqual({}, result.outputs)
+        self.assertEqual(0, len(result.timings))
+
+    def test_run_cached(self):
+        """Ensure stages run through the registry, so unchanged stages are served from its result cache."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(os.path.join(directory, 'store'))
+            registry = cmp.registry(components=self.registry.components, cache_directory=directory, cache=cache)
+
+            CALLS.clear()
+            for _ in range(2):
+                self.assertEqual(25, registry.pipeline(self.diamond()).run(max_workers=0)['e'])
+            self.assertEqual(4, len(CALLS))
+            self.assertEqual(5, cache.stats['hits'])
+
+            # worker processes share the store
+            self.assertEqual(25, registry.pipeline(self.diamond()).run(max_workers=2)['e'])
+            self.assertEqual(5, cache.stats['entries'])
+            self.assertEqual(10, cache.entries()['hits'].sum())
+
+    def test_invalid(self):
+        """Ensure invalid pipelines are rejected before running and stage failures are reported."""
+
+        with self.assertRaises(ValueError):
+            self.registry.pipeline([Stage('a', 'split', {'x': Output('b')}), Stage('b', 'split', {'x': Output('a')})])
+
+        with self.assertRaises(ValueError):
+            self.registry.pipeline([Stage('a', 'split', {'x': Output('missing')})])
+
+        with self.assertRaises(ValueError):
+            self.registry.pipeline([Stage('a', 'split', {'x': 1}), Stage('a', 'split', {'x': 2})])
+
+        with self.assertRaises(KeyError):
+            self.registry.pipeline([Stage('a', 'not_a_component')])
+
+        with self.assertRaisesRegex(RuntimeError, 'bad input'):
+            self.registry.pipeline([Stage('a', 'fail')]).run(max_workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
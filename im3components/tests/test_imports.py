@@ -0,0 +1,40 @@
+import subprocess
+import sys
+import unittest
+
+
+# dependencies that should only be imported once a component actually runs
+HEAVY_MODULES = ['dask', 'geopandas', 'joblib', 'r_functions', 'salem', 'swifter', 'xarray']
+
+
+class TestImports(unittest.TestCase):
+
+    def imported_heavy_modules(self, code: str) -> list:
+        """Run code in a fresh interpreter and return the heavy modules it imported."""
+
+        output = subprocess.run(
+            [sys.executable, '-c', f"{code}\nimport sys\nprint(' '.join(sorted(sys.modules)))"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+
+        return [m for m in HEAVY_MODULES if m in output]
+
+    def test_import_package(self):
+        """Ensure importing the package and listing the registry do not import heavy dependencies."""
+
+        self.assertEqual([], self.imported_heavy_modules('import im3components\nim3components.registry().list_registry()'))
+
+    def test_import_components(self):
+        """Ensure importing the component modules, as their command line interfaces do, is cheap."""
+
+        for module in ['im3components.pop_tell_counties',
+                       'im3components.statemod_to_parquet.statemod_data_extraction',
+                       'im3components.wrf_to_tell.wrf_tell_counties',
+                       'im3components.wrf_to_tell.wrf_tell_pipeline']:
+            self.assertEqual([], self.imported_heavy_modules(f'import {module}'), module)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import im3components as cmp
+from im3components.instrumentation import instrument, instrumented, read_log
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.name, 'log.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_instrument(self):
+        """Ensure time, memory, input and output, and files touched are measured and logged."""
+
+        input_file = os.path.join(self.directory.name, 'input.txt')
+        output_file = os.path.join(self.directory.name, 'output.txt')
+        with open(input_file, 'w') as f:
+            f.write('x' * 100000)
+
+        with instrument('baseline') as baseline:
+            pass
+
+        with instrument('stage', log_file=self.log_file, metadata={'year': 2020}) as instrumentation:
+            with open(input_file, 'r') as f:
+                data = f.read()
+            with open(output_file, 'w') as f:
+                f.write(data)
+            array = np.ones(200 * 2 ** 20 // 8)
+            time.sleep(0.3)
+            del array
+
+        record = instrumentation.record
+        self.assertEqual('stage', record['stage'])
+        self.assertEqual(2020, record['year'])
+        self.assertGreaterEqual(record['seconds'], 0.3)
+        self.assertEqual(1, record['files_read'])
+        self.assertEqual(1, record['files_written'])
+        self.assertEqual(2, record['files_touched'])
+        self.assertGreaterEqual(record['bytes_read'], 100000)
+        self.assertGreaterEqual(record['bytes_written'], 100000)
+        self.assertGreater(record['peak_memory_mb'], baseline.record['peak_memory_mb'] + 100)
+        self.assertIsNone(record['error'])
+
+        self.assertEqual([record['stage']], [r['stage'] for r in read_log(self.log_file)])
+
+    def test_instrumented(self):
+        """Ensure decorated functions are measured, profiled, and record errors."""
+
+        @instrumented(profiler='cprofile', profile_directory=self.directory.name, log_file=self.log_file)
+        def divide(x, y):
+            return x / y
+
+        self.assertEqual(2, divide(4, 2))
+        self.assertEqual('divide', divide.last_record['stage'])
+        self.assertTrue(os.path.isfile(divide.last_record['profile_file']))
+        self.assertIsNotNone(pstats.Stats(divide.last_record['profile_file']))
+
+        with self.assertRaises(ZeroDivisionError):
+            divide(1, 0)
+        self.assertIn('ZeroDivisionError', divide.last_record['error'])
+        self.assertEqual(2, len(read_log(self.log_file)))
+
+        with self.assertRaises(ValueError):
+            instrument('stage', profiler='not-a-profiler')
+
+    def test_registry(self):
+        """Ensure the registry instruments the components it runs."""
+
+        registry = cmp.registry(cache_directory=self.directory.name, instrumentation_log=self.log_file,
+                                record_profiles=True)
+        self.assertEqual(20, registry.run('demo_py', 2, 2))
+
+        record = read_log(self.log_file)[0]
+        self.assertEqual('demo_py', record['component'])
+        self.assertIn('peak_memory_mb', record)
+        self.assertEqual(1, registry.metadata('demo_py')['profile']['runs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
+import os
 import pkg_resources
+import tempfile
 import unittest
 
+import numpy as np
 import pandas as pd
+import rasterio
 
 import im3components as cmp
 import im3components.pop_tell_counties as pop
+from im3components import synthetic
 
 
 class TestPopTellCounties(unittest.TestCase):
@@ -131,6 +136,112 @@ class TestPopTellCounties(unittest.TestCase):
 
         pd.testing.assert_frame_equal(TestPopTellCounties.EXPECTED_OUTPUT, df)
 
+    def test_get_raster_window_data(self):
+        """Ensure a windowed read matches the full read within the window and keeps the full raster cell index."""
+
+        gdf_full, area = pop.get_raster_data(TestPopTellCounties.RASTER_FILE, data_field_name='2020')
+        gdf_window, window_area = pop.get_raster_window_data(TestPopTellCounties.RASTER_FILE,
+                                                             bounds=tuple(gdf_full.total_bounds),
+                                                             data_field_name='2020')
+
+        self.assertEqual(area, window_area)
+        np.testing.assert_array_equal(gdf_full['cell_index'].values, gdf_window['cell_index'].values)
+        np.testing.assert_allclose(gdf_full['2020'].values, gdf_window['2020'].values)
+        self.assertTrue(gdf_full.geometry.geom_equals(gdf_window.geometry).all())
+
+        # only the cells within the bounding box of the counties are read
+        gdf_counties = pop.get_county_data(TestPopTellCounties.RASTER_FILE,
+                                           TestPopTellCounties.COUNTY_SHAPEFILE,
+                                           state_name='alabama')
+        gdf_window, _ = pop.get_raster_window_data(TestPopTellCounties.RASTER_FILE,
+                                                   bounds=tuple(gdf_counties.total_bounds),
+                                                   data_field_name='2020')
+
+        with rasterio.open(TestPopTellCounties.RASTER_FILE) as raster:
+            values = raster.read(1).ravel()
+
+        self.assertTrue(0 < len(gdf_window) < len(gdf_full))
+        np.testing.assert_allclose(values[gdf_window['cell_index'].values], gdf_window['2020'].values)
+
+        df = pop.population_to_tell_counties(raster_list=[TestPopTellCounties.RASTER_FILE],
+                                             county_shapefile=TestPopTellCounties.COUNTY_SHAPEFILE,
+                                             year_list=[2020],
+                                             state_name='alabama',
+                                             n_jobs=1,
+                                             read_window=True)
+
+        self.assertAlmostEqual(gdf_window['2020'].sum(), df['2020'].sum(), places=3)
+
+    def test_raster_stack(self):
+        """Ensure a stack of rasters processed in one pass matches processing each year on its own."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bounds = synthetic.wrf_bounds(10, 12)
+            counties = synthetic.write_county_shapefile(os.path.join(tmp_dir, 'counties.shp'), 2, 3, bounds)
+            rasters = [
+                synthetic.write_population_raster(os.path.join(tmp_dir, f'population_{year}.tif'), 20, 20, bounds,
+                                                  nodata_fraction=0.1, seed=seed)
+                for seed, year in enumerate([2020, 2030])
+            ]
+
+            # the same years as the bands of one raster
+            with rasterio.open(rasters[0]) as raster:
+                profile = dict(raster.profile, count=2)
+            with rasterio.open(os.path.join(tmp_dir, 'population.tif'), 'w', **profile) as stack:
+                for band, raster_file in enumerate(rasters, start=1):
+                    with rasterio.open(raster_file) as raster:
+                        stack.write(raster.read(1), band)
+
+            arguments = dict(county_shapefile=counties, year_list=[2020, 2030], state_name='alabama')
+            expected = pop.population_to_tell_counties(raster_list=rasters, n_jobs=1, **arguments)
+
+            self.assertEqual(6, len(expected))
+            for raster_list in [rasters, [os.path.join(tmp_dir, 'population.tif')]]:
+                pd.testing.assert_frame_equal(
+                    expected, pop.population_to_tell_counties(raster_list=raster_list, stack=True, **arguments))
+
+            # in memory, the same result is handed over as an Arrow table
+            table = pop.population_to_tell_counties(raster_list=rasters, stack=True, in_memory=True, **arguments)
+            pd.testing.assert_frame_equal(expected, table.to_pandas())
+
+            with self.assertRaises(ValueError):
+                pop.population_to_tell_counties(raster_list=rasters[:1], stack=True, **arguments)
+
+    def test_weights_file(self):
+        """Ensure binary weights files round trip and give the same county populations as computing the weights."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bounds = synthetic.wrf_bounds(10, 12)
+            counties = synthetic.write_county_shapefile(os.path.join(tmp_dir, 'counties.shp'), 2, 3, bounds)
+            raster = synthetic.write_population_raster(os.path.join(tmp_dir, 'population.tif'), 20, 20, bounds,
+                                                       nodata_fraction=0.1)
+
+            arguments = dict(county_shapefile=counties, state_name='alabama', scenario='ssp2')
+            expected = pop.process_single_year(raster, output_directory=tmp_dir, target_year=2020, **arguments)
+
+            weights_file = os.path.join(tmp_dir, 'alabama_population_to_county_area_weights.parquet')
+            weights = pop.validate_weights_file(weights_file)
+            self.assertEqual(['cell_index', 'FIPS', 'weight'], list(weights.columns))
+            self.assertTrue(weights['cell_index'].is_monotonic_increasing)
+            self.assertTrue(weights['FIPS'].str.len().eq(5).all())
+
+            # the operator has a row per county and a column per grid cell of the raster data
+            gdf_raster, _, _ = pop.get_raster_stack_data([raster])
+            operator, fips = pop.load_weights_operator(weights_file, gdf_raster['cell_index'].values)
+            self.assertEqual((6, len(gdf_raster)), operator.shape)
+            self.assertEqual(sorted(weights['FIPS'].unique()), fips.tolist())
+
+            for result in [
+                pop.process_single_year(raster, weights_file=weights_file, target_year=2020, **arguments),
+                pop.population_to_tell_counties([raster], weights_file=weights_file, year_list=[2020], stack=True,
+                                                **arguments).rename(columns={'2020': 'n_population'}),
+            ]:
+                pd.testing.assert_series_equal(expected['FIPS'], result['FIPS'])
+                np.testing.assert_allclose(expected['n_population'], result['n_population'], rtol=1e-6)
+
+            with self.assertRaises(ValueError):
+                pop.write_weights_file(weights.assign(FIPS='A'), os.path.join(tmp_dir, 'invalid.parquet'))
+
     def test_registry(self):
         """Test component registry functionality."""
 
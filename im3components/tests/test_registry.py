@@ -0,0 +1,143 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+import im3components as cmp
+from im3components.registry import AssetType, PROFILES_FILE, taxonomy_directory, _LOADED
+from im3components.taxonomy import Component, Performance
+
+
+def work(units, n_jobs=-1):
+    return n_jobs
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.taxonomy_dir = tempfile.TemporaryDirectory()
+        source = taxonomy_directory(AssetType.Component)
+        for name in ['demo_py.yaml', 'wrf_to_tell_counties.yaml']:
+            shutil.copy(os.path.join(source, name), self.taxonomy_dir.name)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        self.taxonomy_dir.cleanup()
+
+    def registry(self):
+        return cmp.registry(directory=self.taxonomy_dir.name, cache_directory=self.cache_dir.name, record_profiles=True)
+
+    def test_lazy_load(self):
+        """Ensure the taxonomy is not read until the registry is first used."""
+
+        registry = self.registry()
+        self.assertIsNone(registry._components)
+        self.assertEqual(['demo_py', 'wrf_to_tell_counties'], registry.list_registry())
+
+    def test_cache(self):
+        """Ensure a compiled cache is written and invalidated when the taxonomy files change."""
+
+        self.assertEqual(2, len(self.registry().components))
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir.name, 'component_registry.json')))
+
+        # components are read back from the compiled cache in a fresh process
+        _LOADED.clear()
+        components = self.registry().components
+        self.assertTrue(all(isinstance(c, Component) for c in components))
+        self.assertEqual('wrf_to_tell_counties', components[1].name)
+
+        # adding a component invalidates the cache
+        shutil.copy(
+            os.path.join(taxonomy_directory(AssetType.Component), 'population_to_tell_counties.yaml'),
+            self.taxonomy_dir.name,
+        )
+        self.assertIn('population_to_tell_counties', self.registry().list_registry())
+
+    def test_lookups(self):
+        """Ensure name and related asset lookups use the indexes."""
+
+        registry = self.registry()
+
+        self.assertEqual(['wrf_to_tell_counties'], registry.list_related('wrf'))
+        self.assertEqual(['demo_py', 'wrf_to_tell_counties'], registry.list_related('python'))
+        self.assertTrue(registry.is_related('wrf_to_tell_counties', 'County'))
+        self.assertFalse(registry.is_related('demo_py', 'county'))
+
+        self.assertEqual(20, registry.run('demo_py', 2, 2))
+
+        with self.assertRaises(KeyError):
+            registry.get_component('not_a_component')
+
+    def test_duplicates(self):
+        """Ensure duplicate component names are not allowed."""
+
+        component = Component(name='a', description='', language='Python', package='im3components.demo.py_demo',
+                              method='py_demo')
+        registry = cmp.registry(components=[component, component])
+
+        with self.assertRaises(AttributeError):
+            registry.get_component('a')
+
+    def test_performance(self):
+        """Ensure performance hints are loaded, drive resource recommendations, and runs are profiled."""
+
+        registry = self.registry()
+        self.assertIsInstance(registry.get_spec('wrf_to_tell_counties').performance, Performance)
+        self.assertIsNone(registry.get_spec('demo_py').performance)
+
+        # performance hints are restored from the compiled cache
+        _LOADED.clear()
+        self.assertEqual('n_jobs', self.registry().get_spec('wrf_to_tell_counties').performance.workers_argument)
+
+        resources = registry.resources('wrf_to_tell_counties', units=2)
+        self.assertTrue(1 <= resources['workers'] <= 2)
+        self.assertTrue(1 <= resources['chunk_size'] <= 2)
+
+        registry.run('demo_py', 1, 2)
+        registry.run('demo_py', 3, 4)
+        metadata = registry.metadata()
+        self.assertEqual(2, metadata['demo_py']['profile']['runs'])
+        self.assertEqual(0, metadata['wrf_to_tell_counties']['profile']['runs'])
+        self.assertEqual('WRF time slice', metadata['wrf_to_tell_counties']['performance']['unit'])
+
+        # runs are only recorded on request
+        default = cmp.registry(directory=self.taxonomy_dir.name, cache_directory=self.cache_dir.name)
+        default.run('demo_py', 5, 6)
+        self.assertEqual(2, default.metadata('demo_py')['profile']['runs'])
+
+    def test_recommended_workers(self):
+        """Ensure the number of workers is set from the recommendation unless given."""
+
+        registry = cmp.registry(
+            components=[
+                Component(name='safe', description='', language='Python', package=__name__, method='work',
+                          performance={'memory_per_unit_mb': 1, 'workers_argument': 'n_jobs'}),
+                Component(name='unsafe', description='', language='Python', package=__name__, method='work',
+                          performance=Performance(parallel_safe=False, workers_argument='n_jobs')),
+            ],
+            cache_directory=self.cache_dir.name,
+            record_profiles=True,
+        )
+
+        self.assertEqual(registry.resources('safe')['workers'], registry.run('safe', 10))
+        self.assertEqual(1, registry.run('unsafe', 10))
+        self.assertEqual(3, registry.run('unsafe', 10, 3))
+        self.assertEqual(2, registry.metadata('unsafe')['profile']['runs'])
+
+    @unittest.skipIf(importlib.util.find_spec('pyinstrument') is not None, 'needs pyinstrument to be missing')
+    def test_failed_instrumentation(self):
+        """Ensure a run whose instrumentation fails to start records no profile, and bad lines are skipped."""
+
+        registry = cmp.registry(cache_directory=self.cache_dir.name, record_profiles=True, profiler='pyinstrument')
+        with self.assertRaises(ImportError):
+            registry.run('demo_py', 1, 2)
+
+        with open(os.path.join(self.cache_dir.name, PROFILES_FILE), 'a') as f:
+            f.write('null\n[1, 2]\n')
+        self.assertEqual(0, registry.metadata('demo_py')['profile']['runs'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import im3components as cmp
+from im3components import runtime
+
+
+# a server speaking the session protocol, used to exercise the pooling and data exchange without R or Julia
+PYTHON_SERVER = """
+import importlib.util
+import json
+import sys
+
+import pyarrow.feather as feather
+
+marker = sys.argv[1]
+sourced = {}
+
+import pandas as pd
+
+arrow = True
+
+def read_argument(argument):
+    if argument.get('frame') is not None:
+        return feather.read_table(argument['frame']).to_pandas()
+    if argument.get('columns') is not None:
+        return pd.DataFrame(argument['columns'])
+    return argument['value']
+
+if not arrow:
+    print(marker + json.dumps({'status': 'ready', 'arrow': False}), flush=True)
+
+for line in sys.stdin:
+    try:
+        request = json.loads(line)
+        if request['source'] not in sourced:
+            spec = importlib.util.spec_from_file_location('component', request['source'])
+            sourced[request['source']] = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(sourced[request['source']])
+        args = [read_argument(a) for a in request['arguments'] if a['name'] is None]
+        kwargs = {a['name']: read_argument(a) for a in request['arguments'] if a['name'] is not None}
+        output = getattr(sourced[request['source']], request['function'])(*args, **kwargs)
+        if hasattr(output, 'columns') and not arrow:
+            response = {'status': 'ok', 'frame': True, 'columns': {c: json.loads(output[c].to_json(orient='values')) for c in output}}
+        elif hasattr(output, 'columns'):
+            feather.write_feather(output, request['output'])
+            response = {'status': 'ok', 'frame': True}
+        else:
+            response = {'status': 'ok', 'frame': False, 'value': output}
+    except Exception as e:
+        response = {'status': 'error', 'message': str(e)}
+    print(marker + json.dumps(response), flush=True)
+"""
+
+COMPONENT = """
+import os
+import time
+
+def add(x, y):
+    print('component output')
+    return x + y
+
+def scale(frame, factor=1):
+    frame['value'] = frame['value'] * factor
+    return frame
+
+def pid(seconds=0):
+    time.sleep(seconds)
+    return os.getpid()
+
+def fail():
+    raise ValueError('bad input')
+"""
+
+
+class PythonSession(runtime.Session):
+    executable = sys.executable
+    server = PYTHON_SERVER
+    server_file_name = 'server.py'
+
+
+class JsonPythonSession(PythonSession):
+    # reports that it cannot exchange data frames as Feather files, as an R session without the arrow package does
+    server = PYTHON_SERVER.replace('arrow = True', 'arrow = False')
+    handshake = True
+
+
+class TestRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(self.directory.name, 'component.py')
+        with open(self.source_file, 'w') as f:
+            f.write(COMPONENT)
+        runtime.SESSIONS['python'] = PythonSession
+        self.pool = runtime.RuntimePool('Python', size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        del runtime.SESSIONS['python']
+        self.directory.cleanup()
+
+    def test_call(self):
+        """Ensure values and data frames are exchanged with a session and errors are raised."""
+
+        self.assertEqual(5, self.pool.create(self.source_file, 'add')(2, y=3))
+
+        frame = pd.DataFrame({'name': ['a', 'b'], 'value': [1.5, 2.0]})
+        result = self.pool.call(self.source_file, 'scale', frame, factor=2)
+        pd.testing.assert_frame_equal(pd.DataFrame({'name': ['a', 'b'], 'value': [3.0, 4.0]}), result)
+
+        with self.assertRaisesRegex(RuntimeError, 'bad input'):
+            self.pool.call(self.source_file, 'fail')
+
+    def test_json_frames(self):
+        """Ensure data frames are exchanged as JSON with a session that cannot read Feather files."""
+
+        session = JsonPythonSession()
+        try:
+            frame = pd.DataFrame({'name': ['a', 'b'], 'value': [1.5, None]})
+            result = session.call(self.source_file, 'scale', frame, factor=2)
+            self.assertFalse(session.arrow)
+            pd.testing.assert_frame_equal(pd.DataFrame({'name': ['a', 'b'], 'value': [3.0, None]}), result)
+            self.assertEqual([], [f for f in os.listdir(session.directory) if f.endswith('.feather')])
+        finally:
+            session.close()
+
+    def test_sessions_are_reused(self):
+        """Ensure sequential calls reuse one session and concurrent calls are spread over the pool."""
+
+        pids = {self.pool.call(self.source_file, 'pid') for _ in range(3)}
+        self.assertEqual(1, len(pids))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pids = set(executor.map(lambda _: self.pool.call(self.source_file, 'pid', 0.5), range(4)))
+        self.assertEqual(2, len(pids))
+
+    def test_restart(self):
+        """Ensure a session that has stopped is restarted on the next call."""
+
+        pid = self.pool.call(self.source_file, 'pid')
+        self.pool._sessions[0].process.kill()
+        self.pool._sessions[0].process.wait()
+        self.assertNotEqual(pid, self.pool.call(self.source_file, 'pid'))
+
+    def test_resize(self):
+        """Ensure shrinking a pool stops idle sessions at once and sessions in use once their calls return."""
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            busy = executor.submit(self.pool.call, self.source_file, 'pid', 1)
+            self.pool.call(self.source_file, 'pid', 0.2)
+            self.assertEqual(2, len(self.pool._sessions))
+
+            # the idle session is stopped, the one in use finishes its call
+            self.pool.resize(1)
+            self.assertEqual(1, len(self.pool._sessions))
+            self.assertIsInstance(busy.result(), int)
+
+        self.assertEqual(1, len(self.pool._sessions))
+        self.assertEqual(1, len({self.pool.call(self.source_file, 'pid') for _ in range(2)}))
+
+        with self.assertRaises(ValueError):
+            self.pool.resize(0)
+
+    def test_missing_executable(self):
+        """Ensure a missing interpreter is reported."""
+
+        pool = runtime.RuntimePool('R', executable='not-an-r-executable')
+        with self.assertRaises(FileNotFoundError):
+            pool.call(self.source_file, 'add', 1, 2)
+
+        with self.assertRaises(ValueError):
+            runtime.RuntimePool('Fortran')
+
+    @unittest.skipIf(shutil.which('Rscript') is None, 'Rscript is not installed')
+    def test_r_component(self):
+        """Ensure R components from the registry are served by one persistent session."""
+
+        fx = cmp.registry().get_component('demo_r')
+        self.assertEqual(20, fx(2, 4))
+        self.assertEqual(29, fx(x=2, y=5))
+        self.assertEqual(1, len(runtime.get_pool('R')._sessions))
+
+
+if __name__ == '__main__':
+    unittest.main()
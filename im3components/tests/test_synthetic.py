@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+import geopandas as gpd
+import pandas as pd
+import rasterio
+
+from im3components import synthetic
+from im3components.statemod_to_parquet.statemod_data_extraction import StateModDataExtractor
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_spatial(self):
+        """Ensure the counties and population raster lie inside the WRF grid."""
+
+        bounds = synthetic.wrf_bounds(20, 30)
+        lon, lat = synthetic.wrf_coordinates(20, 30)
+
+        counties = gpd.read_file(synthetic.write_county_shapefile(self.path('counties.shp'), 3, 4, bounds))
+        self.assertEqual(synthetic.county_fips(12), counties['GEOID'].tolist())
+        self.assertTrue((counties['STATEFP'] == '01').all())
+        west, south, east, north = counties.total_bounds
+        self.assertTrue((lon.min() < west) and (east < lon.max()) and (lat.min() < south) and (north < lat.max()))
+
+        with rasterio.open(synthetic.write_population_raster(self.path('population.tif'), 10, 12, bounds)) as raster:
+            self.assertEqual((10, 12), raster.shape)
+            self.assertTrue((raster.read(1) > 0).all())
+
+        with self.assertRaises(ValueError):
+            synthetic.county_fips(1000)
+
+    def test_tabular(self):
+        """Ensure the county CSV directories and xdd files can be read like the real files."""
+
+        fips = synthetic.county_fips(5)
+        files = synthetic.write_county_data_directory(self.path('counties'), fips, n_hours=4, skip_hours=[1])
+        self.assertEqual(
+            [f'2019_01_01_{hour}_UTC_County_Mean_Meteorology.csv' for hour in ['01', '03', '04']],
+            [os.path.basename(f) for f in files],
+        )
+        self.assertEqual(['FIPS'] + synthetic.WRF_VARIABLES, pd.read_csv(files[0]).columns.tolist())
+
+        ids_file, xdd_files = synthetic.write_xdd_files(self.path('xdd'), n_structures=3, n_files=1, n_years=2)
+        extractor = StateModDataExtractor(ids_file, self.path('output'), xdd_files=xdd_files)
+        os.makedirs(extractor.temporary_path)
+        self.assertTrue(extractor.parse_xdd_file(xdd_files[0]))
+
+        df = pd.read_parquet(self.path('output/tmp/S1_1.parquet'))
+        self.assertEqual(3 * 2 * 12, len(df))
+        self.assertEqual(['OCT', 'NOV', 'DEC', 'JAN'], df['month'].iloc[:4].tolist())
+        self.assertEqual([1908, 1908, 1908, 1909], df['year'].iloc[:4].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
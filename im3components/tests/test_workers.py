@@ -0,0 +1,217 @@
+import os
+import pickle
+import tempfile
+import unittest
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+import im3components as cmp
+from im3components import synthetic
+from im3components.pop_tell_counties import population_to_tell_counties
+from im3components.statemod_to_parquet.statemod_data_extraction import StateModDataExtractor
+from im3components.workers import WorkerPool, map_tasks, release, share
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import wrf_to_tell_balancing_authorities
+from im3components.wrf_to_tell.wrf_tell_counties import (
+    aggregate_chunk_slice,
+    aggregate_time_slice,
+    wrf_to_tell_counties,
+)
+from im3components.wrf_to_tell.wrf_tell_operators import county_operator
+
+
+def describe(value, offset=0):
+    return os.getpid(), id(value), len(value) + offset
+
+
+def inspect_array(values, index):
+    return values.flags.writeable, float(values[index].sum())
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, *names) -> str:
+        return os.path.join(self.directory.name, *names)
+
+    def test_share(self):
+        """Ensure shared objects are loaded once per worker, reused across calls, and removed on shutdown."""
+
+        df = pd.DataFrame({'x': range(1000)})
+
+        with WorkerPool(max_workers=1, preload=()) as pool:
+            handle = pool.share(df, key='frame')
+            self.assertIs(handle, pool.share(df, key='frame'))
+
+            first = map_tasks(pool, describe, [dict(value=handle), dict(value=handle, offset=1)])
+            second = map_tasks(pool, describe, [dict(value=handle)])
+
+            self.assertEqual([1000, 1001, 1000], [r[2] for r in first + second])
+            self.assertEqual(1, len({(r[0], r[1]) for r in first + second}))
+            self.assertNotEqual(os.getpid(), first[0][0])
+
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name=handle.name)
+
+    def test_transport(self):
+        """Ensure shared arrays reach the workers as read only views behind a handle of a few bytes."""
+
+        values = np.arange(4 * 2 * 50000, dtype=np.float64).reshape(4, 2, 50000)
+
+        with WorkerPool(max_workers=1, preload=()) as pool:
+            handle = share(pool, values, transient=True)
+            self.assertLess(len(pickle.dumps(handle)), 200)
+
+            results = map_tasks(pool, inspect_array, [dict(values=handle, index=i) for i in range(4)])
+            self.assertEqual([(False, float(values[i].sum())) for i in range(4)], results)
+
+            release(pool, handle)
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=handle.name)
+
+    def test_chunk_slice(self):
+        """Ensure the sparse operator over a chunk of time slices matches the mapping DataFrame aggregation."""
+
+        rng = np.random.default_rng(0)
+        n_cells, variables, precisions = 30, ['T2', 'Q2'], [2, 5]
+        mapping = pd.DataFrame({
+            'cell_index': np.arange(n_cells),
+            'FIPS': np.repeat(['01001', '01003', '01005'], 10),
+            'weight': np.full(n_cells, 0.1),
+        })
+        values = rng.random((2, 2, n_cells)) * 300
+        # missing cells are skipped by both
+        values[1, 0, [3, 17]] = np.nan
+        times = pd.date_range('2019-01-01', periods=2, freq='H').values
+
+        operator, counties = county_operator(mapping, n_cells)
+        for i, t in enumerate(times):
+            df = pd.DataFrame(values[i].T, columns=variables)
+            df['time'] = t
+            pd.testing.assert_frame_equal(
+                aggregate_time_slice(df, variables, precisions, mapping),
+                aggregate_chunk_slice(values, i, t, operator, counties, variables, precisions),
+            )
+
+    def test_components(self):
+        """Ensure components give the same results on a shared worker pool as on their own joblib pools."""
+
+        bounds = synthetic.wrf_bounds(10, 12)
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=4, ny=10, nx=12, variables=synthetic.WRF_VARIABLES)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 2, 3, bounds)
+        synthetic.write_population_raster(self.path('population.tif'), 20, 20, bounds)
+        ids_file, xdd_files = synthetic.write_xdd_files(self.path('xdd'), n_structures=2, n_files=2, n_years=1)
+
+        for name in ['joblib', 'pool']:
+            os.makedirs(self.path(name))
+
+        wrf_arguments = dict(
+            wrf_file=self.path('wrfout.nc'),
+            wrf_variables=synthetic.WRF_VARIABLES,
+            precisions=synthetic.WRF_PRECISIONS,
+            county_shapefile=self.path('counties.shp'),
+            weight_and_mapping_file=self.path('weights.parquet'),
+        )
+        population_arguments = dict(
+            raster_list=[self.path('population.tif')] * 2,
+            county_shapefile=self.path('counties.shp'),
+            state_name='alabama',
+            year_list=[2020, 2030],
+        )
+
+        wrf_to_tell_counties(output_directory=self.path('joblib'), n_jobs=1, **wrf_arguments)
+        expected = population_to_tell_counties(n_jobs=1, **population_arguments)
+
+        registry = cmp.registry(cache_directory=self.directory.name)
+        with registry.workers(max_workers=2, preload=()) as pool:
+            registry.run('wrf_to_tell_counties', output_directory=self.path('pool'), **wrf_arguments)
+            pd.testing.assert_frame_equal(expected, population_to_tell_counties(executor=pool, **population_arguments))
+            StateModDataExtractor(ids_file, self.path('statemod'), xdd_files=xdd_files, executor=pool).extract()
+
+        self.assertIsNone(registry.executor)
+
+        files = sorted(os.listdir(self.path('joblib')))
+        self.assertEqual(4, len(files))
+        self.assertEqual(files, sorted(os.listdir(self.path('pool'))))
+        for f in files:
+            pd.testing.assert_frame_equal(pd.read_csv(self.path('joblib', f)), pd.read_csv(self.path('pool', f)))
+
+        self.assertEqual(24, len(pd.read_parquet(self.path('statemod', '5100000.parquet'))))
+
+    def test_dask(self):
+        """Ensure components give the same results on a dask cluster as on their own joblib pools."""
+
+        from distributed import Client, LocalCluster
+
+        bounds = synthetic.wrf_bounds(10, 12)
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=4, ny=10, nx=12, variables=synthetic.WRF_VARIABLES)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 2, 3, bounds)
+        synthetic.write_population_raster(self.path('population.tif'), 20, 20, bounds)
+
+        fips = synthetic.county_fips(6)
+        synthetic.write_county_data_directory(self.path('hourly'), fips, n_hours=30)
+        synthetic.write_balancing_authority_mapping(self.path('mapping.csv'), fips, 2)
+        synthetic.write_county_population(self.path('population.csv'), fips, [2010, 2020])
+
+        wrf_arguments = dict(
+            wrf_file=self.path('wrfout.nc'),
+            wrf_variables=synthetic.WRF_VARIABLES,
+            precisions=synthetic.WRF_PRECISIONS,
+            county_shapefile=self.path('counties.shp'),
+            weight_and_mapping_file=self.path('weights.parquet'),
+        )
+        ba_arguments = dict(
+            year=2019,
+            is_historical=True,
+            balancing_authority_to_fips_file=self.path('mapping.csv'),
+            county_population_by_year_file=self.path('population.csv'),
+            county_data_directory=self.path('hourly'),
+            county_data_suffix='_County_Mean_Meteorology',
+            population_cache_directory=self.path('cache'),
+        )
+        population_arguments = dict(
+            raster_list=[self.path('population.tif')] * 2,
+            county_shapefile=self.path('counties.shp'),
+            state_name='alabama',
+            year_list=[2020, 2030],
+        )
+
+        for name in ['joblib', 'dask', 'ba_joblib', 'ba_dask']:
+            os.makedirs(self.path(name))
+
+        wrf_to_tell_counties(output_directory=self.path('joblib'), n_jobs=1, **wrf_arguments)
+        wrf_to_tell_balancing_authorities(output_directory=self.path('ba_joblib'), **ba_arguments)
+        expected = population_to_tell_counties(n_jobs=1, **population_arguments)
+
+        cluster = LocalCluster(n_workers=2, threads_per_worker=1, dashboard_address=None)
+        with cluster, Client(cluster) as client:
+            wrf_to_tell_counties(output_directory=self.path('dask'), executor=client, **wrf_arguments)
+            wrf_to_tell_balancing_authorities(
+                output_directory=self.path('ba_dask'), time_chunk_size=8, executor=client, **ba_arguments)
+            result = population_to_tell_counties(executor=client, **population_arguments)
+            pd.testing.assert_frame_equal(expected, result)
+
+            # objects shared under a key are scattered once and reused by later calls
+            weights = share(client, pd.read_parquet(self.path('weights.parquet')), key='weights')
+            self.assertIs(weights, share(client, None, key='weights'))
+            self.assertEqual(len(weights.result()), len(pd.read_parquet(self.path('weights.parquet'))))
+
+        for expected_directory, directory in [('joblib', 'dask'), ('ba_joblib', 'ba_dask')]:
+            files = sorted(os.listdir(self.path(expected_directory)))
+            self.assertEqual(files, sorted(os.listdir(self.path(directory))))
+            for f in files:
+                if f.endswith('.csv'):
+                    pd.testing.assert_frame_equal(
+                        pd.read_csv(self.path(expected_directory, f)), pd.read_csv(self.path(directory, f)))
+
+        self.assertEqual(2, len([f for f in os.listdir(self.path('ba_dask')) if f.endswith('_2019.csv')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
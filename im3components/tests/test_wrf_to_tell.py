@@ -1,9 +1,35 @@
 import os
 import numpy as np
 import pandas as pd
+import tempfile
 import unittest
+import xarray as xr
 
 import im3components as cmp
+from im3components import synthetic
+from im3components.synthetic import write_wrf_file
+from im3components.wrf_to_tell.wrf_tell_counties import wrf_to_tell_counties
+from im3components.wrf_to_tell.wrf_tell_encoding import (
+    encode_values,
+    quantized_encoding,
+    quantized_encodings,
+    read_parquet,
+    write_parquet,
+)
+from im3components.wrf_to_tell.wrf_tell_ensemble import wrf_to_tell_ensemble
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import wrf_to_tell_balancing_authorities
+from im3components.wrf_to_tell.wrf_tell_fill_missing_hours import fill_missing_hours, fill_missing_hours_in_data
+from im3components.wrf_to_tell.wrf_tell_operators import get_composite_operator, load_operator, operator_key
+from im3components.wrf_to_tell.wrf_tell_pipeline import wrf_to_tell_pipeline
+from im3components.wrf_to_tell.wrf_tell_tables import read_county_files, write_county_files
+from im3components.wrf_to_tell.wrf_tell_watch import (
+    STATE_FILE_NAME,
+    completed_years,
+    find_wrf_files,
+    output_times,
+    poll_wrf_files,
+    read_state,
+)
 
 
 class TestWrfTell(unittest.TestCase):
@@ -148,3 +174,407 @@ class TestWrfTell(unittest.TestCase):
         })
 
         pd.testing.assert_frame_equal(validation_data, pd.concat([slice_one, slice_two], ignore_index=True))
+
+    def test_fill_missing_hours_in_data(self):
+        """Ensure that gaps in consolidated county data are detected and filled in a single pass."""
+
+        county_data = pd.DataFrame({
+            'Time_UTC': pd.to_datetime([
+                '2019-01-01 01:00', '2019-01-01 01:00', '2019-01-01 04:00', '2019-01-01 04:00',
+            ]),
+            'FIPS': [53033, 53035, 53033, 53035],
+            'T2': [270.0, 273.0, 273.0, 276.0],
+        })
+
+        filled, report = fill_missing_hours_in_data(county_data, '2019-01-01T01', '2019-01-01T05', method='nan')
+        self.assertEqual(10, len(filled))
+        self.assertEqual(6, filled['T2'].isnull().sum())
+        pd.testing.assert_frame_equal(
+            pd.DataFrame({
+                'Gap_Start': pd.to_datetime(['2019-01-01 02:00', '2019-01-01 05:00']),
+                'Gap_End': pd.to_datetime(['2019-01-01 03:00', '2019-01-01 05:00']),
+                'Missing_Hours': np.array([2, 1]),
+            }),
+            report,
+            check_dtype=False,
+        )
+
+        filled, _ = fill_missing_hours_in_data(county_data, '2019-01-01T01', '2019-01-01T05', method='linear')
+        np.testing.assert_allclose(
+            filled[filled.FIPS == 53033]['T2'].values,
+            [270.0, 271.0, 272.0, 273.0, 273.0],
+        )
+
+        filled, _ = fill_missing_hours_in_data(county_data, '2019-01-01T01', '2019-01-01T05', method='nearest')
+        np.testing.assert_allclose(
+            filled[filled.FIPS == 53035]['T2'].values,
+            [273.0, 273.0, 276.0, 276.0, 276.0],
+        )
+
+        # climatology fills from the same hour of the previous day
+        daily = pd.DataFrame({
+            'Time_UTC': pd.date_range('2019-01-01 01:00', periods=24, freq='H'),
+            'FIPS': 53033,
+            'T2': np.arange(24, dtype=float),
+        })
+        filled, report = fill_missing_hours_in_data(daily, '2019-01-01', '2019-01-02', method='climatology')
+        self.assertEqual(24, report['Missing_Hours'].sum())
+        np.testing.assert_allclose(filled['T2'].values[24:], np.arange(24, dtype=float))
+
+    def test_pipeline(self):
+        """Ensure that the in memory pipeline matches the county aggregation and writes only the final outputs."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_wrf_file(f'{tmp_dir}/wrfout_2019-01-01.nc')
+            pd.DataFrame({'County_FIPS': [1001], 'BA_Code': ['TEST'], 'BA_Number': [1]}).to_csv(
+                f'{tmp_dir}/ba_mapping.csv', index=False)
+            pd.DataFrame({'county_FIPS': [1001], 'pop_2019': [55000]}).to_csv(
+                f'{tmp_dir}/population.csv', index=False)
+
+            means = wrf_to_tell_pipeline(
+                wrf_files=[f'{tmp_dir}/wrfout_2019-01-01.nc'],
+                year=2019,
+                is_historical=True,
+                balancing_authority_to_fips_file=f'{tmp_dir}/ba_mapping.csv',
+                county_population_by_year_file=f'{tmp_dir}/population.csv',
+                output_directory=tmp_dir,
+                county_shapefile=f'{self.data_path}/test_counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+                county_output_file=f'{tmp_dir}/counties.parquet',
+                variables=['T2', 'Q2'],
+                precisions=[2, 5],
+                time_chunk_size=2,
+                n_jobs=1,
+                population_cache_directory=tmp_dir,
+            )
+
+            counties = pd.read_parquet(f'{tmp_dir}/counties.parquet')
+            self.assertEqual(3, len(counties))
+
+            # a single county in the balancing authority has the whole population
+            data = pd.read_csv(f'{tmp_dir}/TEST_WRF_Hourly_Mean_Meteorology_2019.csv')
+            self.assertEqual(8760, len(data))
+            np.testing.assert_allclose(counties['T2'].values, data['T2'].values[:3])
+            self.assertTrue(data['T2'].iloc[3:].isnull().all())
+            self.assertEqual(8760, len(means))
+
+            # no intermediate county files were written
+            self.assertFalse(any(f.endswith('_County_Mean_Meteorology.csv') for f in os.listdir(tmp_dir)))
+
+    def test_pipeline_composite_operator(self):
+        """Ensure that skipping the county stage with a composite operator matches the two stage aggregation."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_wrf_file(f'{tmp_dir}/wrfout_2019-01-01.nc', variables=('T2', 'Q2', 'U10', 'V10'))
+            pd.DataFrame({'County_FIPS': [1001], 'BA_Code': ['TEST'], 'BA_Number': [1]}).to_csv(
+                f'{tmp_dir}/ba_mapping.csv', index=False)
+            pd.DataFrame({'county_FIPS': [1001], 'pop_2019': [55000]}).to_csv(
+                f'{tmp_dir}/population.csv', index=False)
+
+            results = []
+            for skip_county_stage in [False, True, True]:
+                results.append(wrf_to_tell_pipeline(
+                    wrf_files=[f'{tmp_dir}/wrfout_2019-01-01.nc'],
+                    year=2019,
+                    is_historical=True,
+                    balancing_authority_to_fips_file=f'{tmp_dir}/ba_mapping.csv',
+                    county_population_by_year_file=f'{tmp_dir}/population.csv',
+                    output_directory=tmp_dir,
+                    county_shapefile=f'{self.data_path}/test_counties.shp',
+                    weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+                    variables=['T2', 'Q2', 'U10', 'V10'],
+                    precisions=[2, 5, 2, 2],
+                    n_jobs=1,
+                    skip_county_stage=skip_county_stage,
+                    operator_file=f'{tmp_dir}/operator_2019.npz',
+                    population_cache_directory=tmp_dir,
+                ))
+
+            self.assertTrue(os.path.isfile(f'{tmp_dir}/operator_2019.npz'))
+            self.assertEqual(['Time_UTC', 'BA_Number', 'T2', 'Q2', 'WSPD'], list(results[1].columns))
+            # the composite path does not round county means, so allow for a rounding step of difference
+            pd.testing.assert_frame_equal(results[0], results[1], atol=0.011)
+            pd.testing.assert_frame_equal(results[1], results[2])
+
+            # an operator file built for another year or other inputs is rebuilt rather than reused
+            key = load_operator(f'{tmp_dir}/operator_2019.npz')['key']
+            mapping = pd.read_parquet(f'{tmp_dir}/weights.parquet')
+            arguments = dict(
+                is_historical=True,
+                balancing_authority_to_fips_file=f'{tmp_dir}/ba_mapping.csv',
+                county_population_by_year_file=f'{tmp_dir}/population.csv',
+                mapping=mapping,
+                n_cells=48,
+                operator_file=f'{tmp_dir}/operator_2019.npz',
+                population_cache_directory=tmp_dir,
+            )
+            self.assertNotEqual(key, get_composite_operator(year=2018, **arguments)['key'])
+            self.assertEqual(operator_key(2018, True, f'{tmp_dir}/ba_mapping.csv', f'{tmp_dir}/population.csv', mapping,
+                                          48), load_operator(f'{tmp_dir}/operator_2019.npz')['key'])
+
+    def test_watch(self):
+        """Ensure polling aggregates only new time slices of grown files and reports each completed year once."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(f'{tmp_dir}/wrf')
+            os.makedirs(f'{tmp_dir}/counties')
+            years = []
+            arguments = dict(
+                wrf_variables=['T2', 'Q2'],
+                precisions=[2, 5],
+                output_directory=f'{tmp_dir}/counties',
+                watch_directory=f'{tmp_dir}/wrf',
+                settle_seconds=0,
+                on_year_complete=years.append,
+                county_shapefile=f'{self.data_path}/test_counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+                n_jobs=1,
+            )
+
+            # stand in for the outputs of the rest of the year
+            for t in pd.date_range('2019-01-01 00:00', '2019-12-31 20:00', freq='H'):
+                open(f'{tmp_dir}/counties/{t:%Y_%m_%d_%H}_UTC_County_Mean_Meteorology.csv', 'w').close()
+
+            write_wrf_file(f'{tmp_dir}/wrf/wrfout_2019-12-31.nc', start='2019-12-31 21:00', n_times=2)
+            result = poll_wrf_files(**arguments)
+            self.assertEqual(1, len(result['processed']))
+            self.assertEqual(8760 - 1, len([f for f in os.listdir(f'{tmp_dir}/counties') if f.endswith('.csv')]))
+            self.assertEqual([], years)
+
+            # unchanged files are not aggregated again
+            self.assertEqual([], poll_wrf_files(**arguments)['processed'])
+
+            # only the new time slice of a grown file is aggregated, which completes the year
+            first = f'{tmp_dir}/counties/2019_12_31_21_UTC_County_Mean_Meteorology.csv'
+            os.utime(first, ns=(0, 0))
+            write_wrf_file(f'{tmp_dir}/wrf/wrfout_2019-12-31.nc', start='2019-12-31 21:00', n_times=3)
+            result = poll_wrf_files(**arguments)
+            self.assertEqual(1, len(result['processed']))
+            self.assertEqual(0, os.stat(first).st_mtime_ns)
+            self.assertTrue(os.path.isfile(f'{tmp_dir}/counties/2019_12_31_23_UTC_County_Mean_Meteorology.csv'))
+            self.assertEqual([2019], years)
+
+            # files still being written are left for a later poll, and completed years are not reported again
+            write_wrf_file(f'{tmp_dir}/wrf/wrfout_2020-01-01.nc', start='2020-01-01 00:00', n_times=2)
+            result = poll_wrf_files(**dict(arguments, settle_seconds=3600))
+            self.assertEqual([f'{tmp_dir}/wrf/wrfout_2020-01-01.nc'], result['pending'])
+            self.assertEqual([2019], read_state(f'{tmp_dir}/counties/{STATE_FILE_NAME}')['years'])
+            self.assertEqual(1, len(poll_wrf_files(**arguments)['processed']))
+            self.assertEqual([2019], years)
+
+            # a year with missing hours is not complete, even once a later year has outputs
+            self.assertEqual([2019], completed_years(output_times(f'{tmp_dir}/counties')))
+            os.remove(f'{tmp_dir}/counties/2019_06_01_12_UTC_County_Mean_Meteorology.csv')
+            self.assertEqual([], completed_years(output_times(f'{tmp_dir}/counties')))
+
+            # a manifest lists the files relative to itself
+            with open(f'{tmp_dir}/manifest.txt', 'w') as f:
+                f.write('# completed files\nwrf/wrfout_2019-12-31.nc\nwrf/missing.nc\n')
+            self.assertEqual([f'{tmp_dir}/wrf/wrfout_2019-12-31.nc'],
+                             find_wrf_files(manifest_file=f'{tmp_dir}/manifest.txt'))
+
+    def test_ensemble(self):
+        """Ensure the batched ensemble aggregation matches aggregating each member on its own."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(f'{tmp_dir}/counties')
+            arguments = dict(
+                wrf_variables=['T2', 'Q2'],
+                precisions=[2, 5],
+                county_shapefile=f'{self.data_path}/test_counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+            )
+
+            members = [write_wrf_file(f'{tmp_dir}/member_{i}.nc', n_times=5, offset=10 * i) for i in range(3)]
+            write_wrf_file(f'{tmp_dir}/ensemble.nc', n_times=5, n_members=3)
+
+            wrf_to_tell_ensemble(members, output_file=f'{tmp_dir}/files.nc', time_chunk_size=2, **arguments)
+            wrf_to_tell_ensemble(f'{tmp_dir}/ensemble.nc', output_file=f'{tmp_dir}/dimension.nc',
+                                 member_dimension='member', members=['a', 'b', 'c'], **arguments)
+
+            # the WRF files are closed once aggregated, and also when the ensemble is rejected
+            with self.assertRaises(ValueError):
+                wrf_to_tell_ensemble(members, output_file=f'{tmp_dir}/invalid.nc', members=['a'], **arguments)
+            if os.path.isdir('/proc/self/fd'):
+                wrf_files = {os.path.realpath(f) for f in members + [f'{tmp_dir}/ensemble.nc']}
+                open_files = {os.path.realpath(f'/proc/self/fd/{fd}') for fd in os.listdir('/proc/self/fd')}
+                self.assertEqual(set(), open_files & wrf_files)
+
+            with xr.open_dataset(f'{tmp_dir}/files.nc') as files, xr.open_dataset(f'{tmp_dir}/dimension.nc') as dims:
+                self.assertEqual(['member_0', 'member_1', 'member_2'], files['member'].values.tolist())
+                self.assertEqual(['a', 'b', 'c'], dims['member'].values.tolist())
+                self.assertEqual(('member', 'time', 'FIPS'), files['T2'].dims)
+                self.assertEqual((3, 5, 1), files['T2'].shape)
+                np.testing.assert_allclose(files['T2'].values, dims['T2'].values)
+
+                # each member matches the county aggregation of its file
+                for i, member in enumerate(members):
+                    directory = f'{tmp_dir}/counties/{i}'
+                    os.makedirs(directory)
+                    wrf_to_tell_counties(member, output_directory=directory, n_jobs=1, **arguments)
+                    for t in files['time'].values:
+                        expected = pd.read_csv(
+                            f'{directory}/{pd.Timestamp(t):%Y_%m_%d_%H}_UTC_County_Mean_Meteorology.csv')
+                        np.testing.assert_allclose(expected['T2'], files['T2'].sel(time=t).values[i])
+                        np.testing.assert_allclose(expected['Q2'], files['Q2'].sel(time=t).values[i])
+                        self.assertEqual(expected['FIPS'].tolist(), files['FIPS'].values.tolist())
+
+    def test_rollups(self):
+        """Ensure the daily and monthly rollups match the statistics of the hourly files and count each hour once."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            arguments = dict(
+                wrf_variables=['T2', 'Q2'],
+                precisions=[2, 5],
+                output_directory=tmp_dir,
+                county_shapefile=f'{self.data_path}/test_counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+                n_jobs=1,
+                rollup_frequencies=['daily', 'monthly'],
+            )
+
+            # the second file overlaps the first, and the first is aggregated again
+            first = write_wrf_file(f'{tmp_dir}/wrfout_1.nc', start='2019-01-31 20:00', n_times=30)
+            second = write_wrf_file(f'{tmp_dir}/wrfout_2.nc', start='2019-02-01 22:00', n_times=6)
+            wrf_to_tell_counties(first, **arguments)
+            wrf_to_tell_counties(second, skip_existing=True, **arguments)
+            wrf_to_tell_counties(first, **arguments)
+
+            hourly = pd.concat([
+                pd.read_csv(f'{tmp_dir}/{f}').assign(Time_UTC=pd.to_datetime(f[:13], format='%Y_%m_%d_%H'))
+                for f in os.listdir(tmp_dir) if f.endswith('UTC_County_Mean_Meteorology.csv')
+            ])
+            self.assertEqual(32, hourly['Time_UTC'].nunique())
+
+            for frequency, period in [('daily', 'D'), ('monthly', 'M')]:
+                rollup = pd.read_csv(f'{tmp_dir}/{frequency}_County_Mean_Meteorology.csv', parse_dates=['Time_UTC'])
+                groups = hourly.groupby([hourly['Time_UTC'].dt.to_period(period).dt.to_timestamp(), 'FIPS'])
+                expected = groups.agg(['mean', 'min', 'max', lambda x: x.std(ddof=0), 'size'])
+                self.assertEqual(len(expected), len(rollup))
+                np.testing.assert_array_equal(expected[('T2', 'size')].values, rollup['Hours'].values)
+                for variable, precision in [('T2', 2), ('Q2', 5)]:
+                    for name, statistic in [('Mean', 'mean'), ('Min', 'min'), ('Max', 'max'), ('Std', '<lambda_0>')]:
+                        np.testing.assert_allclose(expected[(variable, statistic)].values,
+                                                   rollup[f'{variable}_{name}'].values, atol=10 ** -precision)
+
+            # the county means shared with the rollups are the ones aggregated without them
+            without = {k: v for k, v in arguments.items() if k != 'rollup_frequencies'}
+            pd.testing.assert_frame_equal(wrf_to_tell_counties(second, in_memory=True, **without).to_pandas(),
+                                          wrf_to_tell_counties(second, in_memory=True, **arguments).to_pandas())
+
+    def test_quantized_encoding(self):
+        """Ensure quantized variables are stored as small integers and decode to the rounded values on read."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            df = pd.DataFrame({
+                'Time_UTC': pd.date_range('2019-01-01 01:00', periods=4, freq='H'),
+                'FIPS': [1001, 1001, 1003, 1003],
+                'T2': [271.37, 305.12, np.nan, 288.5],
+                'Q2': [0.00312, 0.01205, 0.00087, 0.0101],
+            })
+
+            encoding = quantized_encoding(2, df['T2'].values)
+            self.assertEqual('int16', encoding['dtype'])
+            self.assertEqual('int32', quantized_encoding(2)['dtype'])
+            with self.assertRaises(ValueError):
+                encode_values(np.array([1e9]), quantized_encoding(2))
+
+            # Parquet files decode transparently, whichever way they were written
+            write_parquet(df, f'{tmp_dir}/float.parquet')
+            write_parquet(df, f'{tmp_dir}/quantized.parquet', ['T2', 'Q2'], [2, 5], encoding='quantized')
+            self.assertEqual('int16', pd.read_parquet(f'{tmp_dir}/quantized.parquet')['T2'].dtype)
+            pd.testing.assert_frame_equal(df, read_parquet(f'{tmp_dir}/float.parquet'))
+            pd.testing.assert_frame_equal(df, read_parquet(f'{tmp_dir}/quantized.parquet'))
+            pd.testing.assert_frame_equal(
+                df[['FIPS', 'Q2']], read_parquet(f'{tmp_dir}/quantized.parquet', columns=['FIPS', 'Q2']))
+
+            filled, _ = fill_missing_hours_in_data(
+                f'{tmp_dir}/quantized.parquet', start='2019-01-01 01:00', end='2019-01-01 02:00')
+            self.assertEqual(df['T2'].iloc[0], filled['T2'].iloc[0])
+
+            # xarray writes the encodings as CF attributes and decodes them on read
+            ds = df.set_index(['Time_UTC', 'FIPS']).to_xarray()
+            ds.to_netcdf(f'{tmp_dir}/quantized.nc', encoding=quantized_encodings(ds, ['T2', 'Q2'], [2, 5]))
+            with xr.open_dataset(f'{tmp_dir}/quantized.nc', mask_and_scale=False) as raw:
+                self.assertEqual(np.int16, raw['T2'].dtype)
+            with xr.open_dataset(f'{tmp_dir}/quantized.nc') as decoded:
+                np.testing.assert_allclose(ds['T2'].values, decoded['T2'].values, atol=1e-9)
+                np.testing.assert_allclose(ds['Q2'].values, decoded['Q2'].values, atol=1e-9)
+
+            # the ensemble output is stored as scaled integers
+            arguments = dict(
+                wrf_variables=['T2', 'Q2'],
+                precisions=[2, 5],
+                county_shapefile=f'{self.data_path}/test_counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+            )
+            members = [write_wrf_file(f'{tmp_dir}/member_{i}.nc', n_times=3, offset=10 * i) for i in range(2)]
+            wrf_to_tell_ensemble(members, output_file=f'{tmp_dir}/float.nc', **arguments)
+            wrf_to_tell_ensemble(members, output_file=f'{tmp_dir}/ensemble.nc', encoding='quantized', **arguments)
+            with xr.open_dataset(f'{tmp_dir}/float.nc') as expected, \
+                    xr.open_dataset(f'{tmp_dir}/ensemble.nc') as actual:
+                self.assertEqual(np.int32, actual['T2'].encoding['dtype'])
+                np.testing.assert_allclose(expected['T2'].values, actual['T2'].values, atol=1e-9)
+                np.testing.assert_allclose(expected['Q2'].values, actual['Q2'].values, atol=1e-9)
+
+    def test_in_memory(self):
+        """Ensure the components chain in memory through Arrow tables with the schema and values of their files."""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ['counties', 'sink', 'ba']:
+                os.makedirs(f'{tmp_dir}/{name}')
+            bounds = synthetic.wrf_bounds(6, 8)
+            synthetic.write_county_shapefile(f'{tmp_dir}/counties.shp', 2, 2, bounds)
+            wrf_file = write_wrf_file(f'{tmp_dir}/wrfout.nc', start='2019-01-01 01:00', n_times=5,
+                                      variables=synthetic.WRF_VARIABLES)
+            fips = synthetic.county_fips(4)
+            synthetic.write_balancing_authority_mapping(f'{tmp_dir}/mapping.csv', fips, 2)
+            synthetic.write_county_population(f'{tmp_dir}/population.csv', fips, [2010, 2020])
+
+            arguments = dict(
+                wrf_file=wrf_file,
+                wrf_variables=synthetic.WRF_VARIABLES,
+                precisions=synthetic.WRF_PRECISIONS,
+                county_shapefile=f'{tmp_dir}/counties.shp',
+                weight_and_mapping_file=f'{tmp_dir}/weights.parquet',
+                n_jobs=1,
+            )
+            ba_arguments = dict(
+                year=2019,
+                is_historical=True,
+                balancing_authority_to_fips_file=f'{tmp_dir}/mapping.csv',
+                county_population_by_year_file=f'{tmp_dir}/population.csv',
+                population_cache_directory=f'{tmp_dir}/cache',
+            )
+
+            # the county table matches the files, and the files can be written from it
+            self.assertEqual(5, wrf_to_tell_counties(output_directory=f'{tmp_dir}/counties', **arguments))
+            counties = wrf_to_tell_counties(in_memory=True, **arguments)
+            self.assertEqual(['Time_UTC', 'FIPS'] + synthetic.WRF_VARIABLES, counties.column_names)
+            self.assertEqual(4 * 5, counties.num_rows)
+            expected = read_county_files(f'{tmp_dir}/counties').to_pandas()
+            pd.testing.assert_frame_equal(expected, counties.to_pandas(), check_dtype=False)
+            self.assertEqual(5, len(write_county_files(counties, f'{tmp_dir}/sink')))
+            self.assertEqual(sorted(os.listdir(f'{tmp_dir}/counties')), sorted(os.listdir(f'{tmp_dir}/sink')))
+            with self.assertRaises(ValueError):
+                wrf_to_tell_counties(in_memory=True, skip_existing=True, **arguments)
+
+            # missing hours are filled in the table
+            filled = fill_missing_hours('2019-01-01 01:00', '2019-01-01 06:00', county_data=counties)
+            self.assertEqual(4 * 6, filled.num_rows)
+            self.assertTrue(np.isnan(filled.to_pandas()['T2'].values[-4:]).all())
+
+            # the balancing authority table matches aggregating the files
+            from_files = wrf_to_tell_balancing_authorities(
+                county_data_directory=f'{tmp_dir}/counties', county_data_suffix='_County_Mean_Meteorology',
+                in_memory=True, **ba_arguments)
+            from_table = wrf_to_tell_balancing_authorities(county_data=counties, in_memory=True, **ba_arguments)
+            self.assertEqual(['BA_Number', 'Time_UTC', 'T2', 'Q2', 'SWDOWN', 'GLW', 'WSPD'], from_table.column_names)
+            self.assertEqual(2 * 5, from_table.num_rows)
+            pd.testing.assert_frame_equal(from_files.to_pandas(), from_table.to_pandas())
+            self.assertEqual([], os.listdir(f'{tmp_dir}/ba'))
+
+            wrf_to_tell_balancing_authorities(county_data=counties, output_directory=f'{tmp_dir}/ba', **ba_arguments)
+            self.assertEqual(3, len(os.listdir(f'{tmp_dir}/ba')))
+            with self.assertRaises(ValueError):
+                wrf_to_tell_balancing_authorities(county_data=counties, **ba_arguments)
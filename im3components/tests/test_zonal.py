@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import salem
+from affine import Affine
+from shapely.geometry import Polygon, box
+
+import im3components.pop_tell_counties as pop
+from im3components import synthetic
+from im3components.wrf_to_tell.wrf_tell_counties import (
+    create_supersampled_weight_mapping,
+    create_weight_mapping,
+    get_weight_mapping,
+)
+from im3components.zonal import supersampled_coverage, weight_error
+
+
+class TestZonal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_supersampled_coverage(self):
+        """Ensure the coverage converges on the exact overlay for grids in either row order and any tile size."""
+
+        polygons = gpd.GeoSeries([Polygon([(0.3, 0.2), (3.7, 0.5), (2.5, 2.9)]), box(0.1, 2.2, 0.9, 2.8)])
+
+        for transform in [Affine(1, 0, 0, 0, -1, 3), Affine(1, 0, 0, 0, 1, 0)]:
+            cells = gpd.GeoSeries([box(*transform * (c, r), *transform * (c + 1, r + 1))
+                                   for r in range(3) for c in range(4)])
+
+            for max_tile_subcells in [500, 10 ** 6]:
+                coverage = supersampled_coverage(polygons, transform, (3, 4), 20, max_tile_subcells)
+
+                for zone, polygon in enumerate(polygons):
+                    approximate = np.zeros(12)
+                    rows = coverage[coverage['zone'] == zone]
+                    approximate[rows['cell_index'].values] = rows['coverage'].values
+                    np.testing.assert_allclose(cells.intersection(polygon).area.values, approximate, atol=0.05)
+
+    def test_wrf_weights(self):
+        """Ensure the supersampled WRF county weights are close to the exact weights."""
+
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=1, ny=20, nx=24)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 3, 4, synthetic.wrf_bounds(20, 24))
+
+        wrf = salem.open_wrf_dataset(self.path('wrfout.nc'))
+        exact = create_weight_mapping(wrf, ['T2'], self.path('counties.shp'))
+        report = weight_error(create_supersampled_weight_mapping(wrf, self.path('counties.shp')), exact)
+        wrf.close()
+
+        self.assertEqual(12, len(report))
+        self.assertFalse(report['missing'].any())
+        np.testing.assert_allclose(1., report['approximate'])
+        self.assertLess(report['absolute_error'].max(), 0.02)
+
+    def test_weights_file_engine(self):
+        """Ensure a weights file is only reused with the engine and supersample factor that created it."""
+
+        synthetic.write_wrf_file(self.path('wrfout.nc'), n_times=1, ny=10, nx=12)
+        synthetic.write_county_shapefile(self.path('counties.shp'), 2, 2, synthetic.wrf_bounds(10, 12))
+
+        wrf = salem.open_wrf_dataset(self.path('wrfout.nc'))
+        arguments = dict(wrf=wrf, wrf_variables=['T2'], county_shapefile=self.path('counties.shp'),
+                         weight_and_mapping_file=self.path('weights.parquet'))
+        mapping = get_weight_mapping(weight_engine='supersample', supersample_factor=5, **arguments)
+        pd.testing.assert_frame_equal(
+            mapping, get_weight_mapping(weight_engine='supersample', supersample_factor=5, **arguments))
+
+        with self.assertRaises(ValueError):
+            get_weight_mapping(weight_engine='supersample', supersample_factor=10, **arguments)
+        with self.assertRaises(ValueError):
+            get_weight_mapping(weight_engine='overlay', **arguments)
+
+        # files without a recorded engine are read as they are
+        mapping.to_parquet(self.path('weights.parquet'))
+        pd.testing.assert_frame_equal(mapping, get_weight_mapping(weight_engine='overlay', **arguments))
+        wrf.close()
+
+    def test_population_weights(self):
+        """Ensure county populations from supersampled weights are close to those from the exact intersection."""
+
+        bounds = synthetic.wrf_bounds(20, 24)
+        counties = synthetic.write_county_shapefile(self.path('counties.shp'), 3, 4, bounds)
+        raster = synthetic.write_population_raster(self.path('population.tif'), 60, 60, bounds)
+
+        arguments = dict(raster_list=[raster], county_shapefile=counties, state_name='alabama', year_list=[2020])
+        exact = pop.population_to_tell_counties(n_jobs=1, **arguments)
+        approximate = pop.population_to_tell_counties(n_jobs=1, weight_engine='supersample', **arguments)
+
+        pd.testing.assert_series_equal(exact['FIPS'], approximate['FIPS'])
+        np.testing.assert_allclose(exact['2020'], approximate['2020'], rtol=1e-3)
+        self.assertAlmostEqual(exact['2020'].sum(), approximate['2020'].sum(), places=3)
+
+        with self.assertRaises(ValueError):
+            pop.population_to_tell_counties(weight_engine='centroid', **arguments)
+
+    def test_weight_error(self):
+        """Ensure the error report flags differences and counties that the approximation missed."""
+
+        exact = pd.DataFrame({'cell_index': [0, 1, 2, 3], 'FIPS': ['01001', '01001', '01003', '01005'],
+                              'weight': [0.5, 0.5, 1., 1.]})
+        approximate = pd.DataFrame({'cell_index': [0, 1, 2], 'FIPS': ['01001', '01001', '01003'],
+                                    'weight': [0.6, 0.4, 1.]})
+
+        report = weight_error(approximate, exact).set_index('FIPS')
+
+        np.testing.assert_allclose([0.2, 0., 1.], report['absolute_error'])
+        np.testing.assert_allclose([0.1, 0., 1.], report['max_error'])
+        self.assertEqual([False, False, True], report['missing'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
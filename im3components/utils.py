@@ -1,3 +1,6 @@
+import hashlib
+import os
+
 import yaml
 
 
@@ -12,3 +15,63 @@ def read_yaml(yaml_file: str) -> dict:
 
     with open(yaml_file, 'r') as yml:
         return yaml.load(yml, Loader=yaml.FullLoader)
+
+
+def get_cache_directory(cache_directory: str = None) -> str:
+    """Return the directory used to cache derived artifacts, creating it if it does not exist.
+
+    :param cache_directory:         Full path to a directory to use; if None, the 'IM3COMPONENTS_CACHE_DIR' environment
+                                    variable is used if set, otherwise '~/.cache/im3components'
+    :type cache_directory:          str
+
+    :return:                        Full path to the cache directory
+    """
+
+    if cache_directory is None:
+        cache_directory = os.environ.get(
+            'IM3COMPONENTS_CACHE_DIR',
+            os.path.join(os.path.expanduser('~'), '.cache', 'im3components')
+        )
+
+    os.makedirs(cache_directory, exist_ok=True)
+
+    return cache_directory
+
+
+def file_hash(file_path: str, block_size: int = 2 ** 20) -> str:
+    """Compute the SHA-256 hash of a file's contents.
+
+    :param file_path:               Full path with file name and extension to the file
+    :type file_path:                str
+
+    :param block_size:              Number of bytes to read at a time
+    :type block_size:               int
+
+    :return:                        Hexadecimal digest of the file contents
+    """
+
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def available_memory_mb() -> float:
+    """Return the memory available to start new processes, in megabytes.
+
+    :return:                        Available memory in megabytes, or None if it cannot be determined
+    """
+
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 2 ** 20
+    except ImportError:
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        return None
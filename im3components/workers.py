@@ -0,0 +1,355 @@
+import importlib
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import uuid
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+
+# modules imported by each worker when it starts, so tasks do not pay for the imports; missing modules are skipped
+DEFAULT_PRELOAD = ('numpy', 'pandas', 'pyarrow', 'geopandas', 'xarray')
+
+# objects already loaded from shared memory in this process, and the segments their arrays are views of, by name
+_OBJECTS = {}
+_SEGMENTS = {}
+
+# segments of released objects whose arrays were still referenced, to close once they are not
+_DETACHED = []
+
+# alignment in bytes of the array buffers within a segment
+ALIGNMENT = 64
+
+# futures of the objects scattered to the workers of each dask client, by key
+_SCATTERED = weakref.WeakKeyDictionary()
+
+
+@dataclass(frozen=True)
+class Shared:
+    """Handle on an object placed in shared memory by a 'WorkerPool'.  Only the handle is sent with each task, which is
+    a few bytes per array in the object.
+
+    The object is pickled with its arrays out of band, e.g. the columns of a DataFrame or the data of a sparse matrix,
+    so a worker rebuilds it around read only views of the shared memory rather than copies.  The object is loaded once
+    per worker process, on first use, and kept for the life of the worker, unless it is transient:  transient objects,
+    such as a chunk of time slices, are dropped by each worker after the task.
+
+    :param name:                 name of the shared memory segment
+    :type name:                  str
+
+    :param size:                 size of the pickled object, without its arrays, in bytes
+    :type size:                  int
+
+    :param buffers:              offset and size in bytes of each array buffer within the segment
+    :type buffers:               Tuple[Tuple[int, int], ...]
+
+    :param transient:            whether workers drop the object after each task
+    :type transient:             bool
+
+    """
+
+    name: str
+    size: int
+    buffers: Tuple[Tuple[int, int], ...] = ()
+    transient: bool = False
+
+    def get(self) -> Any:
+        """Load the object, or return the one already loaded in this process."""
+
+        if self.name not in _OBJECTS:
+            segment = SharedMemory(name=self.name)
+            data = segment.buf[:self.size]
+            try:
+                _OBJECTS[self.name] = pickle.loads(
+                    data, buffers=[segment.buf[offset:offset + size].toreadonly() for offset, size in self.buffers])
+            finally:
+                data.release()
+
+            # the arrays of the object are views of the segment, so it stays open while the object is loaded
+            _SEGMENTS[self.name] = segment
+
+        return _OBJECTS[self.name]
+
+
+def _detach(name: str):
+    """Drop a loaded object and close its segment, or close it later if its arrays are still referenced."""
+
+    _OBJECTS.pop(name, None)
+    segment = _SEGMENTS.pop(name, None)
+    if segment is not None:
+        _DETACHED.append(segment)
+
+    for segment in list(_DETACHED):
+        try:
+            segment.close()
+        except BufferError:
+            continue
+        _DETACHED.remove(segment)
+
+
+def _initialize(preload: Iterable[str]):
+    """Import the preloaded modules in a new worker."""
+
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+
+
+def _call(fn: Callable, args: tuple, kwargs: dict) -> Any:
+    """Run a task in a worker, replacing 'Shared' arguments with their objects."""
+
+    transient = [v.name for v in list(args) + list(kwargs.values()) if isinstance(v, Shared) and v.transient]
+
+    args = [a.get() if isinstance(a, Shared) else a for a in args]
+    kwargs = {k: v.get() if isinstance(v, Shared) else v for k, v in kwargs.items()}
+
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        del args, kwargs
+        for name in transient:
+            _detach(name)
+
+
+class WorkerPool(ProcessPoolExecutor):
+    """Process pool that is created once and reused by every component call it is passed to, e.g. as the 'executor'
+    argument of 'wrf_to_tell_counties', or by every 'run' of a registry within 'Registry.workers'.
+
+    The workers import the 'preload' modules when they start.  Large read only objects, such as the mapping of grid
+    cells to counties or the county geometries, are placed in shared memory once with 'share';  tasks receive a small
+    'Shared' handle in their place, and each worker loads the object on first use and keeps it.
+
+    :param max_workers:          number of worker processes; defaults to the number of CPUs
+    :type max_workers:           int
+
+    :param preload:              modules to import in each worker when it starts
+    :type preload:               Iterable[str]
+
+    :param mp_context:           multiprocessing context used to start the workers; defaults to 'spawn', so the workers
+                                 do not inherit threads of this process that would be dead in a forked copy, such as
+                                 the thread pool of dask
+    :type mp_context:            multiprocessing.context.BaseContext
+
+    """
+
+    def __init__(self, max_workers: int = None, preload: Iterable[str] = DEFAULT_PRELOAD, mp_context=None):
+
+        # the workers must share the resource tracker of this process, or shared memory segments would be unlinked
+        # when the first worker exits
+        resource_tracker.ensure_running()
+
+        super().__init__(
+            max_workers=max_workers,
+            mp_context=mp_context if mp_context is not None else multiprocessing.get_context('spawn'),
+            initializer=_initialize,
+            initargs=(tuple(preload),),
+        )
+
+        self._segments: Dict[str, SharedMemory] = {}
+        self._handles: Dict[str, Shared] = {}
+        self._share_lock = threading.Lock()
+
+    def share(self, obj: Any, key: str = None, transient: bool = False) -> Shared:
+        """Place an object in shared memory for the workers.  Objects shared under the same key are only placed once,
+        so components can share e.g. a weights mapping keyed by its file and have later calls reuse it.
+
+        :param obj:                  object to share, which must be picklable
+        :type obj:                   Any
+
+        :param key:                  optional key identifying the object across calls
+        :type key:                   str
+
+        :param transient:            if True, workers drop the object after each task; used for data that is only
+                                     needed by one batch of tasks, which is then released
+        :type transient:             bool
+
+        :return:                     handle to pass to tasks in place of the object
+
+        """
+
+        with self._share_lock:
+            if (key is not None) and (key in self._handles):
+                return self._handles[key]
+
+            buffers = []
+            data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+            buffers = [b.raw() for b in buffers]
+
+            # lay out the pickle followed by each array buffer, aligned so the arrays can be used in place
+            offsets, position = [], len(data)
+            for buffer in buffers:
+                position += -position % ALIGNMENT
+                offsets.append((position, buffer.nbytes))
+                position += buffer.nbytes
+
+            segment = SharedMemory(create=True, size=max(position, 1))
+            segment.buf[:len(data)] = data
+            for (offset, size), buffer in zip(offsets, buffers):
+                segment.buf[offset:offset + size] = buffer
+
+            handle = Shared(segment.name, len(data), tuple(offsets), transient)
+            self._segments[segment.name] = segment
+            self._handles[key if key is not None else uuid.uuid4().hex] = handle
+
+            # the process that shares an object can use the handle too
+            _OBJECTS[segment.name] = obj
+
+        return handle
+
+    def release(self, key: Union[str, Shared]):
+        """Remove a shared object from shared memory.  Workers that already loaded it keep it until they drop it.
+
+        :param key:                  key the object was shared under, or its handle
+        :type key:                   Union[str, Shared]
+
+        """
+
+        with self._share_lock:
+            if isinstance(key, Shared):
+                key = next((k for k, handle in self._handles.items() if handle == key), None)
+
+            handle = self._handles.pop(key, None)
+            if handle is not None:
+                _OBJECTS.pop(handle.name, None)
+                segment = self._segments.pop(handle.name)
+                segment.close()
+                segment.unlink()
+
+    def submit(self, fn: Callable, /, *args, **kwargs):
+        return super().submit(_call, fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+
+        for key in list(self._handles):
+            self.release(key)
+
+
+def dask_client(executor: Any):
+    """Return the dask distributed client an executor submits to, or None if it is not backed by a dask cluster.  Both a
+    'distributed.Client' and the executor returned by its 'get_executor' are accepted.
+
+    :param executor:             executor the tasks will run on
+    :type executor:              Any
+
+    """
+
+    # distributed is only imported by callers that created a client, so it is not imported here
+    distributed = sys.modules.get('distributed')
+    if distributed is None:
+        return None
+
+    if isinstance(executor, distributed.Client):
+        return executor
+
+    cfexecutor = sys.modules.get('distributed.cfexecutor')
+    if (cfexecutor is not None) and isinstance(executor, cfexecutor.ClientExecutor):
+        return executor._client
+
+    return None
+
+
+def share(executor: Executor, obj: Any, key: str = None, transient: bool = False) -> Any:
+    """Make an object available to the tasks of an executor without sending it with every task.  Objects are placed in
+    shared memory for a 'WorkerPool' and scattered to the workers of a dask cluster, to every worker unless transient;
+    other executors receive the object itself.
+
+    :param executor:             executor the tasks will run on
+    :type executor:              concurrent.futures.Executor
+
+    :param obj:                  object to share
+    :type obj:                   Any
+
+    :param key:                  optional key identifying the object across calls
+    :type key:                   str
+
+    :param transient:            if True, the object is only needed by the next batch of tasks and is then released
+    :type transient:             bool
+
+    :return:                     value to pass to tasks in place of the object
+
+    """
+
+    if isinstance(executor, WorkerPool):
+        return executor.share(obj, key, transient)
+
+    client = dask_client(executor)
+    if client is not None:
+        scattered = _SCATTERED.setdefault(client, {})
+        if (key is not None) and (key in scattered):
+            return scattered[key]
+
+        # scatter as a list, so collections such as tuples are sent as one object
+        future = client.scatter([obj], broadcast=not transient, hash=False)[0]
+        if key is not None:
+            scattered[key] = future
+        return future
+
+    return obj
+
+
+def release(executor: Executor, value: Any):
+    """Release an object shared with 'share' once the tasks using it are done.
+
+    :param executor:             executor the tasks ran on
+    :type executor:              concurrent.futures.Executor
+
+    :param value:                value returned by 'share'
+    :type value:                 Any
+
+    """
+
+    if isinstance(executor, WorkerPool) and isinstance(value, Shared):
+        executor.release(value)
+
+    elif dask_client(executor) is not None:
+        scattered = _SCATTERED.get(dask_client(executor), {})
+        for key in [k for k, future in scattered.items() if future is value]:
+            del scattered[key]
+        value.release()
+
+
+def file_key(name: str, *paths: str) -> str:
+    """Key for sharing an object derived from files, which changes when any of the files change.
+
+    :param name:                 name of the kind of object, e.g. 'mapping'
+    :type name:                  str
+
+    :param paths:                full paths to the files the object is derived from
+    :type paths:                 str
+
+    """
+
+    return ':'.join([name] + [f'{os.path.abspath(p)}@{os.stat(p).st_mtime_ns}' for p in paths])
+
+
+def map_tasks(executor: Executor, fn: Callable, tasks: Iterable[dict]) -> List[Any]:
+    """Run a function with each set of keyword arguments on an executor and return the results in order.
+
+    :param executor:             executor to run the tasks on
+    :type executor:              concurrent.futures.Executor
+
+    :param fn:                   function to run
+    :type fn:                    Callable
+
+    :param tasks:                keyword arguments of each task
+    :type tasks:                 Iterable[dict]
+
+    """
+
+    # tasks on a dask cluster are not pure, since most write files, so equal arguments must not be merged into one
+    client = dask_client(executor)
+    submit = executor.submit if client is None else partial(client.submit, pure=False)
+
+    futures = [submit(fn, **task) for task in tasks]
+
+    return [future.result() for future in futures]
@@ -12,92 +12,70 @@
 # Import all of the required libraries and packages:
 import argparse
 from calendar import isleap
+from concurrent.futures import Executor
 import distutils.util
 import glob
 import numpy as np
 import pandas as pd
 import os
 import datetime
-from typing import List
+from typing import List, Tuple, Union
 
+from im3components.county_population import get_population_for_year, load_population_table
 
-def wrf_to_tell_balancing_authorities(
+
+def get_county_population(
     year: int,
     is_historical: bool,
-    balancing_authority_to_fips_file: str,
     county_population_by_year_file: str,
-    county_data_directory: str,
-    output_directory: str,
-    output_file_infix: str = 'WRF_Hourly_Mean_Meteorology',
-    county_data_prefix: str = '',
-    county_data_suffix: str = '_County_Mean_Meteorology.csv',
-    county_data_time_format: str = '%Y_%m_%d_%H',
-    variables: List[str] = None,
-    precisions: List[int] = None,
-):
+    population_cache_directory: str = None,
+) -> pd.DataFrame:
     """
-    Aggregate mean county data to mean balancing authority data.
+    Read the population of each county for a given year from the cached table of population by year.
 
-    :param int year: year of data to aggregate to balancing authority level
+    :rtype: pandas.DataFrame
+    :param int year: year of population to read
     :param bool is_historical: true if working with historical data as opposed to future/SSP data
-    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
     :param str county_population_by_year_file: path to the CSV file containing the county populations by year
-    :param str county_data_directory: path to the directory containing the mean county data
-    :param str output_directory: path to the directory to write output files
-    :param str output_file_infix: string to insert in the middle of the output file, between BA and year
-    :param str county_data_prefix: prefix at the beginning of mean county data files, before the datetime
-    :param str county_data_suffix: suffix at the end of mean county data files, after the datetime
-    :param str county_data_time_format: format string of the datetimes in the mean county data filenames
-    :param list(str) variables: list of the variables to aggregate by balancing authority
-    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str population_cache_directory: directory in which to cache population tables; defaults to the package cache
+    :return: DataFrame of county FIPS code and population
     """
 
-    begin_time = datetime.datetime.now()
+    # future data is available at decade resolution so the table is linearly interpolated between decades
+    table = load_population_table(county_population_by_year_file, cache_directory=population_cache_directory)
 
-    if variables is None:
-        variables = ['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW']
+    # historical data is available between 2000 and 2019, so clamp to this range
+    population_df = get_population_for_year(table, year, clamp=is_historical).sort_values('County_FIPS')
+    population_df['Population'] = population_df['Population'].round(0).astype(int)
 
-    if precisions is None:
-        precisions = [2, 5, 2, 2, 2, 2]
+    return population_df
+
+
+def get_balancing_authority_weights(
+    year: int,
+    is_historical: bool,
+    balancing_authority_to_fips_file: str,
+    county_population_by_year_file: str,
+    population_cache_directory: str = None,
+) -> pd.DataFrame:
+    """
+    Calculate the fraction of each balancing authority's population that lives in each of its counties.
+
+    :rtype: pandas.DataFrame
+    :param int year: year of population to weight by
+    :param bool is_historical: true if working with historical data as opposed to future/SSP data
+    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
+    :param str county_population_by_year_file: path to the CSV file containing the county populations by year
+    :param str population_cache_directory: directory in which to cache population tables; defaults to the package cache
+    :return: the balancing authority to county mapping with the population fraction of each county
+    """
 
     # Read the BA to county mapping file
     ba_mapping_df = pd.read_csv(balancing_authority_to_fips_file, index_col=None, header=0)
 
     # Read the county population by year file
-    if is_historical:
-        # historical data is available between 2000 and 2019, so clamp to this range
-        y = year
-        if year < 2000:
-            y = 2000
-        elif year > 2019:
-            y = 2019
-        population_df = pd.read_csv(
-            county_population_by_year_file,
-            index_col=None,
-            header=0,
-        )[['county_FIPS', f'pop_{y}']].rename(columns={
-            'county_FIPS': 'County_FIPS',
-            f'pop_{y}': 'Population',
-        }).sort_values('County_FIPS')
-        population_df['Population'] = population_df['Population'].round(0).astype(int)
-
-    else:
-        # future data is available at decade resolution so linearly interpolate between decades
-        population_df = pd.read_csv(
-            county_population_by_year_file,
-            index_col=None,
-            header=0,
-        ).rename(columns={
-            'FIPS': 'County_FIPS',
-        }).drop(columns=['state_name']).set_index('County_FIPS').T
-        population_df.index = population_df.index.astype(int)
-        population_df = population_df.sort_index().reindex(
-            range(population_df.index.min(), population_df.index.max()+1)
-        ).interpolate().T
-        population_df = population_df[[year]].reset_index().rename(columns={
-            year: 'Population'
-        }).sort_values('County_FIPS')
-        population_df['Population'] = population_df['Population'].round(0).astype(int)
+    population_df = get_county_population(
+        year, is_historical, county_population_by_year_file, population_cache_directory)
 
     # Merge by county
     ba_mapping_df = ba_mapping_df.merge(population_df, on='County_FIPS')
@@ -106,16 +84,25 @@ def wrf_to_tell_balancing_authorities(
     # Calculate the fraction of the BA's total population that lives in each county:
     ba_mapping_df['Population_Fraction'] = ba_mapping_df['Population'] / ba_mapping_df['Population_Sum']
     # Sort the data by BA number, drop duplicates and missing values, and return the dataframe:
-    ba_mapping_df = ba_mapping_df.sort_values('BA_Number').dropna()
+    return ba_mapping_df.sort_values('BA_Number').dropna()
 
-    # list of county data files for this year
-    data_files = sorted(
-        glob.glob(f'{county_data_directory}/{county_data_prefix}*{year}*{county_data_suffix}.csv'))
 
-    # build county data dataframe - set the filename as a column but then parse the time out of it
-    county_data = pd.concat(
-        (pd.read_csv(f).assign(Time_UTC=os.path.basename(f)).rename(columns={'FIPS': 'County_FIPS'}) for f in data_files))
-    county_data['Time_UTC'] = pd.to_datetime(county_data.Time_UTC, exact=False, format=county_data_time_format)
+def add_wind_speed(
+    county_data: pd.DataFrame,
+    variables: List[str],
+    precisions: List[int],
+) -> Tuple[List[str], List[int]]:
+    """
+    Replace the U10 and V10 wind components with the wind speed WSPD, if both are present.
+
+    :rtype: tuple(list(str), list(int))
+    :param pandas.DataFrame county_data: DataFrame of county data to which the WSPD column is added in place
+    :param list(str) variables: list of the variables to aggregate by balancing authority
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :return: new lists of variables and precisions with WSPD in place of U10 and V10
+    """
+    variables = list(variables)
+    precisions = list(precisions)
 
     if ('U10' in county_data) and ('V10' in county_data):
         # Compute the wind speed based on the U10 and V10 variables:
@@ -129,10 +116,30 @@ def wrf_to_tell_balancing_authorities(
         variables.append('WSPD')
         precisions.append(precision)
 
+    return variables, precisions
+
+
+def compute_balancing_authority_weighted_mean(
+    county_data: pd.DataFrame,
+    ba_mapping_df: pd.DataFrame,
+    variables: List[str],
+    precisions: List[int],
+) -> pd.DataFrame:
+    """
+    Compute the population weighted mean of county data per balancing authority and time.
+
+    :rtype: pandas.DataFrame
+    :param pandas.DataFrame county_data: DataFrame of county data with County_FIPS and Time_UTC columns
+    :param pandas.DataFrame ba_mapping_df: the balancing authority to county mapping with population fractions
+    :param list(str) variables: list of the variables to aggregate by balancing authority
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :return: DataFrame of the weighted means by BA_Number and Time_UTC
+    """
+
     merged_df = ba_mapping_df.merge(county_data, how='inner', on='County_FIPS')
 
     # calculate the weighted means per BA per hour
-    means = merged_df[variables].multiply(
+    return merged_df[variables].multiply(
         merged_df['Population_Fraction'],
         axis='index'
     ).join(
@@ -143,6 +150,78 @@ def wrf_to_tell_balancing_authorities(
         key: precisions[i] for i, key in enumerate(variables)
     }).reset_index()
 
+
+def aggregate_county_files(
+    files: List[str],
+    ba_mapping_df: pd.DataFrame,
+    variables: List[str],
+    precisions: List[int],
+    county_data_time_format: str = '%Y_%m_%d_%H',
+) -> pd.DataFrame:
+    """
+    Read mean county data files and compute their population weighted means per balancing authority and time.
+
+    :rtype: pandas.DataFrame
+    :param list(str) files: paths to the mean county data files, with the datetime in their names
+    :param pandas.DataFrame ba_mapping_df: the balancing authority to county mapping with population fractions
+    :param list(str) variables: list of the variables to aggregate by balancing authority
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str county_data_time_format: format string of the datetimes in the mean county data filenames
+    :return: DataFrame of the weighted means by BA_Number and Time_UTC, with WSPD in place of U10 and V10
+    """
+
+    # build county data dataframe - set the filename as a column but then parse the time out of it
+    county_data = pd.concat(
+        (pd.read_csv(f).assign(Time_UTC=os.path.basename(f)) for f in files))
+    county_data['Time_UTC'] = pd.to_datetime(county_data.Time_UTC, exact=False, format=county_data_time_format)
+
+    return aggregate_county_data(county_data, ba_mapping_df, variables, precisions)
+
+
+def aggregate_county_data(
+    county_data: pd.DataFrame,
+    ba_mapping_df: pd.DataFrame,
+    variables: List[str],
+    precisions: List[int],
+) -> pd.DataFrame:
+    """
+    Compute the population weighted means of mean county data per balancing authority and time.
+
+    :rtype: pandas.DataFrame
+    :param pandas.DataFrame county_data: DataFrame of mean county data with Time_UTC and FIPS columns
+    :param pandas.DataFrame ba_mapping_df: the balancing authority to county mapping with population fractions
+    :param list(str) variables: list of the variables to aggregate by balancing authority
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :return: DataFrame of the weighted means by BA_Number and Time_UTC, with WSPD in place of U10 and V10
+    """
+    county_data = county_data.rename(columns={'FIPS': 'County_FIPS'})
+
+    variables, precisions = add_wind_speed(county_data, variables, precisions)
+
+    return compute_balancing_authority_weighted_mean(county_data, ba_mapping_df, variables, precisions)
+
+
+def write_balancing_authority_files(
+    means: pd.DataFrame,
+    ba_mapping_df: pd.DataFrame,
+    year: int,
+    variables: List[str],
+    output_directory: str,
+    output_file_infix: str = 'WRF_Hourly_Mean_Meteorology',
+) -> List[str]:
+    """
+    Write a file of hourly means for each balancing authority and a summary of those missing hourly data.
+
+    :rtype: list(str)
+    :param pandas.DataFrame means: DataFrame of the weighted means by BA_Number and Time_UTC
+    :param pandas.DataFrame ba_mapping_df: the balancing authority to county mapping
+    :param int year: year of the data
+    :param list(str) variables: list of the aggregated variables to write
+    :param str output_directory: path to the directory to write output files
+    :param str output_file_infix: string to insert in the middle of the output file, between BA and year
+    :return: list of the output file names that are missing hourly data
+    """
+
     # hours in year for checking output length
     hours_in_year = 8784 if isleap(year) else 8760
     missing_data = []
@@ -160,6 +239,149 @@ def wrf_to_tell_balancing_authorities(
     # write a file summarizing the missing data
     pd.Series(missing_data).to_csv(f'{output_directory}/missing_data_summary.txt', header=['Missing Hourly Data'], index=False)
 
+    return missing_data
+
+
+def wrf_to_tell_balancing_authorities(
+    year: int,
+    is_historical: bool,
+    balancing_authority_to_fips_file: str,
+    county_population_by_year_file: str,
+    county_data_directory: str = None,
+    output_directory: str = None,
+    output_file_infix: str = 'WRF_Hourly_Mean_Meteorology',
+    county_data_prefix: str = '',
+    county_data_suffix: str = '_County_Mean_Meteorology.csv',
+    county_data_time_format: str = '%Y_%m_%d_%H',
+    variables: List[str] = None,
+    precisions: List[int] = None,
+    population_cache_directory: str = None,
+    time_chunk_size: int = 24,
+    executor: Executor = None,
+    rollup_frequencies: List[str] = None,
+    rollup_directory: str = None,
+    county_data: Union['pyarrow.Table', pd.DataFrame] = None,
+    in_memory: bool = False,
+):
+    """
+    Aggregate mean county data to mean balancing authority data.
+
+    :param int year: year of data to aggregate to balancing authority level
+    :param bool is_historical: true if working with historical data as opposed to future/SSP data
+    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
+    :param str county_population_by_year_file: path to the CSV file containing the county populations by year
+    :param str county_data_directory: path to the directory containing the mean county data; not needed if county_data
+        is given
+    :param str output_directory: path to the directory to write output files; not needed if in_memory
+    :param str output_file_infix: string to insert in the middle of the output file, between BA and year
+    :param str county_data_prefix: prefix at the beginning of mean county data files, before the datetime
+    :param str county_data_suffix: suffix at the end of mean county data files, after the datetime
+    :param str county_data_time_format: format string of the datetimes in the mean county data filenames
+    :param list(str) variables: list of the variables to aggregate by balancing authority
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str population_cache_directory: directory in which to cache population tables; defaults to the package cache
+    :param int time_chunk_size: number of mean county data files to aggregate per task when an executor is given
+    :param concurrent.futures.Executor executor: optional executor, such as a shared WorkerPool or a dask distributed
+        Client, to aggregate chunks of the county data files on; the mapping is shared with its workers once
+    :param list(str) rollup_frequencies: optional rollups, 'daily' and/or 'monthly', of the mean, minimum, maximum, and
+        standard deviation of each variable by balancing authority, accumulated from the hourly means of each chunk
+    :param str rollup_directory: path to the directory of the rollup files; defaults to output_directory
+    :param county_data: optional table of mean county data by Time_UTC and FIPS, as returned by wrf_to_tell_counties
+        in memory, to aggregate instead of the files in county_data_directory; it is aggregated in this process
+    :param bool in_memory: if true, return the balancing authority means as a table by BA_Number and Time_UTC rather
+        than writing a file per balancing authority
+    :return: the table of balancing authority means if in_memory
+    """
+    from im3components.workers import file_key, map_tasks, share
+    from im3components.wrf_to_tell.wrf_tell_rollups import RollupAccumulator, pivot_means
+    from im3components.wrf_to_tell.wrf_tell_tables import as_frame, as_table
+
+    begin_time = datetime.datetime.now()
+
+    if (county_data is None) and (county_data_directory is None):
+        raise ValueError('Either the county data or the directory of the county data files is needed.')
+
+    if (not in_memory) and (output_directory is None):
+        raise ValueError('An output directory is needed unless aggregating in memory.')
+
+    if rollup_frequencies and (rollup_directory or output_directory) is None:
+        raise ValueError('A rollup directory is needed to write the rollups when aggregating in memory.')
+
+    if variables is None:
+        variables = ['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW']
+
+    if precisions is None:
+        precisions = [2, 5, 2, 2, 2, 2]
+
+    ba_mapping_df = get_balancing_authority_weights(
+        year,
+        is_historical,
+        balancing_authority_to_fips_file,
+        county_population_by_year_file,
+        population_cache_directory,
+    )
+
+    if county_data is not None:
+        # the county data of this year
+        county_data = as_frame(county_data)
+        county_data = county_data[pd.DatetimeIndex(county_data['Time_UTC']).year == year]
+        chunks = [aggregate_county_data(county_data, ba_mapping_df, variables, precisions)]
+        means = chunks[0].sort_values(['BA_Number', 'Time_UTC']).reset_index(drop=True)
+
+    elif executor is None:
+        # list of county data files for this year
+        data_files = sorted(
+            glob.glob(f'{county_data_directory}/{county_data_prefix}*{year}*{county_data_suffix}.csv'))
+        chunks = [aggregate_county_files(data_files, ba_mapping_df, variables, precisions, county_data_time_format)]
+        means = chunks[0]
+
+    else:
+        data_files = sorted(
+            glob.glob(f'{county_data_directory}/{county_data_prefix}*{year}*{county_data_suffix}.csv'))
+
+        # the mapping is sent to the workers once, and each task reads and aggregates one chunk of hours
+        shared_mapping = share(executor, ba_mapping_df, key=file_key(
+            f'balancing_authority_weights:{year}:{is_historical}',
+            balancing_authority_to_fips_file,
+            county_population_by_year_file,
+        ))
+        chunks = map_tasks(executor, aggregate_county_files, (
+            dict(
+                files=data_files[i:i + time_chunk_size],
+                ba_mapping_df=shared_mapping,
+                variables=variables,
+                precisions=precisions,
+                county_data_time_format=county_data_time_format,
+            ) for i in range(0, len(data_files), time_chunk_size)
+        ))
+        means = pd.concat(chunks).sort_values(['BA_Number', 'Time_UTC']).reset_index(drop=True)
+
+    # WSPD takes the precision of U10, as in add_wind_speed
+    precision_of = dict(zip(variables, precisions))
+    precision_of.setdefault('WSPD', precision_of.get('U10'))
+
+    variables = [c for c in means.columns if c not in ['BA_Number', 'Time_UTC']]
+
+    if rollup_frequencies:
+        # the whole year is aggregated at once, so the rollups start afresh rather than adding to saved ones
+        rollups = RollupAccumulator(np.sort(means['BA_Number'].unique()), variables, rollup_frequencies)
+
+        # accumulate the hourly means of each chunk, with NaN for any balancing authority missing from a chunk
+        for chunk in chunks:
+            times, ids, values = pivot_means(chunk, 'BA_Number', variables)
+            chunk_values = np.full(values.shape[:2] + (len(rollups.ids),), np.nan)
+            chunk_values[:, :, np.searchsorted(rollups.ids, ids)] = values
+            rollups.update(times, chunk_values)
+
+        rollups.write(rollup_directory or output_directory, f'Balancing_Authority_Mean_Meteorology_{year}',
+                      'BA_Number', [precision_of[v] for v in variables])
+
+    if in_memory:
+        print('Elapsed time = ', datetime.datetime.now() - begin_time)
+        return as_table(means)
+
+    write_balancing_authority_files(means, ba_mapping_df, year, variables, output_directory, output_file_infix)
+
     print('Elapsed time = ', datetime.datetime.now() - begin_time)
 
 
@@ -247,7 +469,37 @@ if __name__ == '__main__':
         help='time format as it appears in county mean file names',
         default='%Y_%m_%d_%H'
     )
+    parser.add_argument(
+        '--population-cache-directory',
+        type=str,
+        help='directory in which to cache the interpolated county population table',
+        default=None
+    )
+    parser.add_argument(
+        '--scheduler-address',
+        type=str,
+        help='address of a dask distributed scheduler, e.g. tcp://node:8786, to spread the work across its workers',
+        default=None
+    )
+    parser.add_argument(
+        '--rollup-frequencies',
+        nargs='+',
+        type=str,
+        choices=['daily', 'monthly'],
+        help='rollups of the balancing authority statistics to accumulate from the hourly means',
+        default=None
+    )
+    parser.add_argument(
+        '--rollup-directory',
+        type=str,
+        help='path to which the rollups should be written; defaults to the output directory',
+        default=None
+    )
     args = parser.parse_args()
+    executor = None
+    if args.scheduler_address is not None:
+        from distributed import Client
+        executor = Client(args.scheduler_address)
     wrf_to_tell_balancing_authorities(
         year=args.year,
         is_historical=args.is_historical,
@@ -261,4 +513,8 @@ if __name__ == '__main__':
         county_data_time_format=args.county_data_time_format,
         variables=args.variables,
         precisions=args.precisions,
+        population_cache_directory=args.population_cache_directory,
+        executor=executor,
+        rollup_frequencies=args.rollup_frequencies,
+        rollup_directory=args.rollup_directory,
     )
@@ -1,12 +1,27 @@
+from __future__ import annotations
+
 import argparse
+from concurrent.futures import Executor
+from contextlib import nullcontext
 import datetime
+import json
 from os.path import isfile, join
-from typing import List
+from typing import TYPE_CHECKING, List, Tuple, Union
 
-import geopandas as gpd
-from joblib import Parallel, delayed
+import numpy as np
 import pandas as pd
-import salem
+
+# geopandas, joblib, and salem are slow to import, so they are imported where they are used
+if TYPE_CHECKING:
+    import geopandas as gpd
+    import pyarrow as pa
+    from scipy import sparse
+
+# number of time slices loaded from the WRF file and sent to the workers at once
+TIME_CHUNK_SIZE = 24
+
+# key of the Parquet schema metadata recording how a weights file was created
+WEIGHT_METADATA_KEY = b'weight_engine'
 
 
 def compute_county_weighted_mean(
@@ -41,6 +56,49 @@ def compute_county_weighted_mean(
     })
 
 
+def open_wrf_dataset(wrf_file: str):
+    """
+    Open a WRF output file with salem, such that closing the dataset closes the file.  The dataset returned by salem
+    has lost the reference to its file, so its close would otherwise leave the file handle and its netCDF lock open
+    until the dataset is garbage collected.
+
+    :rtype: xarray.Dataset
+    :param str wrf_file: path to the WRF output file
+    :return: the dataset
+    """
+    import salem
+
+    wrf = salem.open_wrf_dataset(wrf_file)
+
+    for variable in wrf.variables.values():
+        array = variable._data
+        while hasattr(array, 'array'):
+            array = array.array
+        datastore = getattr(array, 'datastore', None)
+        if datastore is not None:
+            wrf.set_close(datastore.close)
+            break
+
+    return wrf
+
+
+def output_file_name(
+        t: pd.Timestamp,
+        output_directory: str,
+        filename_suffix: str,
+) -> str:
+    """
+    Generate the name of the county output file for a time slice.
+
+    :rtype: str
+    :param pandas.Timestamp t: Timestamp of the time slice
+    :param str output_directory: path to the directory of the output files
+    :param str filename_suffix: string to append to the timestamp for the output file name
+    :return: the path of the output file
+    """
+    return join(output_directory, f'{t.strftime("%Y_%m_%d_%H_UTC")}{filename_suffix}.csv')
+
+
 def write_output_file(
         df: pd.DataFrame,
         t: pd.Timestamp,
@@ -55,40 +113,376 @@ def write_output_file(
     :param str output_directory: path to a directory to which to write the output file
     :param str filename_suffix: string to append to the timestamp for the output file name
     """
-    name = join(output_directory, f'{t.strftime("%Y_%m_%d_%H_UTC")}{filename_suffix}.csv')
-    df.to_csv(name, index=False)
+    df.to_csv(output_file_name(t, output_directory, filename_suffix), index=False)
 
 
-def process_time_slice(
+def aggregate_time_slice(
         df: pd.DataFrame,
         wrf_variables: List[str],
         precisions: List[int],
         mapping: pd.DataFrame,
-        output_path: str,
-        filename_suffix: str,
-) -> None:
+) -> pd.DataFrame:
     """
-    Calculate the county weighted mean for a single time slice of WRF output data.
+    Calculate the county weighted mean for a single time slice of WRF output data, labeled with its time.
 
+    :rtype: pandas.DataFrame
     :param pandas.DataFrame df: DataFrame containing data for a single time slice
     :param list(str) wrf_variables: list of columns in the DataFrame for which to calculate mean by county
     :param list(int) precisions: list of precisions corresponding to the columns
     :param pandas.DataFrame mapping: DataFrame containing the mapping of df index to county and weight
+    :return: a new DataFrame containing the time, county FIPS code, and weighted means
+    """
+    means = compute_county_weighted_mean(
+        mapping.merge(df, how='left', left_on='cell_index', right_index=True),
+        wrf_variables,
+        precisions,
+    )
+    means.insert(0, 'Time_UTC', df.time.iloc[0])
+    return means
+
+
+def time_chunk_values(
+        wrf,
+        wrf_variables: List[str],
+        start: int,
+        stop: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load a chunk of time slices of WRF output data as one array, with the grid cells flattened in the order of the
+    cell index of the weight mapping.
+
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    :param xarray.Dataset wrf: WRF output dataset
+    :param list(str) wrf_variables: list of variables to load
+    :param int start: index of the first time slice of the chunk
+    :param int stop: index after the last time slice of the chunk
+    :return: the times of the chunk and a (time, variable, cell) array of its values
+    """
+    chunk = wrf[wrf_variables].isel(time=slice(start, stop))
+    n_times = chunk.time.shape[0]
+    values = np.stack([
+        chunk[v].transpose('time', 'south_north', 'west_east').values.reshape(n_times, -1) for v in wrf_variables
+    ], axis=1)
+    return chunk.time.values, values
+
+
+def county_means_slice(
+        values: np.ndarray,
+        index: int,
+        time: np.datetime64,
+        counties: np.ndarray,
+        wrf_variables: List[str],
+        precisions: List[int],
+) -> pd.DataFrame:
+    """
+    Label one time slice of a chunk of county means, already computed with the county operator, with its time and the
+    county FIPS codes.
+
+    :rtype: pandas.DataFrame
+    :param numpy.ndarray values: (time, variable, county) array of a chunk of county means
+    :param int index: index of the time slice within the chunk
+    :param numpy.datetime64 time: time of the time slice
+    :param numpy.ndarray counties: the integer county FIPS code of each county of the chunk
+    :param list(str) wrf_variables: list of variables in the chunk, in order
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :return: a new DataFrame containing the time, county FIPS code, and weighted means
+    """
+    means = pd.DataFrame(values[index].T, columns=wrf_variables)
+    means.insert(0, 'FIPS', counties)
+    means.insert(0, 'Time_UTC', pd.Timestamp(time))
+    return means.round({key: precisions[i] for i, key in enumerate(wrf_variables)})
+
+
+def write_county_means_slice(
+        values: np.ndarray,
+        index: int,
+        time: np.datetime64,
+        counties: np.ndarray,
+        wrf_variables: List[str],
+        precisions: List[int],
+        output_path: str,
+        filename_suffix: str,
+) -> None:
+    """
+    Write one time slice of a chunk of county means, already computed with the county operator, to file.
+
+    :param numpy.ndarray values: (time, variable, county) array of a chunk of county means
+    :param int index: index of the time slice within the chunk
+    :param numpy.datetime64 time: time of the time slice
+    :param numpy.ndarray counties: the integer county FIPS code of each county of the chunk
+    :param list(str) wrf_variables: list of variables in the chunk, in order
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :param str output_path: path to which to write the output aggregation
+    :param str filename_suffix: string to append to the timestamp for the output file name
+    """
+    write_output_file(
+        county_means_slice(values, index, time, counties, wrf_variables, precisions).drop(columns='Time_UTC'),
+        pd.Timestamp(time),
+        output_path,
+        filename_suffix,
+    )
+
+
+def aggregate_chunk_slice(
+        values: np.ndarray,
+        index: int,
+        time: np.datetime64,
+        operator: sparse.csr_matrix,
+        counties: np.ndarray,
+        wrf_variables: List[str],
+        precisions: List[int],
+) -> pd.DataFrame:
+    """
+    Calculate the county weighted mean for one time slice of a chunk of WRF output data, using the sparse county
+    operator rather than the mapping DataFrame, so neither needs to be copied to the workers.  Missing (NaN) cells are
+    skipped, as by compute_county_weighted_mean.
+
+    :rtype: pandas.DataFrame
+    :param numpy.ndarray values: (time, variable, cell) array of a chunk of WRF output data
+    :param int index: index of the time slice within the chunk
+    :param numpy.datetime64 time: time of the time slice
+    :param scipy.sparse.csr_matrix operator: (county, cell) matrix of weights, as built by county_operator
+    :param numpy.ndarray counties: the integer county FIPS code of each row of the operator
+    :param list(str) wrf_variables: list of variables in the chunk, in order
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :return: a new DataFrame containing the time, county FIPS code, and weighted means
+    """
+    from im3components.wrf_to_tell.wrf_tell_operators import apply_county_operator
+
+    return county_means_slice(
+        apply_county_operator(operator, values[index])[np.newaxis], 0, time, counties, wrf_variables, precisions)
+
+
+def process_chunk_slice(
+        values: np.ndarray,
+        index: int,
+        time: np.datetime64,
+        operator: sparse.csr_matrix,
+        counties: np.ndarray,
+        wrf_variables: List[str],
+        precisions: List[int],
+        output_path: str,
+        filename_suffix: str,
+) -> None:
+    """
+    Calculate the county weighted mean for one time slice of a chunk of WRF output data and write it to file.
+
+    :param numpy.ndarray values: (time, variable, cell) array of a chunk of WRF output data
+    :param int index: index of the time slice within the chunk
+    :param numpy.datetime64 time: time of the time slice
+    :param scipy.sparse.csr_matrix operator: (county, cell) matrix of weights, as built by county_operator
+    :param numpy.ndarray counties: the integer county FIPS code of each row of the operator
+    :param list(str) wrf_variables: list of variables in the chunk, in order
+    :param list(int) precisions: list of precisions corresponding to the variables
     :param str output_path: path to which to write the output aggregation
     :param str filename_suffix: string to append to the timestamp for the output file name
     """
     write_output_file(
-        compute_county_weighted_mean(
-            mapping.merge(df, how='left', left_on='cell_index', right_index=True),
-            wrf_variables,
-            precisions,
-        ),
-        df.time.iloc[0],
+        aggregate_chunk_slice(values, index, time, operator, counties, wrf_variables, precisions).drop(
+            columns='Time_UTC'),
+        pd.Timestamp(time),
         output_path,
         filename_suffix,
     )
 
 
+def create_weight_mapping(
+        wrf,
+        wrf_variables: List[str],
+        county_shapefile: str,
+) -> gpd.GeoDataFrame:
+    """
+    Intersect the WRF grid cells with the county geometries and weight each intersection by its share of county area.
+
+    :rtype: geopandas.GeoDataFrame
+    :param xarray.Dataset wrf: WRF output dataset opened with salem
+    :param list(str) wrf_variables: list of variables to carry along with the intersection for the first time slice
+    :param str county_shapefile: path to a shapefile (.shp) with county geometries
+    :return: the intersection of counties and WRF cells with the cell index, county FIPS code, and weight
+    """
+    import geopandas as gpd
+
+    from im3components.county_geometry import load_county_geometries
+
+    # using the first file and time:
+    # * get the crs
+    # * create the mapping of cell index to county and weight
+    wrf_crs = wrf.pyproj_srs
+    wrf_df = wrf[wrf_variables].isel(time=0).to_dataframe().reset_index(drop=True)
+    wrf_df = gpd.GeoDataFrame(wrf_df, geometry=wrf.salem.grid.to_geometry().geometry).set_crs(wrf_crs)
+    wrf_df['cell_index'] = wrf_df.index.values
+
+    # load the counties reprojected to WRF projection, from the geometry cache when the shapefile is unchanged
+    counties = load_county_geometries(county_shapefile, wrf_crs, columns=['GEOID'], rename={'GEOID': 'FIPS'})
+
+    # find the intersection between counties and wrf cells
+    try:
+        intersection = gpd.overlay(counties, wrf_df, how='intersection')
+    except ValueError as e:
+        raise ValueError(f'''
+            The intersection of county geometry and WRF grid cells resulted in invalid geometry.
+            Please double check the geometry.
+            
+            {str(e)}
+        ''')
+    # weight by the intersection area
+    intersection['area'] = intersection.area
+    intersection['weight'] = (
+        intersection['area'] / intersection[['FIPS', 'area']].groupby('FIPS').area.transform('sum')
+    )
+
+    return intersection
+
+
+def create_supersampled_weight_mapping(
+        wrf,
+        county_shapefile: str,
+        factor: int = 10,
+) -> pd.DataFrame:
+    """
+    Approximate the mapping of WRF grid cell to county weight by rasterizing the counties onto the WRF grid
+    supersampled factor times along each axis, rather than intersecting the polygons exactly; see
+    im3components.zonal.weight_error to measure the difference.
+
+    :rtype: pandas.DataFrame
+    :param xarray.Dataset wrf: WRF output dataset opened with salem
+    :param str county_shapefile: path to a shapefile (.shp) with county geometries
+    :param int factor: number of sub-cells along each axis of a WRF grid cell
+    :return: DataFrame with the cell index, county FIPS code, and weight
+    """
+    from affine import Affine
+
+    from im3components.county_geometry import load_county_geometries
+    from im3components.zonal import supersampled_coverage
+
+    # load the counties reprojected to WRF projection, with the spatial index used to rasterize them
+    counties = load_county_geometries(county_shapefile, wrf.pyproj_srs, columns=['GEOID'], rename={'GEOID': 'FIPS'},
+                                      spatial_index=True)
+
+    # the cell index is the flattened (south_north, west_east) index, so rows run along dy from the first corner
+    grid = wrf.salem.grid
+    transform = Affine(grid.dx, 0, grid.corner_grid.x0, 0, grid.dy, grid.corner_grid.y0)
+    coverage = supersampled_coverage(counties.geometry, transform, (grid.ny, grid.nx), factor)
+
+    mapping = pd.DataFrame({
+        'cell_index': coverage['cell_index'].values,
+        'FIPS': counties['FIPS'].values[coverage['zone'].values],
+        'weight': coverage['coverage'].values,
+    })
+
+    # weight by the share of county area, as for the exact intersection
+    mapping['weight'] = mapping['weight'] / mapping.groupby('FIPS')['weight'].transform('sum')
+
+    return mapping
+
+
+def weight_settings(
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+) -> dict:
+    """
+    Describe how a weights file is created, as recorded in its metadata.  The supersample factor only applies to the
+    'supersample' engine.
+
+    :rtype: dict
+    :param str weight_engine: 'overlay' or 'supersample'
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :return: dictionary of the engine and supersample factor
+    """
+    return {
+        'engine': weight_engine,
+        'supersample_factor': int(supersample_factor) if weight_engine == 'supersample' else None,
+    }
+
+
+def write_weight_mapping(
+        mapping: pd.DataFrame,
+        weight_and_mapping_file: str,
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+) -> None:
+    """
+    Write the mapping of WRF grid cell to county weight, recording the engine that created it in the file metadata.
+
+    :param pandas.DataFrame mapping: DataFrame with the cell index, county FIPS code, and weight
+    :param str weight_and_mapping_file: path of the weights file to write
+    :param str weight_engine: the engine that created the mapping, 'overlay' or 'supersample'
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(pd.DataFrame(mapping))
+    metadata = dict(table.schema.metadata or {})
+    metadata[WEIGHT_METADATA_KEY] = json.dumps(weight_settings(weight_engine, supersample_factor)).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), weight_and_mapping_file)
+
+
+def read_weight_mapping(
+        weight_and_mapping_file: str,
+        weight_engine: str = None,
+        supersample_factor: int = 10,
+) -> pd.DataFrame:
+    """
+    Read the mapping of WRF grid cell to county weight, checking that it was created by the expected engine.  Files
+    written before the engine was recorded are read as they are.
+
+    :rtype: pandas.DataFrame
+    :param str weight_and_mapping_file: path of the weights file to read
+    :param str weight_engine: optional engine the mapping is expected to be created by, 'overlay' or 'supersample'
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :return: DataFrame with the cell index, county FIPS code, and weight
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(weight_and_mapping_file)
+    recorded = (table.schema.metadata or {}).get(WEIGHT_METADATA_KEY)
+
+    if (weight_engine is not None) and (recorded is not None):
+        expected = weight_settings(weight_engine, supersample_factor)
+        if json.loads(recorded) != expected:
+            raise ValueError(f'The weights file {weight_and_mapping_file} was created with {json.loads(recorded)}, '
+                             f'not {expected}; remove it to create it again, or use a different weights file.')
+
+    return table.to_pandas()
+
+
+def get_weight_mapping(
+        wrf,
+        wrf_variables: List[str],
+        county_shapefile: str,
+        weight_and_mapping_file: str,
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+) -> pd.DataFrame:
+    """
+    Read the mapping of WRF grid cell to county weight, creating and writing it first if it does not exist.  The
+    engine and supersample factor are recorded in the file, and an existing file created with others is rejected.
+
+    :rtype: pandas.DataFrame
+    :param xarray.Dataset wrf: WRF output dataset opened with salem
+    :param list(str) wrf_variables: list of variables to aggregate
+    :param str county_shapefile: path to a shapefile (.shp) with county geometries
+    :param str weight_and_mapping_file: path to read or write a weights file which maps WRF grid cell to county weight
+    :param str weight_engine: how to create the mapping; 'overlay' to intersect the polygons exactly, or 'supersample'
+        to rasterize the counties onto a supersampled grid, which is much faster for fine grids
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :return: DataFrame with the cell index, county FIPS code, and weight
+    """
+    if isfile(weight_and_mapping_file):
+        return read_weight_mapping(weight_and_mapping_file, weight_engine, supersample_factor)
+
+    if weight_engine == 'supersample':
+        mapping = create_supersampled_weight_mapping(wrf, county_shapefile, supersample_factor)
+    elif weight_engine == 'overlay':
+        mapping = create_weight_mapping(wrf, wrf_variables, county_shapefile)[['cell_index', 'FIPS', 'weight']]
+    else:
+        raise ValueError(f"Unknown weight engine '{weight_engine}'; expected 'overlay' or 'supersample'.")
+
+    write_weight_mapping(mapping, weight_and_mapping_file, weight_engine, supersample_factor)
+    return pd.DataFrame(mapping)
+
+
 def wrf_to_tell_counties(
         wrf_file: str,
         wrf_variables: List[str],
@@ -98,7 +492,14 @@ def wrf_to_tell_counties(
         output_directory: str = './County_Output_Files',
         output_filename_suffix: str = '_County_Mean_Meteorology',
         n_jobs: int = -1,
-) -> None:
+        executor: Executor = None,
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+        skip_existing: bool = False,
+        rollup_frequencies: List[str] = None,
+        rollup_directory: str = None,
+        in_memory: bool = False,
+) -> Union[int, pa.Table]:
     """
     Aggregate WRF output data to county level using area weighted average.
 
@@ -110,81 +511,156 @@ def wrf_to_tell_counties(
     :param str output_directory: path to which output should be written
     :param str output_filename_suffix: string to append to the timestamp for the output file name
     :param int n_jobs: number of time slices to process in parallel
+    :param concurrent.futures.Executor executor: optional executor, such as a shared WorkerPool or a dask distributed
+        Client, to process the time slices on instead of a new joblib pool; n_jobs is then ignored
+    :param str weight_engine: how to create a missing weights file; 'overlay' to intersect the polygons exactly, or
+        'supersample' to rasterize the counties onto a supersampled grid, which is much faster for fine grids; an
+        existing weights file created with another engine or supersample factor is rejected
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :param bool skip_existing: if true, only aggregate the time slices whose output file does not exist yet, e.g. to
+        pick up the new time slices of a WRF file that is still being written
+    :param list(str) rollup_frequencies: optional rollups, 'daily' and/or 'monthly', of the mean, minimum, maximum, and
+        standard deviation of each variable by county, accumulated as the time slices are aggregated; the rollups are
+        kept across calls, e.g. one per WRF file, so they cover every time slice aggregated into the rollup directory
+    :param str rollup_directory: path to the directory of the rollup files; defaults to output_directory
+    :param bool in_memory: if true, return the county means as a table by Time_UTC and FIPS rather than writing a file
+        per time slice; write_county_files of wrf_tell_tables writes the files from the table
+    :return: the number of time slices aggregated, or the table of county means if in_memory
     """
+    from joblib import Parallel, delayed
+    from im3components.workers import file_key, map_tasks, release, share
+    from im3components.wrf_to_tell.wrf_tell_operators import apply_county_operator, county_operator
+    from im3components.wrf_to_tell.wrf_tell_rollups import load_rollups
+    from im3components.wrf_to_tell.wrf_tell_tables import as_table
 
     begin_time = datetime.datetime.now()
 
+    if in_memory and skip_existing:
+        raise ValueError('Existing output files cannot be skipped when aggregating in memory.')
+
     if not isfile(wrf_file):
         raise FileNotFoundError('No file to process, exiting...')
 
-    wrf = salem.open_wrf_dataset(wrf_file)
+    wrf = open_wrf_dataset(wrf_file)
+
+    # the time slices to aggregate
+    pending = np.array([
+        not (skip_existing and isfile(output_file_name(pd.Timestamp(t), output_directory, output_filename_suffix)))
+        for t in wrf.time.values
+    ], dtype=bool)
+
+    if not pending.any():
+        wrf.close()
+        print('No time slices to process, exiting...')
+        return 0
+
+    # the county means of each time slice, if aggregating in memory
+    county_slices = []
 
     # if there's not already a mapping file, create one
-    if not isfile(weight_and_mapping_file):
-
-        # using the first file and time:
-        # * get the crs
-        # * create the mapping of cell index to county and weight
-        wrf_crs = wrf.pyproj_srs
-        wrf_df = wrf[wrf_variables].isel(time=0).to_dataframe().reset_index(drop=True)
-        wrf_df = gpd.GeoDataFrame(wrf_df, geometry=wrf.salem.grid.to_geometry().geometry).set_crs(wrf_crs)
-        wrf_df['cell_index'] = wrf_df.index.values
-
-        # load the counties and reproject to WRF projection
-        counties = gpd.read_file(county_shapefile)[["GEOID", "geometry"]].rename(columns={
-            'GEOID': 'FIPS',
-        }).to_crs(wrf_crs)
-
-        # find the intersection between counties and wrf cells
-        try:
-            intersection = gpd.overlay(counties, wrf_df, how='intersection')
-        except ValueError as e:
-            raise ValueError(f'''
-                The intersection of county geometry and WRF grid cells resulted in invalid geometry.
-                Please double check the geometry.
-                
-                {str(e)}
-            ''')
-        # weight by the intersection area
-        intersection['area'] = intersection.area
-        intersection['weight'] = (
-            intersection['area'] / intersection[['FIPS', 'area']].groupby('FIPS').area.transform('sum')
-        )
+    if (not isfile(weight_and_mapping_file)) and (weight_engine != 'overlay'):
+        mapping = get_weight_mapping(
+            wrf, wrf_variables, county_shapefile, weight_and_mapping_file, weight_engine, supersample_factor)
+        t_start = 0
+
+    elif not isfile(weight_and_mapping_file):
 
         # reuse this mapping for the remaining files and slices
+        intersection = create_weight_mapping(wrf, wrf_variables, county_shapefile)
         mapping = intersection[['cell_index', 'FIPS', 'weight']]
-        mapping.to_parquet(weight_and_mapping_file)
+        write_weight_mapping(mapping, weight_and_mapping_file, weight_engine, supersample_factor)
         # create the first output file
-        write_output_file(
-            compute_county_weighted_mean(
+        if pending[0]:
+            first = compute_county_weighted_mean(
                 intersection,
                 wrf_variables,
                 precisions,
-            ),
-            wrf_df.time.iloc[0],
-            output_directory,
-            output_filename_suffix,
-        )
+            )
+            if in_memory:
+                first.insert(0, 'Time_UTC', pd.Timestamp(intersection.time.iloc[0]))
+                county_slices.append(first)
+            else:
+                write_output_file(first, intersection.time.iloc[0], output_directory, output_filename_suffix)
         t_start = 1
 
     else:
-        mapping = pd.read_parquet(weight_and_mapping_file)
+        mapping = read_weight_mapping(weight_and_mapping_file, weight_engine, supersample_factor)
         t_start = 0
 
-    # create the remaining output for each time slice in each file
-    Parallel(n_jobs=n_jobs)(
-        delayed(process_time_slice)(
-            wrf[wrf_variables].isel(time=i).to_dataframe().reset_index(drop=True),
-            wrf_variables,
-            precisions,
-            mapping,
-            output_directory,
-            output_filename_suffix,
-        ) for i in range(wrf.time.shape[0])[t_start:]
-    )
+    # the weights are applied as a sparse (county, cell) operator, so the workers receive arrays rather than DataFrames
+    operator, counties = county_operator(mapping, wrf.south_north.shape[0] * wrf.west_east.shape[0])
+
+    rollups = None
+    if rollup_frequencies:
+        rollup_state_file = join(rollup_directory or output_directory,
+                                 f'{output_filename_suffix.lstrip("_")}_rollup_state.npz')
+        rollups = load_rollups(rollup_state_file, counties, wrf_variables, rollup_frequencies)
+
+        # the first time slice was aggregated with the intersection, so its means are reused rather than recomputed
+        if (t_start == 1) and pending[0]:
+            means = first.set_index('FIPS').reindex(counties)[wrf_variables].values.T
+            rollups.update(wrf.time.values[:1], means[np.newaxis])
+
+    if (executor is not None) and (rollups is None):
+        # the operator is placed in shared memory once and reused by later calls with the same weights file
+        key = file_key('county_operator', weight_and_mapping_file)
+        operator, counties = share(executor, operator, key=key), share(executor, counties, key=f'{key}:counties')
+
+    # create the remaining output for each chunk of time slices in each file
+    with (Parallel(n_jobs=n_jobs) if executor is None else nullcontext()) as parallel:
+        for chunk_start in range(t_start, wrf.time.shape[0], TIME_CHUNK_SIZE):
+            if not pending[chunk_start:chunk_start + TIME_CHUNK_SIZE].any():
+                continue
+
+            times, values = time_chunk_values(wrf, wrf_variables, chunk_start, chunk_start + TIME_CHUNK_SIZE)
+            mask = pending[chunk_start:chunk_start + len(times)]
+            common = dict(
+                counties=counties,
+                wrf_variables=wrf_variables,
+                precisions=precisions,
+                **({} if in_memory else dict(output_path=output_directory, filename_suffix=output_filename_suffix)),
+            )
+
+            if rollups is not None:
+                # the county means are computed once in one sparse product, rounded as in the output files, and
+                # shared by the rollups and the outputs, so the workers only write the files
+                values = apply_county_operator(operator, values[mask])
+                for i, precision in enumerate(precisions):
+                    values[:, i] = np.round(values[:, i], precision)
+                times = times[mask]
+                rollups.update(times, values)
+                tasks = [dict(index=i, time=t, **common) for i, t in enumerate(times)]
+                process = county_means_slice if in_memory else write_county_means_slice
+            else:
+                tasks = [dict(index=i, time=t, operator=operator, **common) for i, t in enumerate(times) if mask[i]]
+                process = aggregate_chunk_slice if in_memory else process_chunk_slice
+
+            if executor is None:
+                # joblib memory maps large arrays rather than pickling them with every task
+                results = parallel(delayed(process)(values=values, **task) for task in tasks)
+
+            else:
+                # each task receives only the handle of the chunk and the index of its time slice
+                shared_values = share(executor, values, transient=True)
+                results = map_tasks(executor, process, (dict(values=shared_values, **task) for task in tasks))
+                release(executor, shared_values)
+
+            if in_memory:
+                county_slices.extend(results)
+
+    wrf.close()
+
+    if rollups is not None:
+        rollups.save(rollup_state_file)
+        rollups.write(rollup_directory or output_directory, output_filename_suffix.lstrip('_'), 'FIPS', precisions)
 
     print('Elapsed time = ', datetime.datetime.now() - begin_time)
 
+    if in_memory:
+        return as_table(pd.concat(county_slices, ignore_index=True))
+
+    return int(pending.sum())
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -246,7 +722,49 @@ if __name__ == '__main__':
         help='number of time slices to process in parallel',
         default=-1
     )
+    parser.add_argument(
+        '--weight-engine',
+        type=str,
+        choices=['overlay', 'supersample'],
+        help='how to create a missing weights file: exact polygon overlay or rasterizing on a supersampled grid',
+        default='overlay'
+    )
+    parser.add_argument(
+        '--supersample-factor',
+        type=int,
+        help='number of sub-cells along each axis of a grid cell for the supersample weight engine',
+        default=10
+    )
+    parser.add_argument(
+        '--scheduler-address',
+        type=str,
+        help='address of a dask distributed scheduler, e.g. tcp://node:8786, to spread the work across its workers',
+        default=None
+    )
+    parser.add_argument(
+        '--skip-existing',
+        action='store_true',
+        help='only aggregate the time slices whose output file does not exist yet',
+    )
+    parser.add_argument(
+        '--rollup-frequencies',
+        nargs='+',
+        type=str,
+        choices=['daily', 'monthly'],
+        help='rollups of the county statistics to accumulate as the time slices are aggregated',
+        default=None
+    )
+    parser.add_argument(
+        '--rollup-directory',
+        type=str,
+        help='path to which the rollups should be written; defaults to the output directory',
+        default=None
+    )
     args = parser.parse_args()
+    executor = None
+    if args.scheduler_address is not None:
+        from distributed import Client
+        executor = Client(args.scheduler_address)
     wrf_to_tell_counties(
         wrf_file=args.file,
         wrf_variables=args.variables,
@@ -256,4 +774,10 @@ if __name__ == '__main__':
         output_directory=args.output_directory,
         output_filename_suffix=args.output_filename_suffix,
         n_jobs=args.number_of_tasks,
+        executor=executor,
+        weight_engine=args.weight_engine,
+        supersample_factor=args.supersample_factor,
+        skip_existing=args.skip_existing,
+        rollup_frequencies=args.rollup_frequencies,
+        rollup_directory=args.rollup_directory,
     )
@@ -0,0 +1,202 @@
+import json
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+# how aggregated variables are stored:  as floats, or as integers scaled by their precision
+ENCODINGS = ['float', 'quantized']
+
+# key of the Parquet schema metadata holding the scale factor and offset of each quantized column
+PARQUET_METADATA_KEY = b'quantization'
+
+
+def quantized_encoding(precision: int, values: np.ndarray = None) -> dict:
+    """
+    Find the CF encoding which stores a variable rounded to a number of decimal places as scaled integers, i.e. as
+    (value - add_offset) / scale_factor, with the smallest integer type which holds the range of the values.  The
+    minimum of the type is reserved as the fill value of NaN.  Without values, the range is unknown, e.g. when data
+    is written in chunks, so int32 is used with no offset.
+
+    :rtype: dict
+    :param int precision: number of decimal places the variable is rounded to
+    :param numpy.ndarray values: optional values of the variable to fit the offset and integer type to
+    :return: dictionary of dtype, scale_factor, add_offset, and _FillValue, as used by xarray and netCDF4
+    """
+    scale_factor = 10. ** -precision
+    dtype = np.dtype('int32')
+    add_offset = 0.
+
+    finite = None if values is None else np.asarray(values, dtype=np.float64)
+    if finite is not None:
+        finite = finite[np.isfinite(finite)]
+    if (finite is not None) and (finite.size > 0):
+        minimum, maximum = finite.min(), finite.max()
+        add_offset = round((minimum + maximum) / 2, precision)
+        steps = max(abs(maximum - add_offset), abs(minimum - add_offset)) / scale_factor + 1
+        dtype = next((np.dtype(t) for t in ['int16', 'int32'] if steps < np.iinfo(t).max), np.dtype('int64'))
+
+    return {
+        'dtype': dtype.name,
+        'scale_factor': scale_factor,
+        'add_offset': add_offset,
+        '_FillValue': int(np.iinfo(dtype).min),
+    }
+
+
+def encode_values(values: np.ndarray, encoding: dict) -> np.ndarray:
+    """
+    Convert values to the scaled integers of an encoding, with NaN as the fill value.
+
+    :rtype: numpy.ndarray
+    :param numpy.ndarray values: the values to encode
+    :param dict encoding: encoding as returned by quantized_encoding
+    :return: array of the encoded integers
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    scaled = np.round((np.where(missing, 0., values) - encoding['add_offset']) / encoding['scale_factor'])
+
+    limits = np.iinfo(encoding['dtype'])
+    if (scaled < limits.min + 1).any() or (scaled > limits.max).any():
+        raise ValueError(f"Values from {np.nanmin(values)} to {np.nanmax(values)} overflow the {encoding['dtype']} "
+                         f"encoding with a scale factor of {encoding['scale_factor']}; store them as floats instead.")
+
+    return np.where(missing, encoding['_FillValue'], scaled).astype(encoding['dtype'])
+
+
+def decode_values(values: np.ndarray, encoding: dict) -> np.ndarray:
+    """
+    Convert the scaled integers of an encoding back to floats, with NaN for the fill value.  The floats are rounded
+    to the precision of the encoding, so they equal the values as rounded before encoding.
+
+    :rtype: numpy.ndarray
+    :param numpy.ndarray values: the encoded integers
+    :param dict encoding: encoding as returned by quantized_encoding
+    :return: array of the decoded values
+    """
+    values = np.asarray(values)
+    precision = int(round(-np.log10(encoding['scale_factor'])))
+    decoded = np.round(values * encoding['scale_factor'] + encoding['add_offset'], precision)
+    return np.where(values == encoding['_FillValue'], np.nan, decoded)
+
+
+def quantized_encodings(
+        data: Union[pd.DataFrame, 'xarray.Dataset'],
+        variables: List[str],
+        precisions: List[int],
+) -> dict:
+    """
+    Find the quantized encoding of each variable of a DataFrame or Dataset.  The encodings of a Dataset may be passed
+    as the encoding argument of its to_netcdf or to_zarr, which store them as CF scale_factor and add_offset
+    attributes that xarray and other CF readers decode on read.
+
+    :rtype: dict
+    :param data: DataFrame or xarray Dataset with the variables
+    :param list(str) variables: names of the variables to encode
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :return: dictionary of the encoding of each variable, fit to its values
+    """
+    return {
+        variable: quantized_encoding(precision, np.asarray(data[variable]))
+        for variable, precision in zip(variables, precisions)
+    }
+
+
+def quantized_table(
+        df: pd.DataFrame,
+        variables: List[str],
+        precisions: List[int],
+        encodings: dict = None,
+) -> 'pyarrow.Table':
+    """
+    Convert a DataFrame to an Arrow table with the variables stored as scaled integers, and the encoding of each in the
+    schema metadata so read_parquet can decode them.
+
+    :rtype: pyarrow.Table
+    :param pandas.DataFrame df: DataFrame with the variables and any other columns, which are stored unchanged
+    :param list(str) variables: names of the variables to encode
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :param dict encodings: optional encoding of each variable, e.g. to keep the schema of a file written in chunks;
+        defaults to encodings fit to the values
+    :return: the encoded table
+    """
+    import pyarrow as pa
+
+    if encodings is None:
+        encodings = quantized_encodings(df, variables, precisions)
+
+    encoded = df.assign(**{variable: encode_values(df[variable].values, encodings[variable]) for variable in variables})
+    table = pa.Table.from_pandas(encoded, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[PARQUET_METADATA_KEY] = json.dumps({variable: encodings[variable] for variable in variables}).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def write_parquet(
+        df: pd.DataFrame,
+        path: str,
+        variables: List[str] = None,
+        precisions: List[int] = None,
+        encoding: str = 'float',
+) -> str:
+    """
+    Write a DataFrame of aggregated variables to a Parquet file, either as is or with the variables quantized.
+
+    :rtype: str
+    :param pandas.DataFrame df: DataFrame to write
+    :param str path: path of the Parquet file to write
+    :param list(str) variables: names of the variables to quantize
+    :param list(int) precisions: list of precisions corresponding to the variables
+    :param str encoding: 'float' to store the variables as they are, or 'quantized' to store them as integers scaled
+        by their precision
+    :return: the path of the file
+    """
+    import pyarrow.parquet as pq
+
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Encoding '{encoding}' is not one of {ENCODINGS}.")
+
+    if encoding == 'float':
+        df.to_parquet(path, index=False)
+    elif (variables is None) or (precisions is None):
+        raise ValueError('The variables and their precisions are needed to quantize them.')
+    else:
+        pq.write_table(quantized_table(df, variables, precisions), path)
+
+    return path
+
+
+def decode_table(table: 'pyarrow.Table') -> pd.DataFrame:
+    """
+    Convert an Arrow table to a DataFrame, decoding any variables quantized by quantized_table.
+
+    :rtype: pandas.DataFrame
+    :param pyarrow.Table table: the table, as read from a Parquet file
+    :return: the decoded DataFrame
+    """
+    metadata = (table.schema.metadata or {}).get(PARQUET_METADATA_KEY)
+    df = table.to_pandas()
+    if metadata is None:
+        return df
+
+    encodings = json.loads(metadata)
+    return df.assign(**{
+        variable: decode_values(df[variable].values, encoding)
+        for variable, encoding in encodings.items() if variable in df.columns
+    })
+
+
+def read_parquet(path: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Read a Parquet file of aggregated variables, decoding any quantized variables, so files written either way read
+    the same.
+
+    :rtype: pandas.DataFrame
+    :param str path: path of the Parquet file
+    :param list(str) columns: optional columns to read
+    :return: the decoded DataFrame
+    """
+    import pyarrow.parquet as pq
+
+    return decode_table(pq.read_table(path, columns=columns))
@@ -0,0 +1,288 @@
+import argparse
+import datetime
+from os.path import basename, isfile, splitext
+from typing import List, Union
+
+import numpy as np
+
+from im3components.wrf_to_tell.wrf_tell_counties import (
+    TIME_CHUNK_SIZE,
+    get_weight_mapping,
+    open_wrf_dataset,
+    time_chunk_values,
+)
+from im3components.wrf_to_tell.wrf_tell_encoding import ENCODINGS, encode_values, quantized_encoding
+from im3components.wrf_to_tell.wrf_tell_operators import apply_county_operator, county_operator
+
+
+def open_members(
+        wrf_files: List[str],
+        member_dimension: str = None,
+) -> tuple:
+    """
+    Open the members of an ensemble of WRF output, either one file per member or files with a member dimension.
+
+    :rtype: tuple(list(xarray.Dataset), list(str), list(xarray.Dataset))
+    :param list(str) wrf_files: paths to the WRF output files
+    :param str member_dimension: name of the member dimension within the files; if not given, each file is a member
+    :return: a dataset per member, the default name of each member, and the dataset of each file, which the caller
+        closes once done with the members
+    """
+    datasets, names, opened = [], [], []
+    try:
+        for wrf_file in wrf_files:
+            if not isfile(wrf_file):
+                raise FileNotFoundError(f'WRF file does not exist: {wrf_file}')
+
+            wrf = open_wrf_dataset(wrf_file)
+            opened.append(wrf)
+            stem = splitext(basename(wrf_file))[0]
+
+            if member_dimension is None:
+                datasets.append(wrf)
+                names.append(stem)
+                continue
+
+            if member_dimension not in wrf.dims:
+                raise ValueError(f"WRF file {wrf_file} has no dimension named '{member_dimension}'.")
+
+            labels = (
+                wrf[member_dimension].values if member_dimension in wrf.coords else range(wrf.dims[member_dimension])
+            )
+            for i, label in enumerate(labels):
+                datasets.append(wrf.isel({member_dimension: i}))
+                names.append(str(label) if len(wrf_files) == 1 else f'{stem}:{label}')
+
+    except Exception:
+        for wrf in opened:
+            wrf.close()
+        raise
+
+    return datasets, names, opened
+
+
+def wrf_to_tell_ensemble(
+        wrf_files: Union[str, List[str]],
+        wrf_variables: List[str],
+        precisions: List[int],
+        output_file: str,
+        members: List[str] = None,
+        member_dimension: str = None,
+        county_shapefile: str = './Geolocation/tl_2020_us_county/tl_2020_us_county.shp',
+        weight_and_mapping_file: str = './grid_cell_to_county_weight.parquet',
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+        time_chunk_size: int = TIME_CHUNK_SIZE,
+        encoding: str = 'float',
+) -> str:
+    """
+    Aggregate an ensemble of WRF output on a shared domain to county level using area weighted average, loading the
+    weights once and applying them to each chunk of times of every member in one batched sparse product. The county
+    means are written to a single NetCDF file with member, time, and FIPS dimensions, rather than to a CSV file per
+    time slice and member.
+
+    :rtype: str
+    :param str or list(str) wrf_files: paths to the WRF output files of the members, or to files with a member dimension
+    :param list(str) wrf_variables: list of variables to aggregate
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str output_file: path to which to write the county means (.nc)
+    :param list(str) members: optional name of each member; defaults to the file names, or to the member coordinate
+    :param str member_dimension: name of the member dimension within the files; if not given, each file is a member
+    :param str county_shapefile: path to a shapefile (.shp) with county geometries
+    :param str weight_and_mapping_file: path to read or write a weights file which maps WRF grid cell to county weight
+    :param str weight_engine: how to create a missing weights file; 'overlay' to intersect the polygons exactly, or
+        'supersample' to rasterize the counties onto a supersampled grid, which is much faster for fine grids; an
+        existing weights file created with another engine or supersample factor is rejected
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :param int time_chunk_size: number of time slices of every member to hold in memory and aggregate at once
+    :param str encoding: how to store the variables; 'float', or 'quantized' to store them as int32 scaled by their
+        precision, with CF scale_factor and add_offset attributes so that xarray and other CF readers decode them
+    :return: the path of the output file
+    """
+    import netCDF4
+
+    begin_time = datetime.datetime.now()
+
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Encoding '{encoding}' is not one of {ENCODINGS}.")
+
+    if isinstance(wrf_files, str):
+        wrf_files = [wrf_files]
+
+    datasets, names, opened = open_members(wrf_files, member_dimension)
+
+    # the files are closed once aggregated, or on any failure, so no handles or netCDF locks are left on them
+    try:
+        if members is None:
+            members = names
+        elif len(members) != len(datasets):
+            raise ValueError(f'{len(members)} member names were given for {len(datasets)} members.')
+
+        # the members must share the domain and times, so the one operator applies to every member
+        times = datasets[0].time.values
+        shape = (datasets[0].south_north.shape[0], datasets[0].west_east.shape[0])
+        for member, wrf in zip(members, datasets):
+            if (wrf.south_north.shape[0], wrf.west_east.shape[0]) != shape:
+                raise ValueError(f'Member {member} is not on the same grid as member {members[0]}.')
+            if not np.array_equal(wrf.time.values, times):
+                raise ValueError(f'Member {member} does not have the same times as member {members[0]}.')
+
+        mapping = get_weight_mapping(datasets[0], wrf_variables, county_shapefile, weight_and_mapping_file,
+                                     weight_engine, supersample_factor)
+        operator, counties = county_operator(mapping, shape[0] * shape[1])
+
+        with netCDF4.Dataset(output_file, 'w') as nc:
+            nc.createDimension('member', len(members))
+            nc.createDimension('time', None)
+            nc.createDimension('FIPS', len(counties))
+
+            nc.createVariable('member', str, ('member',))[:] = np.array(members, dtype=object)
+            nc.createVariable('FIPS', 'i4', ('FIPS',))[:] = counties
+            time_variable = nc.createVariable('time', 'f8', ('time',))
+            time_variable.units = 'hours since 1970-01-01 00:00:00'
+            time_variable.calendar = 'standard'
+            # the file is written in chunks, so the quantized encodings are not fit to the values
+            encodings = {}
+            for variable, precision in zip(wrf_variables, precisions):
+                if encoding == 'float':
+                    nc.createVariable(variable, 'f8', ('member', 'time', 'FIPS'))
+                    continue
+
+                encodings[variable] = quantized_encoding(precision)
+                nc_variable = nc.createVariable(variable, encodings[variable]['dtype'], ('member', 'time', 'FIPS'),
+                                                fill_value=encodings[variable]['_FillValue'])
+                nc_variable.scale_factor = encodings[variable]['scale_factor']
+                nc_variable.add_offset = encodings[variable]['add_offset']
+                nc_variable.set_auto_maskandscale(False)
+
+            for chunk_start in range(0, len(times), time_chunk_size):
+                chunk_stop = min(chunk_start + time_chunk_size, len(times))
+
+                # (member, time, variable, cell) block of the chunk, reduced to counties in one product
+                values = np.stack([
+                    time_chunk_values(wrf, wrf_variables, chunk_start, chunk_stop)[1] for wrf in datasets
+                ])
+                means = apply_county_operator(operator, values)
+
+                time_variable[chunk_start:chunk_stop] = (
+                    (times[chunk_start:chunk_stop] - np.datetime64('1970-01-01')) / np.timedelta64(1, 'h')
+                )
+                for i, (variable, precision) in enumerate(zip(wrf_variables, precisions)):
+                    rounded = np.round(means[:, :, i, :], precision)
+                    if variable in encodings:
+                        rounded = encode_values(rounded, encodings[variable])
+                    nc[variable][:, chunk_start:chunk_stop, :] = rounded
+
+    finally:
+        for wrf in opened:
+            wrf.close()
+
+    print('Elapsed time = ', datetime.datetime.now() - begin_time)
+
+    return output_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Read in the WRF output files of an ensemble and write their county level aggregations to a '
+                    'single NetCDF file with a member dimension.'
+    )
+    parser.add_argument(
+        'files',
+        metavar='/path/to/WRF/output/file',
+        type=str,
+        nargs='+',
+        help='paths to the WRF output file of each member, or to files with a member dimension',
+    )
+    parser.add_argument(
+        '-v',
+        '--variables',
+        nargs='+',
+        type=str,
+        default=['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW'],
+        help='list of variables to aggregate',
+    )
+    parser.add_argument(
+        '-p',
+        '--precisions',
+        nargs='+',
+        type=int,
+        default=[2, 5, 2, 2, 2, 2],
+        help='list of precisions for the variables to aggregate',
+    )
+    parser.add_argument(
+        '-s',
+        '--shapefile-path',
+        type=str,
+        help='path to a shapefile (.shp) with county geometries',
+        required=True,
+    )
+    parser.add_argument(
+        '-w',
+        '--weights-file-path',
+        type=str,
+        help='path to the weights file mapping grid cell to county and weight; will be created if it does not exist',
+        required=True,
+    )
+    parser.add_argument(
+        '-o',
+        '--output-file',
+        type=str,
+        help='path to which the NetCDF output should be written',
+        required=True,
+    )
+    parser.add_argument(
+        '-m',
+        '--members',
+        nargs='+',
+        type=str,
+        help='name of each member; defaults to the file names or the member coordinate',
+        default=None
+    )
+    parser.add_argument(
+        '--member-dimension',
+        type=str,
+        help='name of the member dimension within the WRF files, if the members are not in separate files',
+        default=None
+    )
+    parser.add_argument(
+        '--weight-engine',
+        type=str,
+        choices=['overlay', 'supersample'],
+        help='how to create a missing weights file: exact polygon overlay or rasterizing on a supersampled grid',
+        default='overlay'
+    )
+    parser.add_argument(
+        '--supersample-factor',
+        type=int,
+        help='number of sub-cells along each axis of a grid cell for the supersample weight engine',
+        default=10
+    )
+    parser.add_argument(
+        '--time-chunk-size',
+        type=int,
+        help='number of time slices of every member to hold in memory at once',
+        default=TIME_CHUNK_SIZE
+    )
+    parser.add_argument(
+        '--encoding',
+        type=str,
+        choices=ENCODINGS,
+        help='how to store the variables: as floats, or as integers scaled by their precision',
+        default='float'
+    )
+    args = parser.parse_args()
+    wrf_to_tell_ensemble(
+        wrf_files=args.files,
+        wrf_variables=args.variables,
+        precisions=args.precisions,
+        output_file=args.output_file,
+        members=args.members,
+        member_dimension=args.member_dimension,
+        county_shapefile=args.shapefile_path,
+        weight_and_mapping_file=args.weights_file_path,
+        weight_engine=args.weight_engine,
+        supersample_factor=args.supersample_factor,
+        time_chunk_size=args.time_chunk_size,
+        encoding=args.encoding,
+    )
@@ -3,25 +3,25 @@ import os
 
 from datetime import datetime, timedelta
 from glob import glob
+from typing import List, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
+from im3components.wrf_to_tell.wrf_tell_encoding import ENCODINGS, decode_table, read_parquet, write_parquet
 
-def fill_missing_hours(
-    start: str,
-    end: str,
-    output_directory: str = './County_Output_Files',
-    output_filename_suffix: str = '_County_Mean_Meteorology',
-):
+
+FILL_METHODS = ['nan', 'linear', 'nearest', 'climatology']
+
+
+def parse_time_range(start: str, end: str) -> Tuple[datetime, datetime]:
     """
-    Check county output files for missing hours and create files for those hours filled with NaNs.
+    Parse the first and last expected datetimes of a county time series.
 
+    :rtype: tuple(datetime.datetime, datetime.datetime)
     :param str start: first expected datetime in ISO8601 format; if just a date assumes start of day (1am)
     :param str end: last expected datetime in ISO8601 format; if just a date assumes end of day (midnight)
-    :param str output_directory: path to which output should be written
-    :param str output_filename_suffix: string to append to the timestamp for the output file name
-    :param str county_data_time_format: format string of the datetimes in the mean county data filenames
+    :return: the first and last expected datetimes, truncated to the hour
     """
     try:
         if (start is None) or (end is None):
@@ -42,10 +42,200 @@ def fill_missing_hours(
     except ValueError:
         raise ValueError('Start and end must be provided in ISO8601 format.')
 
+    return start_dt, end_dt
+
+
+def find_missing_hours(
+    times: Union[pd.DatetimeIndex, pd.Series, np.ndarray],
+    start_dt: datetime,
+    end_dt: datetime,
+) -> pd.DatetimeIndex:
+    """
+    Find the hours between two datetimes that are not present in a collection of times.
+
+    :rtype: pandas.DatetimeIndex
+    :param times: datetimes for which data is available; may contain duplicates
+    :param datetime.datetime start_dt: first expected datetime
+    :param datetime.datetime end_dt: last expected datetime
+    :return: the expected hours that are missing from the times
+    """
+    hour = np.timedelta64(1, 'h')
+    start = np.datetime64(start_dt, 'h')
+    n_hours = int((np.datetime64(end_dt, 'h') - start) // hour) + 1
+
+    # integer hour offsets from the start, ignoring anything outside of the expected range
+    offsets = (pd.DatetimeIndex(times).values.astype('datetime64[h]') - start) // hour
+    offsets = offsets[(offsets >= 0) & (offsets < n_hours)]
+
+    present = np.zeros(n_hours, dtype=bool)
+    present[offsets] = True
+
+    return pd.DatetimeIndex(start + np.flatnonzero(~present) * hour)
+
+
+def summarize_gaps(missing: pd.DatetimeIndex) -> pd.DataFrame:
+    """
+    Collapse a collection of missing hours into contiguous gaps.
+
+    :rtype: pandas.DataFrame
+    :param pandas.DatetimeIndex missing: the sorted missing hours
+    :return: a DataFrame with the start, end, and length in hours of each gap
+    """
+    offsets = missing.values.astype('datetime64[h]').astype(np.int64)
+
+    # a new gap begins wherever consecutive missing hours are more than an hour apart
+    gap_starts = np.flatnonzero(np.diff(offsets, prepend=offsets[:1] - 2) != 1)
+    gap_ends = np.append(gap_starts[1:], len(offsets))[:len(gap_starts)] - 1
+
+    return pd.DataFrame({
+        'Gap_Start': missing[gap_starts],
+        'Gap_End': missing[gap_ends],
+        'Missing_Hours': gap_ends - gap_starts + 1,
+    })
+
+
+def fill_missing_hours_in_data(
+    county_data: Union[pd.DataFrame, 'pyarrow.Table', str],
+    start: str,
+    end: str,
+    method: str = 'nan',
+    variables: List[str] = None,
+    precisions: List[int] = None,
+    time_key: str = 'Time_UTC',
+    county_fips_key: str = 'FIPS',
+    output_file: str = None,
+    report_file: str = None,
+    encoding: str = 'float',
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Detect and fill missing hours in a consolidated, time-indexed table of county data in a single pass.
+
+    :rtype: tuple(pandas.DataFrame, pandas.DataFrame)
+    :param county_data: DataFrame, Arrow table, or path to a Parquet file, with a time column, a county FIPS column,
+        and variables
+    :param str start: first expected datetime in ISO8601 format; if just a date assumes start of day (1am)
+    :param str end: last expected datetime in ISO8601 format; if just a date assumes end of day (midnight)
+    :param str method: how to fill missing hours; one of 'nan', 'linear', 'nearest', or 'climatology' (mean of the
+        same hour of day over the available data); interpolation at the edges of the range uses the nearest valid hour
+    :param list(str) variables: columns to fill; defaults to every column other than the time and county columns
+    :param list(int) precisions: optional precisions to round the filled values to, corresponding to the variables
+    :param str time_key: column name of the county data representing the time
+    :param str county_fips_key: column name of the county data representing the county FIPS code
+    :param str output_file: optional path to write the filled data to as Parquet
+    :param str report_file: optional path to write the gap report to as CSV
+    :param str encoding: how to store the variables of the output file; 'float', or 'quantized' to store them as
+        integers scaled by their precision, which requires the precisions
+    :return: the filled county data sorted by time and county, and a report of the gaps
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"Fill method '{method}' is not one of {FILL_METHODS}.")
+
+    if isinstance(county_data, str):
+        county_data = read_parquet(county_data)
+    elif not isinstance(county_data, pd.DataFrame):
+        county_data = decode_table(county_data)
+
+    start_dt, end_dt = parse_time_range(start, end)
+
+    if variables is None:
+        variables = [c for c in county_data.columns if c not in [time_key, county_fips_key]]
+
+    hour = np.timedelta64(1, 'h')
+    first = np.datetime64(start_dt, 'h')
+    n_hours = int((np.datetime64(end_dt, 'h') - first) // hour) + 1
+    expected = pd.DatetimeIndex(first + np.arange(n_hours) * hour)
+
+    # place the data into a (time, county, variable) array using integer hour offsets and county positions
+    rows = (pd.DatetimeIndex(county_data[time_key]).values.astype('datetime64[h]') - first) // hour
+    in_range = (rows >= 0) & (rows < n_hours)
+    columns, counties = pd.factorize(county_data[county_fips_key].values[in_range], sort=True)
+    data = np.full((n_hours, len(counties), len(variables)), np.nan)
+    data[rows[in_range], columns] = county_data[variables].values[in_range]
+
+    present = np.zeros(n_hours, dtype=bool)
+    present[rows[in_range]] = True
+    missing_rows = np.flatnonzero(~present)
+    present_rows = np.flatnonzero(present)
+
+    if (len(missing_rows) > 0) and (len(present_rows) > 0) and (method != 'nan'):
+
+        if method == 'climatology':
+            # mean of each county and variable per hour of day, ignoring NaN
+            hour_of_day = expected.hour.values
+            valid = ~np.isnan(data[present_rows])
+            sums = np.zeros((24,) + data.shape[1:])
+            counts = np.zeros((24,) + data.shape[1:])
+            np.add.at(sums, hour_of_day[present_rows], np.where(valid, data[present_rows], 0))
+            np.add.at(counts, hour_of_day[present_rows], valid)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data[missing_rows] = (sums / counts)[hour_of_day[missing_rows]]
+
+        else:
+            # bracketing present hours for each missing hour, clamped at the edges of the range
+            right = np.searchsorted(present_rows, missing_rows).clip(0, len(present_rows) - 1)
+            left = (right - (present_rows[right] > missing_rows)).clip(0, len(present_rows) - 1)
+            left_rows = present_rows[left]
+            right_rows = present_rows[right]
+            span = np.maximum(right_rows - left_rows, 1)
+            fraction = ((missing_rows - left_rows) / span).clip(0, 1)
+
+            if method == 'nearest':
+                data[missing_rows] = data[np.where(fraction <= 0.5, left_rows, right_rows)]
+            else:
+                fraction = fraction[:, np.newaxis, np.newaxis]
+                data[missing_rows] = data[left_rows] * (1 - fraction) + data[right_rows] * fraction
+
+    filled = pd.DataFrame(data.reshape(-1, len(variables)), columns=variables)
+    filled.insert(0, county_fips_key, np.tile(counties, n_hours))
+    filled.insert(0, time_key, np.repeat(expected, len(counties)))
+
+    if precisions is not None:
+        filled = filled.round({key: precisions[i] for i, key in enumerate(variables)})
+
+    report = summarize_gaps(expected[missing_rows])
+
+    for gap in report.itertuples():
+        print(f'Missing data: {str(gap.Gap_Start)} to {str(gap.Gap_End)} ({gap.Missing_Hours} hours).')
+
+    if output_file is not None:
+        write_parquet(filled, output_file, variables, precisions, encoding)
+
+    if report_file is not None:
+        report.to_csv(report_file, index=False)
+
+    return filled, report
+
+
+def fill_missing_hours(
+    start: str,
+    end: str,
+    output_directory: str = './County_Output_Files',
+    output_filename_suffix: str = '_County_Mean_Meteorology',
+    county_data: Union['pyarrow.Table', pd.DataFrame] = None,
+):
+    """
+    Check county output files for missing hours and create files for those hours filled with NaNs.
+
+    :param str start: first expected datetime in ISO8601 format; if just a date assumes start of day (1am)
+    :param str end: last expected datetime in ISO8601 format; if just a date assumes end of day (midnight)
+    :param str output_directory: path to which output should be written
+    :param str output_filename_suffix: string to append to the timestamp for the output file name
+    :param county_data: optional table of county data by Time_UTC and FIPS, as returned by wrf_to_tell_counties in
+        memory; if given, the missing hours are filled with NaN in memory and the filled table is returned instead of
+        writing files
+    :return: the filled table if county_data is given
+    """
+    if county_data is not None:
+        from im3components.wrf_to_tell.wrf_tell_tables import as_table
+
+        filled, _ = fill_missing_hours_in_data(county_data, start, end)
+        return as_table(filled)
+
+    start_dt, end_dt = parse_time_range(start, end)
+
     county_files = sorted(glob(f"{output_directory}/*{output_filename_suffix}.csv"))
     county_datetimes = pd.to_datetime(county_files, exact=False, format='%Y_%m_%d_%H')
-    expected_datetimes = pd.date_range(start_dt, end_dt, freq='1H')
-    missing = expected_datetimes[~expected_datetimes.isin(county_datetimes)]
+    missing = find_missing_hours(county_datetimes, start_dt, end_dt)
 
     # read the first file as a template
     data = pd.read_csv(county_files[0], dtype={'FIPS': str})
@@ -92,10 +282,56 @@ if __name__ == '__main__':
         help='string to append to the timestamp for the output file name',
         default='_County_Mean_Meteorology'
     )
-    args = parser.parse_args()
-    fill_missing_hours(
-        start=args.start,
-        end=args.end,
-        output_directory=args.output_directory,
-        output_filename_suffix=args.output_filename_suffix,
+    parser.add_argument(
+        '-i',
+        '--input-file',
+        type=str,
+        help='path to a consolidated Parquet file of county data; if given, gaps are filled in this file instead of '
+             'writing a file per missing hour',
+        default=None
+    )
+    parser.add_argument(
+        '-m',
+        '--method',
+        type=str,
+        choices=FILL_METHODS,
+        help='how to fill missing hours when using a consolidated file',
+        default='nan'
+    )
+    parser.add_argument(
+        '-p',
+        '--precisions',
+        nargs='+',
+        type=int,
+        help='list of precisions for the variables of a consolidated file, in the order of its columns',
+        default=None
     )
+    parser.add_argument(
+        '--encoding',
+        type=str,
+        choices=ENCODINGS,
+        help='how to store the variables of the filled consolidated file; quantized requires the precisions',
+        default='float'
+    )
+    args = parser.parse_args()
+    if args.input_file is not None:
+        fill_missing_hours_in_data(
+            county_data=args.input_file,
+            start=args.start,
+            end=args.end,
+            method=args.method,
+            precisions=args.precisions,
+            encoding=args.encoding,
+            output_file=os.path.join(
+                args.output_directory,
+                f'{os.path.splitext(os.path.basename(args.input_file))[0]}_filled.parquet'
+            ),
+            report_file=os.path.join(args.output_directory, f'missing_data_{args.start}_to_{args.end}.csv'),
+        )
+    else:
+        fill_missing_hours(
+            start=args.start,
+            end=args.end,
+            output_directory=args.output_directory,
+            output_filename_suffix=args.output_filename_suffix,
+        )
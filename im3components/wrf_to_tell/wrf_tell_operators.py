@@ -0,0 +1,285 @@
+import hashlib
+from os.path import isfile
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import get_balancing_authority_weights
+
+
+def county_operator(
+        mapping: pd.DataFrame,
+        n_cells: int = None,
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Build the sparse linear operator that maps WRF grid cell values to county weighted means.
+
+    :rtype: tuple(scipy.sparse.csr_matrix, numpy.ndarray)
+    :param pandas.DataFrame mapping: DataFrame containing the mapping of cell index to county FIPS code and weight
+    :param int n_cells: number of cells in the WRF grid; defaults to one more than the largest mapped cell index
+    :return: a (county, cell) matrix of weights and the integer county FIPS code of each row
+    """
+    counties, rows = np.unique(mapping['FIPS'].astype(int).values, return_inverse=True)
+    cells = mapping['cell_index'].values.astype(np.int64)
+    if n_cells is None:
+        n_cells = int(cells.max()) + 1
+    return sparse.csr_matrix(
+        (mapping['weight'].values.astype(np.float64), (rows, cells)),
+        shape=(len(counties), n_cells),
+    ), counties
+
+
+def zero_missing(values: np.ndarray) -> np.ndarray:
+    """
+    Replace NaN with zero, so a missing cell adds nothing to a weighted mean, as the groupby sum of
+    compute_county_weighted_mean skips it, rather than making the whole mean NaN.  Values without NaN are returned as
+    they are, without a copy.
+
+    :rtype: numpy.ndarray
+    :param numpy.ndarray values: array of WRF values
+    :return: the values with NaN replaced by zero
+    """
+    missing = np.isnan(values)
+    return np.where(missing, 0., values) if missing.any() else values
+
+
+def apply_county_operator(
+        operator: sparse.csr_matrix,
+        values: np.ndarray,
+) -> np.ndarray:
+    """
+    Apply a (county, cell) operator to a block of WRF values in one sparse product, whatever the leading dimensions
+    of the block, such as (member, time, variable, cell).  Missing (NaN) cells are skipped, see zero_missing.
+
+    :rtype: numpy.ndarray
+    :param scipy.sparse.csr_matrix operator: the (county, cell) matrix of weights, as built by county_operator
+    :param numpy.ndarray values: array of values with the cells along the last axis
+    :return: array of the county weighted means, with the counties along the last axis in place of the cells
+    """
+    block = zero_missing(values.reshape(-1, values.shape[-1]))
+    return np.asarray(operator @ block.T).T.reshape(values.shape[:-1] + (operator.shape[0],))
+
+
+def balancing_authority_operator(
+        ba_mapping_df: pd.DataFrame,
+        counties: np.ndarray,
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Build the sparse linear operator that maps county values to balancing authority population weighted means.
+
+    :rtype: tuple(scipy.sparse.csr_matrix, numpy.ndarray)
+    :param pandas.DataFrame ba_mapping_df: the balancing authority to county mapping with population fractions
+    :param numpy.ndarray counties: the integer county FIPS code of each column, in order
+    :return: a (balancing authority, county) matrix of population fractions and the BA_Number of each row
+    """
+    # only counties that are present in the county operator contribute, matching an inner merge
+    ba_mapping_df = ba_mapping_df[ba_mapping_df['County_FIPS'].isin(counties)]
+    ba_numbers, rows = np.unique(ba_mapping_df['BA_Number'].values, return_inverse=True)
+    columns = np.searchsorted(counties, ba_mapping_df['County_FIPS'].values)
+    return sparse.csr_matrix(
+        (ba_mapping_df['Population_Fraction'].values.astype(np.float64), (rows, columns)),
+        shape=(len(ba_numbers), len(counties)),
+    ), ba_numbers
+
+
+def save_operator(
+        operator_file: str,
+        county_matrix: sparse.csr_matrix,
+        counties: np.ndarray,
+        composite_matrix: sparse.csr_matrix,
+        ba_county_matrix: sparse.csr_matrix,
+        ba_numbers: np.ndarray,
+        key: str = '',
+) -> None:
+    """
+    Write the county and composite balancing authority operators to a compressed NumPy file.
+
+    :param str operator_file: path to which to write the operators (.npz)
+    :param scipy.sparse.csr_matrix county_matrix: the (county, cell) operator
+    :param numpy.ndarray counties: the integer county FIPS code of each county row
+    :param scipy.sparse.csr_matrix composite_matrix: the (balancing authority, cell) operator
+    :param scipy.sparse.csr_matrix ba_county_matrix: the (balancing authority, county) operator
+    :param numpy.ndarray ba_numbers: the BA_Number of each balancing authority row
+    :param str key: key of the year and inputs the operators were built from, as returned by operator_key
+    """
+    arrays = {'counties': counties, 'ba_numbers': ba_numbers, 'key': np.array(key)}
+    for key, matrix in (('county', county_matrix), ('composite', composite_matrix), ('ba_county', ba_county_matrix)):
+        arrays[f'{key}_data'] = matrix.data
+        arrays[f'{key}_indices'] = matrix.indices
+        arrays[f'{key}_indptr'] = matrix.indptr
+        arrays[f'{key}_shape'] = np.asarray(matrix.shape)
+    np.savez_compressed(operator_file, **arrays)
+
+
+def load_operator(operator_file: str) -> dict:
+    """
+    Read the operators written by save_operator.
+
+    :rtype: dict
+    :param str operator_file: path to the operators file (.npz)
+    :return: dictionary with the county, composite, and ba_county matrices, the counties and ba_numbers labels, and the
+        key of the inputs, which is None for files written without one
+    """
+    with np.load(operator_file) as npz:
+        operators = {
+            'counties': npz['counties'],
+            'ba_numbers': npz['ba_numbers'],
+            'key': str(npz['key']) if 'key' in npz.files else None,
+        }
+        for key in ['county', 'composite', 'ba_county']:
+            operators[key] = sparse.csr_matrix(
+                (npz[f'{key}_data'], npz[f'{key}_indices'], npz[f'{key}_indptr']),
+                shape=tuple(npz[f'{key}_shape']),
+            )
+    return operators
+
+
+def operator_key(
+        year: int,
+        is_historical: bool,
+        balancing_authority_to_fips_file: str,
+        county_population_by_year_file: str,
+        mapping: pd.DataFrame,
+        n_cells: int = None,
+) -> str:
+    """
+    Key of the year and inputs a composite operator is built from, which changes when any of them change.
+
+    :rtype: str
+    :param int year: year of population to weight by
+    :param bool is_historical: true if working with historical data as opposed to future/SSP data
+    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
+    :param str county_population_by_year_file: path to the CSV file containing the county populations by year
+    :param pandas.DataFrame mapping: DataFrame containing the mapping of cell index to county FIPS code and weight
+    :param int n_cells: number of cells in the WRF grid
+    :return: the key
+    """
+    from im3components.workers import file_key
+
+    mapping_hash = hashlib.sha256(
+        pd.util.hash_pandas_object(mapping[['cell_index', 'FIPS', 'weight']], index=False).values.tobytes()
+    ).hexdigest()
+
+    return file_key(
+        f'composite_operator:{year}:{bool(is_historical)}:{n_cells}:{mapping_hash}',
+        balancing_authority_to_fips_file,
+        county_population_by_year_file,
+    )
+
+
+def get_composite_operator(
+        year: int,
+        is_historical: bool,
+        balancing_authority_to_fips_file: str,
+        county_population_by_year_file: str,
+        mapping: pd.DataFrame,
+        n_cells: int = None,
+        operator_file: str = None,
+        population_cache_directory: str = None,
+) -> dict:
+    """
+    Compose the WRF cell to county operator with the county to balancing authority operator for a given year,
+    reading it from or writing it to a cache file if one is given.
+
+    :rtype: dict
+    :param int year: year of population to weight by
+    :param bool is_historical: true if working with historical data as opposed to future/SSP data
+    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
+    :param str county_population_by_year_file: path to the CSV file containing the county populations by year
+    :param pandas.DataFrame mapping: DataFrame containing the mapping of cell index to county FIPS code and weight
+    :param int n_cells: number of cells in the WRF grid
+    :param str operator_file: optional path to read or write the operators (.npz); an existing file built from another
+        year or other inputs is rebuilt and overwritten
+    :param str population_cache_directory: directory in which to cache population tables; defaults to the package cache
+    :return: dictionary with the county, composite, and ba_county matrices and the counties and ba_numbers labels
+    """
+    key = operator_key(
+        year, is_historical, balancing_authority_to_fips_file, county_population_by_year_file, mapping, n_cells)
+
+    if (operator_file is not None) and isfile(operator_file):
+        operators = load_operator(operator_file)
+        if operators['key'] == key:
+            return operators
+
+    county_matrix, counties = county_operator(mapping, n_cells)
+    ba_county_matrix, ba_numbers = balancing_authority_operator(
+        get_balancing_authority_weights(
+            year,
+            is_historical,
+            balancing_authority_to_fips_file,
+            county_population_by_year_file,
+            population_cache_directory,
+        ),
+        counties,
+    )
+    composite_matrix = (ba_county_matrix @ county_matrix).tocsr()
+
+    if operator_file is not None:
+        save_operator(operator_file, county_matrix, counties, composite_matrix, ba_county_matrix, ba_numbers, key)
+
+    return {
+        'key': key,
+        'county': county_matrix,
+        'counties': counties,
+        'composite': composite_matrix,
+        'ba_county': ba_county_matrix,
+        'ba_numbers': ba_numbers,
+    }
+
+
+def apply_composite_operator(
+        wrf,
+        operators: dict,
+        variables: List[str],
+        precisions: List[int],
+) -> Tuple[pd.DataFrame, List[str], List[int]]:
+    """
+    Aggregate a chunk of WRF output data directly to balancing authority population weighted means.
+
+    Linear variables go through the composite operator in a single sparse product. Wind speed is not linear in U10
+    and V10, so when both are present they are first taken to county level to compute WSPD, as the county step does.
+    Unlike the two step process, county means are not rounded before weighting by population.
+
+    :rtype: tuple(pandas.DataFrame, list(str), list(int))
+    :param xarray.Dataset wrf: WRF output dataset opened with salem, holding the time slices to aggregate
+    :param dict operators: operators as returned by get_composite_operator
+    :param list(str) variables: list of the variables to aggregate
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :return: DataFrame of the weighted means by BA_Number and Time_UTC, and the aggregated variables and precisions
+    """
+    times = wrf.time.values
+    n_times = len(times)
+    has_wind = ('U10' in variables) and ('V10' in variables)
+
+    def cells(variable):
+        # (cell, time) array with cells ordered to match the cell index of the mapping
+        return zero_missing(wrf[variable].transpose('time', 'south_north', 'west_east').values.reshape(n_times, -1).T)
+
+    output_variables, output_precisions, columns = [], [], []
+    for variable, precision in zip(variables, precisions):
+        if has_wind and variable in ['U10', 'V10']:
+            continue
+        output_variables.append(variable)
+        output_precisions.append(precision)
+        columns.append(operators['composite'] @ cells(variable))
+
+    if has_wind:
+        county_u = operators['county'] @ cells('U10')
+        county_v = operators['county'] @ cells('V10')
+        output_variables.append('WSPD')
+        output_precisions.append(precisions[variables.index('U10')])
+        columns.append(operators['ba_county'] @ np.sqrt(np.square(county_u) + np.square(county_v)))
+
+    ba_numbers = operators['ba_numbers']
+    means = pd.DataFrame({
+        'BA_Number': np.repeat(ba_numbers, n_times),
+        'Time_UTC': np.tile(times, len(ba_numbers)),
+    })
+    for variable, values in zip(output_variables, columns):
+        means[variable] = np.asarray(values).reshape(-1)
+
+    return means.round({
+        key: output_precisions[i] for i, key in enumerate(output_variables)
+    }), output_variables, output_precisions
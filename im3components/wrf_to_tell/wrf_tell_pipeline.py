@@ -0,0 +1,380 @@
+import argparse
+from concurrent.futures import Executor
+from contextlib import nullcontext
+import datetime
+import distutils.util
+from os.path import isfile
+from typing import List
+
+import pandas as pd
+
+from im3components.wrf_to_tell.wrf_tell_balancing_authorities import (
+    add_wind_speed,
+    compute_balancing_authority_weighted_mean,
+    get_balancing_authority_weights,
+    write_balancing_authority_files,
+)
+from im3components.wrf_to_tell.wrf_tell_counties import (
+    aggregate_chunk_slice,
+    get_weight_mapping,
+    open_wrf_dataset,
+    time_chunk_values,
+)
+from im3components.wrf_to_tell.wrf_tell_encoding import ENCODINGS, quantized_encoding, quantized_table
+from im3components.wrf_to_tell.wrf_tell_fill_missing_hours import fill_missing_hours_in_data
+from im3components.wrf_to_tell.wrf_tell_operators import (
+    apply_composite_operator,
+    county_operator,
+    get_composite_operator,
+)
+
+
+def wrf_to_tell_pipeline(
+        wrf_files: List[str],
+        year: int,
+        is_historical: bool,
+        balancing_authority_to_fips_file: str,
+        county_population_by_year_file: str,
+        output_directory: str,
+        county_shapefile: str = './Geolocation/tl_2020_us_county/tl_2020_us_county.shp',
+        weight_and_mapping_file: str = './grid_cell_to_county_weight.parquet',
+        county_output_file: str = None,
+        county_output_encoding: str = 'float',
+        output_file_infix: str = 'WRF_Hourly_Mean_Meteorology',
+        variables: List[str] = None,
+        precisions: List[int] = None,
+        fill_method: str = 'nan',
+        time_chunk_size: int = 24,
+        n_jobs: int = -1,
+        skip_county_stage: bool = False,
+        operator_file: str = None,
+        population_cache_directory: str = None,
+        executor: Executor = None,
+        weight_engine: str = 'overlay',
+        supersample_factor: int = 10,
+) -> pd.DataFrame:
+    """
+    Aggregate WRF output data to county and then balancing authority level in memory, writing only the final
+    balancing authority files and, optionally, the county level data as a single Parquet file.
+
+    :rtype: pandas.DataFrame
+    :param list(str) wrf_files: paths to the WRF output files covering the year, in any order
+    :param int year: year of data to aggregate to balancing authority level; other times are ignored
+    :param bool is_historical: true if working with historical data as opposed to future/SSP data
+    :param str balancing_authority_to_fips_file: path to the CSV file mapping county FIPS code to balancing authority
+    :param str county_population_by_year_file: path to the CSV file containing the county populations by year
+    :param str output_directory: path to the directory to write the balancing authority files
+    :param str county_shapefile: path to a shapefile (.shp) with county geometries
+    :param str weight_and_mapping_file: path to read or write a weights file which maps WRF grid cell to county weight
+    :param str county_output_file: optional path to write the county level data to as Parquet
+    :param str county_output_encoding: how to store the variables of the county output file; 'float', or 'quantized'
+        to store them as int32 scaled by their precision, which read_parquet of wrf_tell_encoding decodes
+    :param str output_file_infix: string to insert in the middle of the output file, between BA and year
+    :param list(str) variables: list of the variables to aggregate
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str fill_method: how to fill missing hours; one of 'nan', 'linear', 'nearest', or 'climatology'
+    :param int time_chunk_size: number of time slices to hold in memory and process in parallel at once
+    :param int n_jobs: number of time slices to process in parallel
+    :param bool skip_county_stage: if true, aggregate WRF cells directly to balancing authorities with a single
+        composite sparse operator per time chunk; the county level data is not available in this mode
+    :param str operator_file: optional path to read or write the composite operator (.npz) for this year and inputs
+    :param str population_cache_directory: directory in which to cache population tables; defaults to the package cache
+    :param concurrent.futures.Executor executor: optional executor, such as a shared WorkerPool, to process the time
+        slices on instead of a new joblib pool; n_jobs is then ignored
+    :param str weight_engine: how to create a missing weights file; 'overlay' to intersect the polygons exactly, or
+        'supersample' to rasterize the counties onto a supersampled grid, which is much faster for fine grids; an
+        existing weights file created with another engine or supersample factor is rejected
+    :param int supersample_factor: number of sub-cells along each axis of a grid cell for the 'supersample' engine
+    :return: DataFrame of the balancing authority weighted means by BA_Number and Time_UTC
+    """
+    from joblib import Parallel, delayed
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from im3components.workers import file_key, map_tasks, release, share
+
+    begin_time = datetime.datetime.now()
+
+    if variables is None:
+        variables = ['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW']
+
+    if precisions is None:
+        precisions = [2, 5, 2, 2, 2, 2]
+
+    if skip_county_stage and (county_output_file is not None):
+        raise ValueError('The county level data cannot be written when skipping the county stage.')
+
+    if county_output_encoding not in ENCODINGS:
+        raise ValueError(f"Encoding '{county_output_encoding}' is not one of {ENCODINGS}.")
+
+    # the encoding of the county output file is fixed up front, since it is written in chunks with one schema
+    county_encodings = None
+    if county_output_encoding == 'quantized':
+        county_encodings = {v: quantized_encoding(p) for v, p in zip(variables, precisions)}
+
+    for wrf_file in wrf_files:
+        if not isfile(wrf_file):
+            raise FileNotFoundError(f'WRF file does not exist: {wrf_file}')
+
+    ba_mapping_df = get_balancing_authority_weights(
+        year,
+        is_historical,
+        balancing_authority_to_fips_file,
+        county_population_by_year_file,
+        population_cache_directory,
+    )
+
+    mapping = None
+    operator, counties = None, None
+    operators = None
+    county_writer = None
+    ba_chunks = []
+    ba_variables, ba_precisions = variables, precisions
+
+    with (Parallel(n_jobs=n_jobs) if executor is None else nullcontext()) as parallel:
+
+        for wrf_file in sorted(wrf_files):
+
+            wrf = open_wrf_dataset(wrf_file)
+
+            # the mapping is shared by every file on the same domain
+            if mapping is None:
+                mapping = get_weight_mapping(wrf, variables, county_shapefile, weight_and_mapping_file,
+                                             weight_engine, supersample_factor)
+
+            if (not skip_county_stage) and (operator is None):
+                operator, counties = county_operator(mapping, wrf.south_north.shape[0] * wrf.west_east.shape[0])
+                if executor is not None:
+                    key = file_key('county_operator', weight_and_mapping_file)
+                    operator = share(executor, operator, key=key)
+                    counties = share(executor, counties, key=f'{key}:counties')
+
+            if skip_county_stage and (operators is None):
+                operators = get_composite_operator(
+                    year,
+                    is_historical,
+                    balancing_authority_to_fips_file,
+                    county_population_by_year_file,
+                    mapping,
+                    n_cells=wrf.south_north.shape[0] * wrf.west_east.shape[0],
+                    operator_file=operator_file,
+                    population_cache_directory=population_cache_directory,
+                )
+
+            for chunk_start in range(0, wrf.time.shape[0], time_chunk_size):
+
+                chunk = wrf[variables].isel(time=slice(chunk_start, chunk_start + time_chunk_size)).load()
+
+                if skip_county_stage:
+                    means, ba_variables, ba_precisions = apply_composite_operator(
+                        chunk, operators, variables, precisions)
+                    ba_chunks.append(means)
+                    continue
+
+                times, values = time_chunk_values(chunk, variables, 0, chunk.time.shape[0])
+                tasks = [
+                    dict(
+                        index=i,
+                        time=t,
+                        operator=operator,
+                        counties=counties,
+                        wrf_variables=variables,
+                        precisions=precisions,
+                    ) for i, t in enumerate(times)
+                ]
+                if executor is None:
+                    county_slices = parallel(delayed(aggregate_chunk_slice)(values=values, **task) for task in tasks)
+                else:
+                    shared_values = share(executor, values, transient=True)
+                    county_slices = map_tasks(
+                        executor, aggregate_chunk_slice, (dict(values=shared_values, **task) for task in tasks))
+                    release(executor, shared_values)
+                county_data = pd.concat(county_slices, ignore_index=True)
+
+                # optionally persist the county level data as it streams through
+                if county_output_file is not None:
+                    if county_encodings is None:
+                        county_table = pa.Table.from_pandas(county_data, preserve_index=False)
+                    else:
+                        county_table = quantized_table(county_data, variables, precisions, county_encodings)
+                    if county_writer is None:
+                        county_writer = pq.ParquetWriter(county_output_file, county_table.schema)
+                    county_writer.write_table(county_table)
+
+                county_data = county_data.rename(columns={'FIPS': 'County_FIPS'})
+                ba_variables, ba_precisions = add_wind_speed(county_data, variables, precisions)
+                ba_chunks.append(
+                    compute_balancing_authority_weighted_mean(county_data, ba_mapping_df, ba_variables, ba_precisions)
+                )
+
+            wrf.close()
+
+    if county_writer is not None:
+        county_writer.close()
+
+    # fill any missing hours of the year at the balancing authority level
+    means, _ = fill_missing_hours_in_data(
+        pd.concat(ba_chunks, ignore_index=True),
+        start=f'{year}-01-01',
+        end=f'{year}-12-31',
+        method=fill_method,
+        variables=ba_variables,
+        precisions=ba_precisions,
+        county_fips_key='BA_Number',
+        report_file=f'{output_directory}/missing_data_{year}.csv',
+    )
+
+    write_balancing_authority_files(means, ba_mapping_df, year, ba_variables, output_directory, output_file_infix)
+
+    print('Elapsed time = ', datetime.datetime.now() - begin_time)
+
+    return means
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Aggregate WRF output files for a year to county and balancing authority level in memory.'
+    )
+    parser.add_argument(
+        'files',
+        metavar='/path/to/WRF/output/file',
+        nargs='+',
+        type=str,
+        help='paths to the WRF output files covering the year',
+    )
+    parser.add_argument(
+        '-y',
+        '--year',
+        type=int,
+        help='year to process data for',
+        required=True,
+    )
+    parser.add_argument(
+        '--is-historical',
+        type=distutils.util.strtobool,
+        help='true if processing historical data as opposed to future/SSP data',
+        required=True,
+    )
+    parser.add_argument(
+        '-v',
+        '--variables',
+        nargs='+',
+        type=str,
+        default=['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW'],
+        help='list of variables to aggregate',
+    )
+    parser.add_argument(
+        '-p',
+        '--precisions',
+        nargs='+',
+        type=int,
+        default=[2, 5, 2, 2, 2, 2],
+        help='list of precisions for the variables to aggregate',
+    )
+    parser.add_argument(
+        '-s',
+        '--shapefile-path',
+        type=str,
+        help='path to a shapefile (.shp) with county geometries',
+        required=True,
+    )
+    parser.add_argument(
+        '-w',
+        '--weights-file-path',
+        type=str,
+        help='path to the weights file mapping grid cell to county and weight; will be created if it does not exist',
+        required=True,
+    )
+    parser.add_argument(
+        '-b',
+        '--balancing-authority-to-county',
+        type=str,
+        help='path to .csv file that maps balancing authority to county FIPS',
+        required=True,
+    )
+    parser.add_argument(
+        '-c',
+        '--county-population-by-year',
+        type=str,
+        help='path to .csv file containing county FIPS population per year',
+        required=True,
+    )
+    parser.add_argument(
+        '-o',
+        '--output-directory',
+        type=str,
+        help='path to which output should be written',
+        required=True,
+    )
+    parser.add_argument(
+        '--county-output-file',
+        type=str,
+        help='optional path to a Parquet file to which to write the county level data',
+        default=None
+    )
+    parser.add_argument(
+        '--county-output-encoding',
+        type=str,
+        choices=ENCODINGS,
+        help='how to store the variables of the county output file: as floats, or as integers scaled by precision',
+        default='float'
+    )
+    parser.add_argument(
+        '--output-file-infix',
+        type=str,
+        help='string to insert into the output file name',
+        default='WRF_Hourly_Mean_Meteorology'
+    )
+    parser.add_argument(
+        '-m',
+        '--fill-method',
+        type=str,
+        choices=['nan', 'linear', 'nearest', 'climatology'],
+        help='how to fill missing hours',
+        default='nan'
+    )
+    parser.add_argument(
+        '--time-chunk-size',
+        type=int,
+        help='number of time slices to hold in memory at once',
+        default=24
+    )
+    parser.add_argument(
+        '-n',
+        '--number-of-tasks',
+        type=int,
+        help='number of time slices to process in parallel',
+        default=-1
+    )
+    parser.add_argument(
+        '--skip-county-stage',
+        action='store_true',
+        help='aggregate WRF cells directly to balancing authorities with a composite operator',
+    )
+    parser.add_argument(
+        '--operator-file',
+        type=str,
+        help='optional path to a .npz file in which to cache the composite operator for this year',
+        default=None
+    )
+    args = parser.parse_args()
+    wrf_to_tell_pipeline(
+        wrf_files=args.files,
+        year=args.year,
+        is_historical=args.is_historical,
+        balancing_authority_to_fips_file=args.balancing_authority_to_county,
+        county_population_by_year_file=args.county_population_by_year,
+        output_directory=args.output_directory,
+        county_shapefile=args.shapefile_path,
+        weight_and_mapping_file=args.weights_file_path,
+        county_output_file=args.county_output_file,
+        county_output_encoding=args.county_output_encoding,
+        output_file_infix=args.output_file_infix,
+        variables=args.variables,
+        precisions=args.precisions,
+        fill_method=args.fill_method,
+        time_chunk_size=args.time_chunk_size,
+        n_jobs=args.number_of_tasks,
+        skip_county_stage=args.skip_county_stage,
+        operator_file=args.operator_file,
+    )
@@ -0,0 +1,255 @@
+from os.path import isfile, join
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# pandas period frequency of each rollup
+FREQUENCIES = {
+    'daily': 'D',
+    'monthly': 'M',
+}
+
+# statistics kept for each period, variable, and id
+MOMENTS = ['count', 'mean', 'm2', 'min', 'max']
+
+
+def compute_moments(values: np.ndarray) -> dict:
+    """
+    Compute the count, mean, sum of squared deviations from the mean, minimum, and maximum of a block of values along
+    its first axis, ignoring NaN.  Means of empty cells are 0 rather than NaN, so they merge cleanly.
+
+    :rtype: dict
+    :param numpy.ndarray values: (time, variable, id) array of values
+    :return: dictionary of (variable, id) arrays of each of MOMENTS
+    """
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    mean = np.where(valid, values, 0.).sum(axis=0) / np.maximum(count, 1)
+    return {
+        'count': count,
+        'mean': mean,
+        'm2': np.where(valid, np.square(values - mean), 0.).sum(axis=0),
+        'min': np.fmin.reduce(values, axis=0),
+        'max': np.fmax.reduce(values, axis=0),
+    }
+
+
+def merge_moments(a: dict, b: dict) -> dict:
+    """
+    Merge the moments of two blocks of values, as if they had been computed over both at once, using the pairwise
+    update of the mean and variance of Chan et al.
+
+    :rtype: dict
+    :param dict a: moments of the first block, as returned by compute_moments
+    :param dict b: moments of the second block
+    :return: the merged moments
+    """
+    count = a['count'] + b['count']
+    n = np.maximum(count, 1)
+    delta = b['mean'] - a['mean']
+    return {
+        'count': count,
+        'mean': a['mean'] + delta * b['count'] / n,
+        'm2': a['m2'] + b['m2'] + np.square(delta) * a['count'] * b['count'] / n,
+        'min': np.fmin(a['min'], b['min']),
+        'max': np.fmax(a['max'], b['max']),
+    }
+
+
+class RollupAccumulator:
+    """
+    Accumulate daily and monthly statistics of hourly means as chunks of hours stream through, so the statistics
+    need no second pass over the hourly data.  Each hour is only counted once, however many times it is passed, so
+    the statistics of a period can be built up over several calls, e.g. one per WRF file, by saving and loading the
+    accumulator in between.
+
+    :param numpy.ndarray ids: the id of each county or balancing authority, along the last axis of the values
+    :param list(str) variables: names of the variables, in the order of the second axis of the values
+    :param list(str) frequencies: rollups to accumulate, from FREQUENCIES
+    """
+
+    def __init__(self, ids: np.ndarray, variables: List[str], frequencies: List[str] = ('daily', 'monthly')):
+        unknown = set(frequencies) - set(FREQUENCIES)
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown rollup frequencies {sorted(unknown)}; expected any of {list(FREQUENCIES)}.')
+
+        self.ids = np.asarray(ids)
+        self.variables = list(variables)
+        self.frequencies = list(frequencies)
+        self.times = set()
+        self.periods = {frequency: {} for frequency in self.frequencies}
+        self.hours = {frequency: {} for frequency in self.frequencies}
+
+    def update(self, times: np.ndarray, values: np.ndarray) -> None:
+        """
+        Add a chunk of hourly means to the statistics; hours already added are skipped.
+
+        :param numpy.ndarray times: the time of each hour
+        :param numpy.ndarray values: (time, variable, id) array of the hourly means
+        """
+        times = pd.DatetimeIndex(times)
+        new = np.array([t not in self.times for t in times.asi8], dtype=bool)
+        if not new.any():
+            return
+
+        times, values = times[new], np.asarray(values, dtype=np.float64)[new]
+        self.times.update(times.asi8.tolist())
+
+        for frequency in self.frequencies:
+            periods = times.to_period(FREQUENCIES[frequency]).to_timestamp()
+            for period in periods.unique():
+                in_period = np.asarray(periods == period)
+                moments = compute_moments(values[in_period])
+                if period in self.periods[frequency]:
+                    moments = merge_moments(self.periods[frequency][period], moments)
+                self.periods[frequency][period] = moments
+                self.hours[frequency][period] = self.hours[frequency].get(period, 0) + int(in_period.sum())
+
+    def to_frame(self, frequency: str, id_column: str, precisions: List[int] = None) -> pd.DataFrame:
+        """
+        Tabulate the statistics of a rollup:  the mean, minimum, maximum, and population standard deviation of each
+        variable per period and id, along with the number of hours in the period.
+
+        :rtype: pandas.DataFrame
+        :param str frequency: the rollup to tabulate
+        :param str id_column: name of the id column, e.g. 'FIPS' or 'BA_Number'
+        :param list(int) precisions: optional precisions corresponding to the variables to round the statistics to
+        :return: DataFrame by Time_UTC, the start of each period, and id
+        """
+        periods = sorted(self.periods[frequency])
+        frames = []
+        for period in periods:
+            moments = self.periods[frequency][period]
+            empty = moments['count'] == 0
+            frame = pd.DataFrame({
+                'Time_UTC': period,
+                id_column: self.ids,
+                'Hours': self.hours[frequency][period],
+            })
+            statistics = {
+                'Mean': np.where(empty, np.nan, moments['mean']),
+                'Min': moments['min'],
+                'Max': moments['max'],
+                'Std': np.where(empty, np.nan, np.sqrt(moments['m2'] / np.maximum(moments['count'], 1))),
+            }
+            for i, variable in enumerate(self.variables):
+                for name, values in statistics.items():
+                    frame[f'{variable}_{name}'] = values[i]
+            frames.append(frame)
+
+        columns = ['Time_UTC', id_column, 'Hours'] + [
+            f'{variable}_{name}' for variable in self.variables for name in ['Mean', 'Min', 'Max', 'Std']]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.concat(frames, ignore_index=True)[columns]
+        if precisions is not None:
+            df = df.round({
+                f'{variable}_{name}': precisions[i]
+                for i, variable in enumerate(self.variables) for name in ['Mean', 'Min', 'Max', 'Std']
+            })
+        return df
+
+    def write(self, output_directory: str, name: str, id_column: str, precisions: List[int] = None) -> List[str]:
+        """
+        Write each rollup to a CSV file named after its frequency, e.g. daily_County_Mean_Meteorology.csv.
+
+        :rtype: list(str)
+        :param str output_directory: path to the directory to write the rollup files
+        :param str name: name of the rollup files, after the frequency
+        :param str id_column: name of the id column, e.g. 'FIPS' or 'BA_Number'
+        :param list(int) precisions: optional precisions corresponding to the variables to round the statistics to
+        :return: the paths of the files written
+        """
+        files = []
+        for frequency in self.frequencies:
+            files.append(join(output_directory, f'{frequency}_{name}.csv'))
+            self.to_frame(frequency, id_column, precisions).to_csv(files[-1], index=False)
+        return files
+
+    def save(self, state_file: str) -> None:
+        """
+        Write the accumulated statistics to a compressed NumPy file, to be loaded and added to later.
+
+        :param str state_file: path to which to write the statistics (.npz)
+        """
+        arrays = {
+            'ids': self.ids,
+            'variables': np.array(self.variables),
+            'frequencies': np.array(self.frequencies),
+            'times': np.array(sorted(self.times), dtype=np.int64),
+        }
+        for frequency in self.frequencies:
+            periods = sorted(self.periods[frequency])
+            arrays[f'{frequency}_periods'] = pd.DatetimeIndex(periods).asi8
+            arrays[f'{frequency}_hours'] = np.array([self.hours[frequency][p] for p in periods], dtype=np.int64)
+            for moment in MOMENTS:
+                arrays[f'{frequency}_{moment}'] = np.array([self.periods[frequency][p][moment] for p in periods])
+        np.savez_compressed(state_file, **arrays)
+
+    @classmethod
+    def load(cls, state_file: str) -> 'RollupAccumulator':
+        """
+        Read the statistics written by save.
+
+        :rtype: RollupAccumulator
+        :param str state_file: path to the statistics file (.npz)
+        :return: the accumulator
+        """
+        with np.load(state_file) as npz:
+            accumulator = cls(npz['ids'], npz['variables'].tolist(), npz['frequencies'].tolist())
+            accumulator.times = set(npz['times'].tolist())
+            for frequency in accumulator.frequencies:
+                periods = pd.DatetimeIndex(npz[f'{frequency}_periods'])
+                for i, period in enumerate(periods):
+                    accumulator.periods[frequency][period] = {m: npz[f'{frequency}_{m}'][i] for m in MOMENTS}
+                    accumulator.hours[frequency][period] = int(npz[f'{frequency}_hours'][i])
+        return accumulator
+
+
+def pivot_means(
+        means: pd.DataFrame,
+        id_column: str,
+        variables: List[str],
+) -> tuple:
+    """
+    Arrange a long DataFrame of hourly means by Time_UTC and id as the (time, variable, id) array of the accumulator.
+
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    :param pandas.DataFrame means: DataFrame of the hourly means with Time_UTC, id, and variable columns
+    :param str id_column: name of the id column, e.g. 'FIPS' or 'BA_Number'
+    :param list(str) variables: names of the variables
+    :return: the sorted times, the sorted ids, and the (time, variable, id) array of means
+    """
+    table = means.pivot(index='Time_UTC', columns=id_column, values=variables).sort_index()
+    ids = np.sort(means[id_column].unique())
+    values = np.stack([table[variable].reindex(columns=ids).values for variable in variables], axis=1)
+    return table.index.values, ids, values
+
+
+def load_rollups(
+        state_file: str,
+        ids: np.ndarray,
+        variables: List[str],
+        frequencies: List[str],
+) -> RollupAccumulator:
+    """
+    Load the accumulated statistics from a state file, or start new ones if it does not exist.
+
+    :rtype: RollupAccumulator
+    :param str state_file: path to the statistics file (.npz)
+    :param numpy.ndarray ids: the id of each county or balancing authority
+    :param list(str) variables: names of the variables
+    :param list(str) frequencies: rollups to accumulate, from FREQUENCIES
+    :return: the accumulator
+    """
+    if not isfile(state_file):
+        return RollupAccumulator(ids, variables, frequencies)
+
+    accumulator = RollupAccumulator.load(state_file)
+    if (not np.array_equal(accumulator.ids, np.asarray(ids))) or (accumulator.variables != list(variables)) or (
+            accumulator.frequencies != list(frequencies)):
+        raise ValueError(f'The rollups in {state_file} are for other ids, variables, or frequencies; '
+                         'remove the file to start new rollups.')
+    return accumulator
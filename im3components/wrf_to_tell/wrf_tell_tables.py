@@ -0,0 +1,88 @@
+import glob
+import os
+from typing import List, Union
+
+import pandas as pd
+
+from im3components.wrf_to_tell.wrf_tell_encoding import decode_table
+
+
+def as_table(df: pd.DataFrame) -> 'pyarrow.Table':
+    """
+    Convert a DataFrame to an Arrow table without its index.  Numeric columns are handed over without copying.
+
+    :rtype: pyarrow.Table
+    :param pandas.DataFrame df: DataFrame to convert
+    :return: the table
+    """
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def as_frame(data: Union['pyarrow.Table', pd.DataFrame]) -> pd.DataFrame:
+    """
+    Convert a table returned by an in memory component, or read from a Parquet file, to a DataFrame, decoding any
+    quantized variables.  DataFrames are returned as they are.
+
+    :rtype: pandas.DataFrame
+    :param data: Arrow table or DataFrame
+    :return: the DataFrame
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    return decode_table(data)
+
+
+def write_county_files(
+        county_data: Union['pyarrow.Table', pd.DataFrame],
+        output_directory: str,
+        filename_suffix: str = '_County_Mean_Meteorology',
+        time_key: str = 'Time_UTC',
+) -> List[str]:
+    """
+    Write a table of county data with a time column to a CSV file per time slice, as written by wrf_to_tell_counties.
+
+    :rtype: list(str)
+    :param county_data: Arrow table or DataFrame with a time column, a FIPS column, and variables
+    :param str output_directory: path to the directory to write the files
+    :param str filename_suffix: string to append to the timestamp for the output file name
+    :param str time_key: column name of the county data representing the time
+    :return: the paths of the files written
+    """
+    from im3components.wrf_to_tell.wrf_tell_counties import output_file_name
+
+    files = []
+    for t, group in as_frame(county_data).groupby(time_key, sort=True):
+        files.append(output_file_name(pd.Timestamp(t), output_directory, filename_suffix))
+        group.drop(columns=time_key).to_csv(files[-1], index=False)
+    return files
+
+
+def read_county_files(
+        county_data_directory: str,
+        year: int = None,
+        county_data_prefix: str = '',
+        county_data_suffix: str = '_County_Mean_Meteorology',
+        county_data_time_format: str = '%Y_%m_%d_%H',
+) -> 'pyarrow.Table':
+    """
+    Read the CSV file per time slice written by wrf_to_tell_counties into one table with a Time_UTC column, the
+    schema of the table returned by wrf_to_tell_counties in memory.
+
+    :rtype: pyarrow.Table
+    :param str county_data_directory: path to the directory containing the mean county data
+    :param int year: optional year of the files to read
+    :param str county_data_prefix: prefix at the beginning of mean county data files, before the datetime
+    :param str county_data_suffix: suffix at the end of mean county data files, after the datetime
+    :param str county_data_time_format: format string of the datetimes in the mean county data filenames
+    :return: table of the county data by Time_UTC and FIPS
+    """
+    pattern = f'{county_data_prefix}*{"" if year is None else year}*{county_data_suffix}.csv'
+    files = sorted(glob.glob(os.path.join(county_data_directory, pattern)))
+    if len(files) == 0:
+        raise FileNotFoundError(f'No county data files match {pattern} in {county_data_directory}.')
+
+    county_data = pd.concat([pd.read_csv(f).assign(Time_UTC=os.path.basename(f)) for f in files], ignore_index=True)
+    county_data['Time_UTC'] = pd.to_datetime(county_data['Time_UTC'], exact=False, format=county_data_time_format)
+    return as_table(county_data[['Time_UTC'] + [c for c in county_data.columns if c != 'Time_UTC']])
@@ -0,0 +1,405 @@
+import argparse
+import datetime
+import distutils.util
+import gc
+import glob
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from im3components.wrf_to_tell.wrf_tell_counties import wrf_to_tell_counties
+from im3components.wrf_to_tell.wrf_tell_fill_missing_hours import find_missing_hours
+
+# name of the state file kept in the output directory by default
+STATE_FILE_NAME = '.wrf_to_tell_watch.json'
+
+
+def read_state(state_file: str) -> dict:
+    """
+    Read the state of a watch, or a new state if the state file does not exist.
+
+    :rtype: dict
+    :param str state_file: path to the JSON state file
+    :return: the size and modification time of each WRF file when it was last aggregated, by path, and the years
+        already aggregated to balancing authorities
+    """
+    if not os.path.isfile(state_file):
+        return {'files': {}, 'years': []}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+
+def write_state(state: dict, state_file: str) -> None:
+    """
+    Write the state of a watch, replacing the state file in one step so an interrupted write never corrupts it.
+
+    :param dict state: the state, as returned by read_state
+    :param str state_file: path to the JSON state file
+    """
+    temporary_file = f'{state_file}.tmp'
+    with open(temporary_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temporary_file, state_file)
+
+
+def find_wrf_files(
+        watch_directory: str = None,
+        pattern: str = 'wrfout*',
+        manifest_file: str = None,
+) -> List[str]:
+    """
+    List the WRF output files in a directory, or the files listed in a manifest, one path per line.
+
+    :rtype: list(str)
+    :param str watch_directory: path to the directory the WRF files are written to
+    :param str pattern: glob pattern of the WRF file names within the directory
+    :param str manifest_file: path to a manifest of WRF files, used instead of the directory; relative paths are
+        relative to the manifest, and lines starting with '#' are ignored
+    :return: the paths of the WRF files that exist, sorted
+    """
+    if manifest_file is not None:
+        if not os.path.isfile(manifest_file):
+            return []
+        with open(manifest_file, 'r') as f:
+            lines = [line.strip() for line in f]
+        base = os.path.dirname(os.path.abspath(manifest_file))
+        paths = [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+    else:
+        paths = glob.glob(os.path.join(watch_directory, pattern))
+
+    return sorted(os.path.abspath(p) for p in paths if os.path.isfile(p))
+
+
+def output_times(
+        output_directory: str,
+        output_filename_suffix: str = '_County_Mean_Meteorology',
+) -> pd.DatetimeIndex:
+    """
+    List the times of the county output files in a directory.
+
+    :rtype: pandas.DatetimeIndex
+    :param str output_directory: path to the directory of the county output files
+    :param str output_filename_suffix: string appended to the timestamp of the output file names
+    :return: the sorted times
+    """
+    expression = re.compile(rf'^(\d{{4}}_\d{{2}}_\d{{2}}_\d{{2}})_UTC{re.escape(output_filename_suffix)}\.csv$')
+    matches = [expression.match(name) for name in os.listdir(output_directory)]
+    return pd.DatetimeIndex(sorted(
+        pd.to_datetime([m.group(1) for m in matches if m is not None], format='%Y_%m_%d_%H')
+    ))
+
+
+def completed_years(times: pd.DatetimeIndex) -> List[int]:
+    """
+    Find the years whose county outputs are complete:  those with an output for every hour of the year.  Outputs in a
+    later year do not complete a year with missing hours, which may still be aggregated or filled.
+
+    :rtype: list(int)
+    :param pandas.DatetimeIndex times: the times of the county output files
+    :return: the completed years, sorted
+    """
+    if len(times) == 0:
+        return []
+    years = sorted(set(times.year))
+    return [
+        year for year in years
+        if len(find_missing_hours(times, datetime.datetime(year, 1, 1), datetime.datetime(year, 12, 31, 23))) == 0
+    ]
+
+
+def poll_wrf_files(
+        wrf_variables: List[str],
+        precisions: List[int],
+        output_directory: str,
+        watch_directory: str = None,
+        pattern: str = 'wrfout*',
+        manifest_file: str = None,
+        state_file: str = None,
+        settle_seconds: float = 60,
+        on_year_complete: Callable[[int], None] = None,
+        **kwargs,
+) -> Dict[str, list]:
+    """
+    Poll once for new or grown WRF files and aggregate the time slices of each whose county outputs do not exist yet.
+    A file is only aggregated once it has not been modified for settle_seconds, so a time slice being written is not
+    read.  The size and modification time of each aggregated file are kept in the state file, so unchanged files are
+    not reopened by later polls, even by a new process.
+
+    Once every known file is aggregated, on_year_complete is called for each newly completed year, see completed_years,
+    e.g. to aggregate the year to balancing authorities.
+
+    :rtype: dict
+    :param list(str) wrf_variables: list of variables to aggregate
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str output_directory: path to which county output should be written
+    :param str watch_directory: path to the directory the WRF files are written to
+    :param str pattern: glob pattern of the WRF file names within the directory
+    :param str manifest_file: path to a manifest of WRF files to poll instead of the directory
+    :param str state_file: path to the JSON state file; defaults to a hidden file in the output directory
+    :param float settle_seconds: number of seconds a file must be unmodified before it is aggregated
+    :param callable on_year_complete: optional function called with each newly completed year
+    :param kwargs: other arguments of wrf_to_tell_counties, such as county_shapefile and weight_and_mapping_file
+    :return: the WRF files aggregated, the files still being written, and the years completed by this poll
+    """
+    if state_file is None:
+        state_file = os.path.join(output_directory, STATE_FILE_NAME)
+
+    state = read_state(state_file)
+    result = {'processed': [], 'pending': [], 'years': []}
+    now = time.time()
+
+    for wrf_file in find_wrf_files(watch_directory, pattern, manifest_file):
+        stat = os.stat(wrf_file)
+        fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        if state['files'].get(wrf_file) == fingerprint:
+            continue
+
+        if now - stat.st_mtime < settle_seconds:
+            result['pending'].append(wrf_file)
+            continue
+
+        wrf_to_tell_counties(
+            wrf_file=wrf_file,
+            wrf_variables=wrf_variables,
+            precisions=precisions,
+            output_directory=output_directory,
+            skip_existing=True,
+            **kwargs,
+        )
+
+        # salem keeps the netCDF file open until its dataset is collected, which would hold a lock on a file the model
+        #   is still writing to
+        gc.collect()
+
+        # record the file as it was when it was read, so a file that grew meanwhile is polled again
+        state['files'][wrf_file] = fingerprint
+        write_state(state, state_file)
+        result['processed'].append(wrf_file)
+
+    # a year may only be complete once no earlier files are waiting to be aggregated
+    if len(result['pending']) == 0:
+        suffix = kwargs.get('output_filename_suffix', '_County_Mean_Meteorology')
+        for year in completed_years(output_times(output_directory, suffix)):
+            if year in state['years']:
+                continue
+            if on_year_complete is not None:
+                on_year_complete(year)
+            state['years'].append(year)
+            write_state(state, state_file)
+            result['years'].append(year)
+
+    return result
+
+
+def balancing_authority_trigger(
+        county_data_directory: str,
+        output_filename_suffix: str = '_County_Mean_Meteorology',
+        **kwargs,
+) -> Callable[[int], None]:
+    """
+    Create an on_year_complete function that aggregates each completed year of county outputs to balancing authorities.
+
+    :rtype: callable
+    :param str county_data_directory: path to the directory containing the county outputs
+    :param str output_filename_suffix: string appended to the timestamp of the county output file names
+    :param kwargs: other arguments of wrf_to_tell_balancing_authorities, such as is_historical and output_directory
+    :return: a function of the year
+    """
+    from im3components.wrf_to_tell.wrf_tell_balancing_authorities import wrf_to_tell_balancing_authorities
+
+    def trigger(year: int) -> None:
+        wrf_to_tell_balancing_authorities(
+            year=year,
+            county_data_directory=county_data_directory,
+            county_data_suffix=output_filename_suffix,
+            **kwargs,
+        )
+
+    return trigger
+
+
+def watch_wrf_files(
+        wrf_variables: List[str],
+        precisions: List[int],
+        output_directory: str,
+        poll_interval: float = 60,
+        max_polls: int = None,
+        **kwargs,
+) -> None:
+    """
+    Poll for new or grown WRF files every poll_interval seconds, aggregating them to county level as they land, see
+    poll_wrf_files.  Runs until interrupted, or for max_polls polls.
+
+    :param list(str) wrf_variables: list of variables to aggregate
+    :param list(int) precisions: list of precisions corresponding to the variables to aggregate
+    :param str output_directory: path to which county output should be written
+    :param float poll_interval: number of seconds between polls
+    :param int max_polls: optional number of polls after which to stop
+    :param kwargs: other arguments of poll_wrf_files and wrf_to_tell_counties
+    """
+    polls = 0
+    try:
+        while (max_polls is None) or (polls < max_polls):
+            result = poll_wrf_files(wrf_variables, precisions, output_directory, **kwargs)
+            polls += 1
+            for wrf_file in result['processed']:
+                print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Aggregated {wrf_file}')
+            for year in result['years']:
+                print(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S} Completed {year}')
+            if (max_polls is None) or (polls < max_polls):
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Watch for WRF output files and aggregate their new time slices to county level as they land, and '
+                    'optionally each completed year to balancing authority level.'
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        '-d',
+        '--watch-directory',
+        type=str,
+        help='path to the directory the WRF output files are written to',
+    )
+    source.add_argument(
+        '-m',
+        '--manifest-file',
+        type=str,
+        help='path to a manifest listing the WRF output files, one per line',
+    )
+    parser.add_argument(
+        '--pattern',
+        type=str,
+        help='glob pattern of the WRF output file names within the watched directory',
+        default='wrfout*'
+    )
+    parser.add_argument(
+        '-v',
+        '--variables',
+        nargs='+',
+        type=str,
+        default=['T2', 'Q2', 'U10', 'V10', 'SWDOWN', 'GLW'],
+        help='list of variables to aggregate',
+    )
+    parser.add_argument(
+        '-p',
+        '--precisions',
+        nargs='+',
+        type=int,
+        default=[2, 5, 2, 2, 2, 2],
+        help='list of precisions for the variables to aggregate',
+    )
+    parser.add_argument(
+        '-s',
+        '--shapefile-path',
+        type=str,
+        help='path to a shapefile (.shp) with county geometries',
+        required=True,
+    )
+    parser.add_argument(
+        '-w',
+        '--weights-file-path',
+        type=str,
+        help='path to the weights file mapping grid cell to county and weight; will be created if it does not exist',
+        required=True,
+    )
+    parser.add_argument(
+        '-o',
+        '--output-directory',
+        type=str,
+        help='path to which county output should be written',
+        required=True,
+    )
+    parser.add_argument(
+        '--state-file',
+        type=str,
+        help='path to the JSON file recording the files and years already aggregated',
+        default=None
+    )
+    parser.add_argument(
+        '-i',
+        '--poll-interval',
+        type=float,
+        help='number of seconds between polls',
+        default=60
+    )
+    parser.add_argument(
+        '--settle-seconds',
+        type=float,
+        help='number of seconds a WRF file must be unmodified before it is aggregated',
+        default=60
+    )
+    parser.add_argument(
+        '-n',
+        '--number-of-tasks',
+        type=int,
+        help='number of time slices to process in parallel',
+        default=-1
+    )
+    parser.add_argument(
+        '--ba-output-directory',
+        type=str,
+        help='path to which balancing authority output should be written for each completed year; if not given, '
+             'only the county level aggregation is run',
+        default=None
+    )
+    parser.add_argument(
+        '--is-historical',
+        type=distutils.util.strtobool,
+        help='true if working with historical data as opposed to future/SSP data',
+        default=True
+    )
+    parser.add_argument(
+        '-b',
+        '--balancing-authority-to-county',
+        type=str,
+        help='path to the CSV file mapping county FIPS code to balancing authority',
+        default=None
+    )
+    parser.add_argument(
+        '-c',
+        '--county-population-by-year',
+        type=str,
+        help='path to the CSV file containing the county populations by year',
+        default=None
+    )
+    args = parser.parse_args()
+    if (args.ba_output_directory is not None) and (
+            (args.balancing_authority_to_county is None) or (args.county_population_by_year is None)):
+        parser.error('--ba-output-directory requires -b/--balancing-authority-to-county and '
+                     '-c/--county-population-by-year')
+
+    on_year_complete = None
+    if args.ba_output_directory is not None:
+        on_year_complete = balancing_authority_trigger(
+            county_data_directory=args.output_directory,
+            is_historical=bool(args.is_historical),
+            balancing_authority_to_fips_file=args.balancing_authority_to_county,
+            county_population_by_year_file=args.county_population_by_year,
+            output_directory=args.ba_output_directory,
+            variables=args.variables,
+            precisions=args.precisions,
+        )
+    watch_wrf_files(
+        wrf_variables=args.variables,
+        precisions=args.precisions,
+        output_directory=args.output_directory,
+        poll_interval=args.poll_interval,
+        watch_directory=args.watch_directory,
+        pattern=args.pattern,
+        manifest_file=args.manifest_file,
+        state_file=args.state_file,
+        settle_seconds=args.settle_seconds,
+        on_year_complete=on_year_complete,
+        county_shapefile=args.shapefile_path,
+        weight_and_mapping_file=args.weights_file_path,
+        n_jobs=args.number_of_tasks,
+    )
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Tuple
+
+import numpy as np
+import pandas as pd
+
+# geospatial dependencies are imported where they are used so that importing this module is cheap
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from affine import Affine
+
+
+# number of sub-cells rasterized at once, which bounds the memory used by each tile to about 100 MB
+MAX_TILE_SUBCELLS = 2 ** 22
+
+# number of (cell, zone) bins counted with np.bincount per tile before counting the distinct labels instead
+MAX_BINCOUNT_BINS = 2 ** 24
+
+
+def supersampled_coverage(geometries: gpd.GeoSeries,
+                          transform: Affine,
+                          shape: Tuple[int, int],
+                          factor: int = 10,
+                          max_tile_subcells: int = MAX_TILE_SUBCELLS) -> pd.DataFrame:
+    """Approximate the fraction of each grid cell covered by each polygon by rasterizing the polygons once onto the
+    grid supersampled 'factor' times along each axis and counting the sub-cells of each polygon per cell.  This is
+    much faster than an exact polygon overlay for fine grids, with an error per cell of the order of one sub-cell
+    along the polygon boundaries;  polygons smaller than a sub-cell may not be found at all.  The polygons must not
+    overlap, as each sub-cell is labelled with a single polygon, e.g. counties.
+
+    The grid is processed in tiles of rows, so memory is bounded by 'max_tile_subcells' rather than the grid size.
+
+    :param geometries:           polygons in the coordinate system of the grid
+    :type geometries:            geopandas.GeoSeries
+
+    :param transform:            affine transform of the grid, mapping (column, row) to coordinates; rows may run
+                                 north to south, as in a GeoTIFF, or south to north, as in a WRF grid
+    :type transform:             affine.Affine
+
+    :param shape:                number of rows and columns of the grid
+    :type shape:                 Tuple[int, int]
+
+    :param factor:               number of sub-cells along each axis of a cell
+    :type factor:                int
+
+    :param max_tile_subcells:    maximum number of sub-cells to rasterize at once
+    :type max_tile_subcells:     int
+
+    :return:                     DataFrame with the 'cell_index' of each covered cell, its index in the flattened grid,
+                                 the position of the polygon in 'geometries' as 'zone', and the fraction of the cell it
+                                 covers as 'coverage'
+
+    """
+
+    from affine import Affine
+    from rasterio import features
+    from shapely.geometry import box
+
+    n_rows, n_columns = shape
+    # keep the spatial index of geometries that already have a positional index, e.g. from 'load_county_geometries'
+    if not geometries.index.equals(pd.RangeIndex(len(geometries))):
+        geometries = geometries.reset_index(drop=True)
+    tile_rows = max(1, max_tile_subcells // (n_columns * factor * factor))
+
+    frames = []
+    for row_start in range(0, n_rows, tile_rows):
+        rows = min(tile_rows, n_rows - row_start)
+        tile_transform = transform * Affine.translation(0, row_start)
+
+        # only rasterize the polygons within the tile, labelled from 1 so that 0 is outside of every polygon
+        (west, east), (south, north) = zip(tile_transform * (0, 0), tile_transform * (n_columns, rows))
+        zones = np.sort(geometries.sindex.query(box(min(west, east), min(south, north), max(west, east),
+                                                    max(south, north))))
+        if len(zones) == 0:
+            continue
+
+        labels = features.rasterize(
+            ((geometries.iloc[zone], label) for label, zone in enumerate(zones, start=1)),
+            out_shape=(rows * factor, n_columns * factor),
+            transform=tile_transform * Affine.scale(1 / factor),
+            fill=0,
+            dtype='int32',
+        )
+
+        # the cell of each sub-cell, and a key for each (cell, label) pair
+        cells = np.repeat(np.repeat(np.arange(rows * n_columns).reshape(rows, n_columns), factor, 0), factor, 1)
+        keys = cells.ravel() * (len(zones) + 1) + labels.ravel()
+
+        if rows * n_columns * (len(zones) + 1) <= MAX_BINCOUNT_BINS:
+            counts = np.bincount(keys, minlength=rows * n_columns * (len(zones) + 1))
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+
+        cell, label = np.divmod(keys, len(zones) + 1)
+        inside = label > 0
+        frames.append(pd.DataFrame({
+            'cell_index': cell[inside] + row_start * n_columns,
+            'zone': zones[label[inside] - 1],
+            'coverage': counts[inside] / factor ** 2,
+        }))
+
+    if len(frames) == 0:
+        return pd.DataFrame({'cell_index': np.array([], dtype=np.int64),
+                             'zone': np.array([], dtype=np.int64),
+                             'coverage': np.array([], dtype=np.float64)})
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def weight_error(approximate: pd.DataFrame,
+                 exact: pd.DataFrame,
+                 zone_key: str = 'FIPS',
+                 weight_key: str = 'weight') -> pd.DataFrame:
+    """Report the error of approximate weights, such as those derived from 'supersampled_coverage', against exact
+    weights from a polygon overlay, per zone.
+
+    :param approximate:          approximate weights with 'cell_index', 'zone_key', and 'weight_key' columns
+    :type approximate:           pd.DataFrame
+
+    :param exact:                exact weights with the same columns
+    :type exact:                 pd.DataFrame
+
+    :param zone_key:             name of the column identifying the zone, e.g. the county FIPS code
+    :type zone_key:              str
+
+    :param weight_key:           name of the column of weights
+    :type weight_key:            str
+
+    :return:                     DataFrame per zone of the exact and approximate total weight, the sum of the absolute
+                                 differences of the cell weights as 'absolute_error', the largest difference for a
+                                 single cell as 'max_error', and whether the approximation missed the zone entirely
+
+    """
+
+    columns = ['cell_index', zone_key, weight_key]
+    merged = exact[columns].merge(
+        approximate[columns], how='outer', on=['cell_index', zone_key], suffixes=('_exact', '_approximate')
+    ).fillna({f'{weight_key}_exact': 0., f'{weight_key}_approximate': 0.})
+    merged['error'] = (merged[f'{weight_key}_approximate'] - merged[f'{weight_key}_exact']).abs()
+
+    report = merged.groupby(zone_key).agg(
+        exact=(f'{weight_key}_exact', 'sum'),
+        approximate=(f'{weight_key}_approximate', 'sum'),
+        absolute_error=('error', 'sum'),
+        max_error=('error', 'max'),
+    ).reset_index()
+    report['missing'] = ~report[zone_key].isin(approximate[zone_key])
+
+    return report
@@ -14,7 +14,7 @@ def get_requirements():
 setup(
     name='im3components',
     version='0.1.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     url='https://github.com/IMMM-SFA/im3components',
     license='BSD 2-Clause',
     author='Chris R. Vernon',